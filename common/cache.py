@@ -0,0 +1,47 @@
+from time import time
+
+from django.core.cache import caches
+
+GENERATION_KEY = 'generation'
+
+
+def get_cache():
+    return caches['results']
+
+
+def get_generation():
+    """
+    Return the current generation of the cached results. If the counter
+    is missing (e.g., culled), start from the current time so that no
+    previous generation is reused.
+    """
+    cache = get_cache()
+    generation = int(time() * 1000)
+    cache.add(GENERATION_KEY, generation, None)
+    return cache.get(GENERATION_KEY, generation)
+
+
+def bump_generation():
+    """ Invalidate all cached results by starting a new generation. """
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, int(time() * 1000), None)
+
+
+def get_cached(name, start, end, func):
+    """
+    Return the cached result of a given endpoint and date range (days),
+    or compute and cache it if it's missing or outdated.
+    """
+    key = '{}:{}:{:%Y%m%d}:{:%Y%m%d}'.format(
+        name, get_generation(), start, end)
+    cache = get_cache()
+
+    result = cache.get(key)
+    if result is None:
+        result = func()
+        cache.set(key, result)
+
+    return result
@@ -0,0 +1,83 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .cache import bump_generation
+
+User = apps.get_model('common', 'User')
+Organization = apps.get_model('common', 'Organization')
+PrincipalInvestigator = apps.get_model('common', 'PrincipalInvestigator')
+Request = apps.get_model('request', 'Request')
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+LibraryProtocol = apps.get_model('library_sample_shared', 'LibraryProtocol')
+LibraryPreparation = apps.get_model('library_preparation',
+                                    'LibraryPreparation')
+Pool = apps.get_model('index_generator', 'Pool')
+Sequencer = apps.get_model('flowcell', 'Sequencer')
+Flowcell = apps.get_model('flowcell', 'Flowcell')
+Lane = apps.get_model('flowcell', 'Lane')
+
+# User fields shown on (or used to group) the dashboards
+USER_FIELDS = {'first_name', 'last_name', 'organization', 'pi'}
+
+
+def invalidate_results(using='default'):
+    """
+    Invalidate the dashboards once the current transaction is committed,
+    so that no concurrent request caches the results of the old data (and
+    nothing is invalidated if the transaction is rolled back).
+    """
+    transaction.on_commit(bump_generation, using=using)
+
+
+@receiver(post_save, sender=Request)
+@receiver(post_save, sender=Library)
+@receiver(post_save, sender=Sample)
+@receiver(post_save, sender=Pool)
+@receiver(post_save, sender=Lane)
+@receiver(post_save, sender=Flowcell)
+@receiver(post_save, sender=LibraryPreparation)
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=PrincipalInvestigator)
+@receiver(post_save, sender=Sequencer)
+@receiver(post_save, sender=LibraryProtocol)
+@receiver(post_delete, sender=Request)
+@receiver(post_delete, sender=Library)
+@receiver(post_delete, sender=Sample)
+@receiver(post_delete, sender=Pool)
+@receiver(post_delete, sender=Lane)
+@receiver(post_delete, sender=Flowcell)
+@receiver(post_delete, sender=LibraryPreparation)
+@receiver(post_delete, sender=Organization)
+@receiver(post_delete, sender=PrincipalInvestigator)
+@receiver(post_delete, sender=Sequencer)
+@receiver(post_delete, sender=LibraryProtocol)
+def invalidate_results_objects(sender, using, **kwargs):
+    """ When the data of the dashboards is changed, invalidate them. """
+    invalidate_results(using)
+
+
+@receiver(post_save, sender=User)
+def invalidate_results_user(sender, using, update_fields, **kwargs):
+    """
+    Invalidate the dashboards when a user's name, organization or PI may
+    have changed (e.g., not when only the last login time is updated).
+    """
+    if update_fields is None or USER_FIELDS & set(update_fields):
+        invalidate_results(using)
+
+
+@receiver(m2m_changed, sender=Request.libraries.through)
+@receiver(m2m_changed, sender=Request.samples.through)
+@receiver(m2m_changed, sender=Pool.libraries.through)
+@receiver(m2m_changed, sender=Pool.samples.through)
+@receiver(m2m_changed, sender=Flowcell.lanes.through)
+def invalidate_results_relations(sender, action, using, **kwargs):
+    """
+    When records are added to or removed from a request or a pool, or lanes
+    to or from a flowcell, invalidate the dashboards.
+    """
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        invalidate_results(using)
@@ -1,13 +1,18 @@
 import json
 import string
 import random
+from datetime import datetime
 
-from django.test import TestCase
+from django.apps import apps
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 
+from .cache import get_cache, get_cached, get_generation, bump_generation
 from .models import Organization, PrincipalInvestigator, CostUnit
+from .utils import get_random_name, QueryCounter
 
 
 User = get_user_model()
@@ -125,3 +130,121 @@ class NavigationTreeTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(tabs, ['Requests', 'Libraries & Samples'])
+
+
+# Utils
+
+class QueryCounterTest(BaseTestCase):
+    def test_count(self):
+        with QueryCounter() as counter:
+            Organization.objects.create(name=get_random_name())
+            list(Organization.objects.all())
+        self.assertEqual(counter.count, 2)
+
+    def test_no_debug_cursor(self):
+        queries_log = list(connection.queries_log)
+        with QueryCounter() as counter:
+            self.assertFalse(connection.queries_logged)
+            list(Organization.objects.all())
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(list(connection.queries_log), queries_log)
+        self.assertNotIn('make_cursor', connection.__dict__)
+
+    def test_nested(self):
+        with self.assertNumQueries(3), QueryCounter() as outer:
+            list(Organization.objects.all())
+            with QueryCounter() as inner:
+                list(Organization.objects.all())
+            list(Organization.objects.all())
+        self.assertEqual((outer.count, inner.count), (3, 1))
+
+    def test_requests(self):
+        self.create_user()
+        self.login()
+        with QueryCounter() as counter:
+            self.client.get(reverse('index'))
+            count = counter.count
+            self.client.get(reverse('index'))
+        self.assertGreater(count, 0)
+        self.assertEqual(counter.count, 2 * count)
+
+
+# Cache
+
+class ResultsCacheTest(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(
+            email='test@test.io', password='foo-bar')
+        self.start = datetime(2020, 1, 1)
+        self.end = datetime(2020, 1, 31)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return {'count': self.calls}
+
+    def test_cached(self):
+        first = get_cached('test', self.start, self.end, self.compute)
+        second = get_cached('test', self.start, self.end, self.compute)
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+
+        # Different date ranges are cached separately
+        get_cached('test', self.start, self.start, self.compute)
+        self.assertEqual(self.calls, 2)
+
+    def test_invalidated(self):
+        get_cached('test', self.start, self.end, self.compute)
+        Request = apps.get_model('request', 'Request')
+        Request(user=self.user, description=get_random_name()).save()
+
+        result = get_cached('test', self.start, self.end, self.compute)
+        self.assertEqual(result, {'count': 2})
+
+    def test_invalidated_on_commit(self):
+        get_cached('test', self.start, self.end, self.compute)
+        Request = apps.get_model('request', 'Request')
+
+        with transaction.atomic():
+            Request(user=self.user, description=get_random_name()).save()
+            result = get_cached('test', self.start, self.end, self.compute)
+            self.assertEqual(result, {'count': 1})
+
+        result = get_cached('test', self.start, self.end, self.compute)
+        self.assertEqual(result, {'count': 2})
+
+    def test_not_invalidated_on_rollback(self):
+        generation = get_generation()
+        try:
+            with transaction.atomic():
+                Organization(name=get_random_name()).save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_generation(), generation)
+
+    def test_invalidated_by_renames(self):
+        organization = Organization.objects.create(name=get_random_name())
+        generation = get_generation()
+
+        organization.name = get_random_name()
+        organization.save()
+        self.assertEqual(get_generation(), generation + 1)
+
+    def test_invalidated_by_user_organization(self):
+        generation = get_generation()
+
+        # Logging in only updates the last login time
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(get_generation(), generation)
+
+        self.user.organization = Organization.objects.create(
+            name=get_random_name())
+        self.user.save(update_fields=['organization'])
+        self.assertEqual(get_generation(), generation + 2)
+
+    def test_bump_generation(self):
+        generation = get_generation()
+        bump_generation()
+        self.assertEqual(get_generation(), generation + 1)
@@ -4,7 +4,8 @@ import random
 from time import time
 from datetime import datetime
 
-from django.db import connection
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.utils import CursorWrapper
 
 
 def timeit(func):
@@ -50,6 +51,88 @@ def print_sql_queries(func):
     return wrapper
 
 
+class CountingCursorWrapper(CursorWrapper):
+    """ Cursor wrapper counting the executed queries of a `QueryCounter`. """
+
+    def __init__(self, cursor, db, counter):
+        super().__init__(cursor, db)
+        self.counter = counter
+
+    def execute(self, sql, params=None):
+        self.counter.count += 1
+        return super().execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter.count += 1
+        return super().executemany(sql, param_list)
+
+
+class QueryCounter:
+    """
+    Context manager counting the database queries executed within it.
+
+    The cursors of the connection are wrapped while counting, so queries
+    are neither logged nor kept in memory (unlike with a debug cursor).
+    """
+    CURSOR_FACTORIES = ['make_cursor', 'make_debug_cursor']
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.count = 0
+        self.connection = connections[using]
+        self._factories = {}
+
+    def __enter__(self):
+        for name in self.CURSOR_FACTORIES:
+            self._factories[name] = self.connection.__dict__.get(name)
+            setattr(self.connection, name,
+                    self.get_cursor_factory(getattr(self.connection, name)))
+        return self
+
+    def __exit__(self, *args):
+        for name, factory in self._factories.items():
+            if factory is None:
+                delattr(self.connection, name)
+            else:
+                setattr(self.connection, name, factory)
+
+    def get_cursor_factory(self, make_cursor):
+        def factory(cursor):
+            return CountingCursorWrapper(
+                make_cursor(cursor), self.connection, self)
+        return factory
+
+
+class Echo:
+    """ A file-like object which returns what is written to it. """
+
+    def write(self, value):
+        return value
+
+
+class StreamBuffer:
+    """
+    A write-only file-like object whose content is taken out chunk by
+    chunk with `pop()`, to stream what a writer (e.g., a `ZipFile`) writes
+    to it.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, value):
+        self.chunks.append(bytes(value))
+        return len(value)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """ Return and forget the content written since the last call. """
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
 def get_date_range(start, end, format):
     now = datetime.now()
 
@@ -59,7 +142,7 @@ def get_date_range(start, end, format):
     except ValueError:
         start = now
     finally:
-        start = start.replace(hour=0, minute=0)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
 
     try:
         end = datetime.strptime(end, format) \
@@ -67,9 +150,9 @@ def get_date_range(start, end, format):
     except ValueError:
         end = now
     finally:
-        end = end.replace(hour=23, minute=59)
+        end = end.replace(hour=23, minute=59, second=59, microsecond=0)
 
     if start > end:
-        start = end.replace(hour=0, minute=0)
+        start = end.replace(hour=0, minute=0, second=0)
 
     return (start, end)
@@ -0,0 +1,315 @@
+import re
+import heapq
+import itertools
+import unicodedata
+from collections import namedtuple
+
+from django.apps import apps
+from django.db.models import Q, F, OuterRef, Subquery
+from django.db.models.functions import Substr
+from django.utils import timezone
+
+IndexI7 = apps.get_model('library_sample_shared', 'IndexI7')
+IndexI5 = apps.get_model('library_sample_shared', 'IndexI5')
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+Request = apps.get_model('request', 'Request')
+
+# Sequencers demultiplexed with BCL Convert (Sample Sheet v2)
+BCLCONVERT_SEQUENCERS = ['NextSeq 1000', 'NextSeq 2000', 'NovaSeq X']
+
+ADAPTER = 'CTGTCTCTTATACACATCT'
+
+Record = namedtuple('Record', [
+    'lane',
+    'barcode',
+    'name',
+    'index_i7_id',
+    'index_i7',
+    'index_i5_id',
+    'index_i5',
+    'request_name',
+    'library_protocol',
+    'read_length',
+])
+
+
+def to_ascii(value):
+    """ Strip the accents and other non-ASCII characters of a string. """
+    value = unicodedata.normalize('NFKD', value or '')
+    return str(value.encode('ASCII', 'ignore'), 'utf-8')
+
+
+def get_index_ids(model, index_type_ids):
+    """
+    Return the index IDs of given index types by (index type, sequence).
+    If several indices of an index type share a sequence, the first one
+    is used.
+    """
+    index_ids = {}
+    for index_type_id, index, prefix, number in model.objects.filter(
+        index_type__in=index_type_ids,
+    ).values_list('index_type', 'index', 'prefix', 'number').order_by('pk'):
+        index_ids.setdefault((index_type_id, index), f'{prefix}{number}')
+    return index_ids
+
+
+def parse_read_length(name):
+    """
+    Return the cycles of each read of a read length, e.g., 2x75 or 75.
+    Names without cycles (e.g., 'Other') have no reads, so they don't
+    change the [Reads] of a sample sheet.
+    """
+    match = re.match(r'^\s*(?:(\d+)\s*x\s*)?(\d+)', name or '')
+    if match is None:
+        return []
+    return [int(match.group(2))] * int(match.group(1) or 1)
+
+
+class SampleSheet:
+    """
+    Libraries and samples of the selected lanes of a flowcell, ordered by
+    lane and barcode, with everything the sample sheet writers need.
+
+    The records are kept in memory, since the header of a sample sheet
+    (read and index cycles) depends on all of them. A flowcell holds a
+    few thousand records at most.
+    """
+
+    def __init__(self, flowcell_id, sequencer, date, records):
+        self.flowcell_id = flowcell_id
+        self.sequencer = sequencer
+        self.date = date
+        self.records = records
+
+    @classmethod
+    def load(cls, flowcell, lane_ids):
+        """
+        Load the records of given lanes of a flowcell with one query per
+        record type and one per index group. A record belonging to several
+        requests is listed (once) with the first one.
+        """
+        querysets = [
+            model.objects.filter(
+                ~Q(status=-1), pool__lane__pk__in=lane_ids,
+            ).annotate(
+                lane_name=F('pool__lane__name'),
+                request_name=Subquery(Request.objects.filter(**{
+                    field: OuterRef('pk'),
+                }).order_by('pk').values('name')[:1]),
+                barcode_number=Substr('barcode', 4),
+            ).values(
+                'lane_name',
+                'barcode_number',
+                'barcode',
+                'name',
+                'index_type',
+                'index_i7',
+                'index_i5',
+                'request_name',
+                'library_protocol__name',
+                'read_length__name',
+            ).order_by('lane_name', 'barcode_number')
+            for field, model in [('libraries', Library), ('samples', Sample)]
+        ]
+        records = list(heapq.merge(
+            *querysets,
+            key=lambda x: (x['lane_name'], x['barcode_number']),
+        ))
+
+        index_type_ids = {x['index_type'] for x in records}
+        index_i7_ids = get_index_ids(IndexI7, index_type_ids)
+        index_i5_ids = get_index_ids(IndexI5, index_type_ids)
+
+        return cls(
+            flowcell.flowcell_id,
+            flowcell.sequencer.name,
+            timezone.localtime(flowcell.create_time).date(),
+            [
+                Record(
+                    lane=x['lane_name'].split()[1],
+                    barcode=x['barcode'],
+                    name=x['name'],
+                    index_i7_id=index_i7_ids.get(
+                        (x['index_type'], x['index_i7']), ''),
+                    index_i7=x['index_i7'] or '',
+                    index_i5_id=index_i5_ids.get(
+                        (x['index_type'], x['index_i5']), ''),
+                    index_i5=x['index_i5'] or '',
+                    request_name=to_ascii(x['request_name']),
+                    library_protocol=to_ascii(x['library_protocol__name']),
+                    read_length=x['read_length__name'],
+                )
+                for x in records
+            ],
+        )
+
+    @property
+    def lanes(self):
+        return sorted({x.lane for x in self.records})
+
+    @property
+    def reads(self):
+        """ Return the cycles of each read (the longest read length). """
+        reads = [parse_read_length(x.read_length) for x in self.records]
+        num_reads = max([len(x) for x in reads], default=0)
+        cycles = max([x[0] for x in reads if x], default=0)
+        return [cycles] * num_reads
+
+    @property
+    def index_cycles(self):
+        """ Return the cycles of the I7 and I5 index reads. """
+        return (
+            max([len(x.index_i7) for x in self.records], default=0),
+            max([len(x.index_i5) for x in self.records], default=0),
+        )
+
+    def split(self):
+        """ Return a sample sheet per lane. """
+        return [
+            type(self)(
+                self.flowcell_id, self.sequencer, self.date, list(records))
+            for _, records in itertools.groupby(
+                self.records, key=lambda x: x.lane)
+        ]
+
+
+class SampleSheetWriter:
+    """ Base class of the sample sheet formats. """
+    version = None
+
+    def __init__(self, sample_sheet):
+        self.sample_sheet = sample_sheet
+
+    def get_filename(self):
+        lanes = self.sample_sheet.lanes
+        suffix = f'_L{lanes[0]}' if len(lanes) == 1 else ''
+        return f'{self.sample_sheet.flowcell_id}{suffix}_SampleSheet.csv'
+
+    def get_rows(self):
+        """ Generate the rows of the sample sheet. """
+        raise NotImplementedError
+
+
+class IEMWriter(SampleSheetWriter):
+    """ Sample Sheet v1 (Illumina Experiment Manager, bcl2fastq). """
+    version = 'v1'
+    num_columns = 11
+
+    def get_rows(self):
+        sample_sheet = self.sample_sheet
+        rows = [
+            ['[Header]'],
+            ['IEMFileVersion', '4'],
+            ['Date', sample_sheet.date.strftime('%m/%d/%Y')],
+            ['Workflow', 'GenerateFASTQ'],
+            ['Application', 'HiSeq FASTQ Only'],
+            ['Assay', 'Nextera XT'],
+            ['Description'],
+            ['Chemistry', 'Amplicon'],
+            [],
+            ['[Reads]'],
+            *[[str(x)] for x in sample_sheet.reads],
+            [],
+            ['[Settings]'],
+            ['ReverseComplement', '0'],
+            ['Adapter', ADAPTER],
+            [],
+            ['[Data]'],
+            [
+                'Lane',
+                'Sample_ID',
+                'Sample_Name',
+                'Sample_Plate',
+                'Sample_Well',
+                'I7_Index_ID',
+                'index',
+                'I5_Index_ID',
+                'index2',
+                'Sample_Project',
+                'Description',
+            ],
+        ]
+
+        for row in rows:
+            yield row + [''] * (self.num_columns - len(row))
+
+        for record in sample_sheet.records:
+            yield [
+                record.lane,              # Lane
+                record.barcode,           # Sample_ID
+                record.name,              # Sample_Name
+                '',                       # Sample_Plate
+                '',                       # Sample_Well
+                record.index_i7_id,       # I7_Index_ID
+                record.index_i7,          # index
+                record.index_i5_id,       # I5_Index_ID
+                record.index_i5,          # index2
+                record.request_name,      # Sample_Project / Request ID
+                record.library_protocol,  # Description / Library Protocol
+            ]
+
+
+class BCLConvertWriter(SampleSheetWriter):
+    """ Sample Sheet v2 (BCL Convert). """
+    version = 'v2'
+
+    def get_rows(self):
+        sample_sheet = self.sample_sheet
+        reads = sample_sheet.reads
+        index1_cycles, index2_cycles = sample_sheet.index_cycles
+
+        yield ['[Header]']
+        yield ['FileFormatVersion', '2']
+        yield ['RunName', sample_sheet.flowcell_id]
+        yield ['InstrumentPlatform', sample_sheet.sequencer]
+        yield []
+
+        yield ['[Reads]']
+        for i, cycles in enumerate(reads[:2]):
+            yield [f'Read{i + 1}Cycles', str(cycles)]
+        if index1_cycles:
+            yield ['Index1Cycles', str(index1_cycles)]
+        if index2_cycles:
+            yield ['Index2Cycles', str(index2_cycles)]
+        yield []
+
+        yield ['[BCLConvert_Settings]']
+        yield ['AdapterRead1', ADAPTER]
+        if len(reads) > 1:
+            yield ['AdapterRead2', ADAPTER]
+        yield []
+
+        # The Index2 column is only allowed if there are I5 indices
+        yield ['[BCLConvert_Data]']
+        if index2_cycles:
+            yield ['Lane', 'Sample_ID', 'Index', 'Index2', 'Sample_Project']
+        else:
+            yield ['Lane', 'Sample_ID', 'Index', 'Sample_Project']
+        for record in sample_sheet.records:
+            yield [
+                record.lane,
+                record.barcode,
+                record.index_i7,
+                *([record.index_i5] if index2_cycles else []),
+                record.request_name,
+            ]
+
+
+WRITERS = {x.version: x for x in [IEMWriter, BCLConvertWriter]}
+
+
+def get_writer_class(sequencer, version=None):
+    """
+    Return the sample sheet writer of a given version, or the one of the
+    sequencer if the version is not given.
+    """
+    if not version:
+        version = 'v2' if any(
+            sequencer.startswith(x) for x in BCLCONVERT_SEQUENCERS
+        ) else 'v1'
+
+    try:
+        return WRITERS[version]
+    except KeyError:
+        raise ValueError('Invalid sample sheet version.')
@@ -1,5 +1,4 @@
 import itertools
-from pprint import pprint
 from django.apps import apps
 from django.db.models import Q
 
@@ -60,106 +59,69 @@ class LaneSerializer(ModelSerializer):
         model = Lane
         fields = ('pk', 'name', 'pool', 'pool_name', 'read_length_name',
                   'index_i7_show', 'index_i5_show', 'equal_representation',
-                  'loading_concentration', 'phix', 'quality_check','request','protocol')
+                  'loading_concentration', 'phix', 'quality_check', 'request',
+                  'protocol',)
         extra_kwargs = {
             'name': {'required': False},
             'pool': {'required': False},
         }
 
-    def get_request(self,obj):
+    def get_request(self, obj):
+        return self._join(self.get_summary(obj)['requests'])
 
-        requests = []
-        records = obj.pool.libraries.all() or obj.pool.samples.all()
-
-        for record in records:
-            for req in record.request.all():
-                requests.append(req.name)
-        if len(requests) == 1 or len(set(requests)) == 1:
-            return requests[0]
-        else:
-            return ";".join(requests)
-
-    def get_protocol(self,obj):
-
-        protocols = []
-
-        records = obj.pool.libraries.all() or obj.pool.samples.all()
-
-        for record in records:
-            protocols.append(record.library_protocol.name)
-
-        if len(protocols) == 1 or len(set(protocols)) == 1:
-            return protocols[0]
-        else:
-            return ";".join(protocols)
+    def get_protocol(self, obj):
+        return self._join(self.get_summary(obj)['protocols'])
 
     def get_pool_name(self, obj):
-
         return obj.pool.name
 
     def get_read_length_name(self, obj):
-        read_lengths = []
-        i = 0
-        records = obj.pool.libraries.all() or obj.pool.samples.all()
-        for record in records:
-            print(record.library_protocol.name)
-            read_lengths.append(str(record.read_length.name))
-
-        if len(read_lengths) == 1 or len(set(read_lengths)) == 1:
-            return read_lengths[0]
-        else:
-            return ";".join(read_lengths)
-
-
+        return self._join(self.get_summary(obj)['read_lengths'])
 
     def get_index_i7_show(self, obj):
-        '''we show the actual index instead of a yes/no entry'''
-        records = obj.pool.libraries.all() or obj.pool.samples.all()
-        idx = []
-        contains_i7 = False
-        for record in records:
-            if str(record.index_i7) != "":
-                contains_i7 = True
-                break
-                #idx.append(str(record.index_i7))
-
-        #if len(idx) == 1 or len(set(idx)) == 1:
-        #    return idx[0]
-        #else:
-        #    return ";".join(idx)
-        if contains_i7:
-            return "Yes"
-        else:
-            return ""
-
+        return 'Yes' if self.get_summary(obj)['index_i7'] else ''
 
     def get_index_i5_show(self, obj):
-        '''we show the actual index instead of a yes/no entry'''
-
-        records = obj.pool.libraries.all() or obj.pool.samples.all()
-        idx = []
-        contains_i5 = False
-        for record in records:
-            if str(record.index_i5) != "":
-                contains_i5 = True
-                break
-                #idx.append(str(record.index_i5))
-
-        #if len(idx) == 1 or len(set(idx)) == 1:
-        #    return idx[0]
-        #else:
-        #    return ";".join(idx)
-        if contains_i5:
-            return "Yes"
-        else:
-            return ""
-         #return None
+        return 'Yes' if self.get_summary(obj)['index_i5'] else ''
 
     def get_equal_representation(self, obj):
-        records = list(itertools.chain(
-            obj.pool.libraries.all(), obj.pool.samples.all()))
-        ern = [x.equal_representation_nucleotides for x in records].count(True)
-        return len(records) == ern
+        return self.get_summary(obj)['equal_representation']
+
+    @staticmethod
+    def get_summary(obj):
+        """
+        Return the requests, protocols, read lengths and indices of a lane's
+        records (its pool's libraries, or samples if there are none). They
+        are computed once per lane from the prefetched records.
+        """
+        if not hasattr(obj, '_summary'):
+            libraries = list(obj.pool.libraries.all())
+            samples = list(obj.pool.samples.all())
+            records = libraries or samples
+
+            obj._summary = {
+                'requests': [
+                    req.name for record in records
+                    for req in record.request.all()
+                ],
+                'protocols': [x.library_protocol.name for x in records],
+                'read_lengths': [str(x.read_length.name) for x in records],
+                'index_i7': any(str(x.index_i7) != '' for x in records),
+                'index_i5': any(str(x.index_i5) != '' for x in records),
+                'equal_representation': all(
+                    x.equal_representation_nucleotides
+                    for x in libraries + samples
+                ),
+            }
+
+        return obj._summary
+
+    @staticmethod
+    def _join(values):
+        """ Return the value if all values are the same, else join them. """
+        if len(set(values)) == 1:
+            return values[0]
+        return ';'.join(values)
 
 
 class FlowcellListSerializer(ModelSerializer):
@@ -173,7 +135,6 @@ class FlowcellListSerializer(ModelSerializer):
                   'create_time', 'lanes',)
 
     def get_flowcell(self, obj):
-        pprint(vars(obj))
         return obj.pk
 
     def get_sequencer_name(self, obj):
@@ -1,13 +1,20 @@
+import io
+import csv
 import json
+import zipfile
 
 from django.core.urlresolvers import reverse
 
-from common.utils import get_random_name
+from common.utils import get_random_name, QueryCounter
 from common.tests import BaseTestCase
 from library.tests import create_library
 from sample.tests import create_sample
 from index_generator.tests import create_pool
+from library_sample_shared.tests import create_index_type
+from library_sample_shared.models import IndexI7, ReadLength
+from request.tests import create_request
 from .models import Sequencer, Lane, Flowcell
+from .sample_sheets import SampleSheet, parse_read_length
 
 
 def create_sequencer(name, lanes=8, lane_capacity=200):
@@ -205,6 +212,40 @@ class TestFlowcell(BaseTestCase):
         self.assertNotIn(lanes2[0], lane_ids)
         self.assertNotIn(lanes2[1], lane_ids)
 
+    def test_flowcell_list_queries(self):
+        """ Ensure the number of queries doesn't depend on the records. """
+        self.client.login(email='test@test.io', password='foo-bar')
+        sequencer = create_sequencer(get_random_name())
+
+        def add_flowcell(num_records):
+            libraries = [
+                create_library(get_random_name(), 4)
+                for _ in range(num_records)
+            ]
+            request = create_request(self.user)
+            request.libraries.add(*libraries)
+
+            pool = create_pool(self.user)
+            pool.libraries.add(*libraries)
+
+            flowcell = create_flowcell(get_random_name(), sequencer)
+            flowcell.lanes.add(create_lane('Lane 1', pool))
+            return request
+
+        def count_queries():
+            with QueryCounter() as counter:
+                response = self.client.get(reverse('flowcells-list'))
+            self.assertEqual(response.status_code, 200)
+            return counter.count, response.json()
+
+        request = add_flowcell(1)
+        num_queries, data = count_queries()
+        self.assertEqual(data[0]['request'], request.name)
+        self.assertEqual(data[0]['read_length_name'], 'Read Length')
+
+        add_flowcell(3)
+        self.assertEqual(count_queries()[0], num_queries)
+
     def test_create_flowcell(self):
         """ Ensure create flowcell behaves correctly. """
         self.client.login(email='test@test.io', password='foo-bar')
@@ -404,3 +445,169 @@ class TestFlowcell(BaseTestCase):
         self.assertEqual(response.status_code, 400)
         self.assertFalse(data['success'])
         self.assertIn('Invalid payload.', data['message'])
+
+
+class TestSampleSheet(BaseTestCase):
+    """ Tests for sample sheets. """
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.login(email='test@test.io', password='foo-bar')
+
+        index_type = create_index_type(get_random_name(), is_dual=True)
+        index_i7 = IndexI7(prefix='A', number='01', index='GTAAATGC')
+        index_i7.save()
+        index_type.indices_i7.add(index_i7)
+
+        read_length = ReadLength(name='2x75')
+        read_length.save()
+
+        self.library1 = create_library(
+            get_random_name(), index_type=index_type, read_length=read_length)
+        self.library1.index_i7 = 'GTAAATGC'
+        self.library1.index_i5 = 'TTAC'
+        self.library1.save()
+        library2 = create_library(get_random_name(), status=-1)
+        self.sample = create_sample(get_random_name())
+
+        self.request = create_request(self.user)
+        self.request.libraries.add(self.library1, library2)
+        self.request.samples.add(self.sample)
+
+        pool1 = create_pool(self.user)
+        pool1.libraries.add(self.library1, library2)
+        pool1.samples.add(self.sample)
+        pool2 = create_pool(self.user)
+        pool2.samples.add(self.sample)
+        self.sample.refresh_from_db()  # pooled samples' barcodes are updated
+
+        self.lane1 = create_lane('Lane 1', pool1)
+        self.lane2 = create_lane('Lane 2', pool2)
+
+    def load_flowcell(self, sequencer_name):
+        sequencer = create_sequencer(sequencer_name)
+        self.flowcell = create_flowcell(get_random_name(), sequencer)
+        self.flowcell.lanes.add(self.lane1, self.lane2)
+
+    def download(self, **data):
+        return self.client.post(reverse('flowcells-download-sample-sheet'), {
+            'flowcell_id': self.flowcell.pk,
+            'ids': json.dumps([self.lane2.pk, self.lane1.pk]),
+            **data
+        })
+
+    def test_sample_sheet_v1(self):
+        self.load_flowcell('HiSeq3000')
+        with QueryCounter() as counter:
+            response = self.download()
+            content = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(counter.count, 10)
+
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertIn(['75'] + [''] * 10, rows)
+        data = rows[rows.index(['[Data]'] + [''] * 10) + 2:]
+        self.assertEqual([(x[0], x[1]) for x in data], [
+            ('1', self.library1.barcode),
+            ('1', self.sample.barcode),
+            ('2', self.sample.barcode),
+        ])
+        self.assertEqual(data[0][5:7], ['A01', 'GTAAATGC'])
+        self.assertEqual(data[0][9], self.request.name)
+
+    def test_sample_sheet_v2(self):
+        self.load_flowcell('NovaSeq X Plus')
+        response = self.download()
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(['FileFormatVersion', '2'], rows)
+        self.assertIn(['Read2Cycles', '75'], rows)
+        self.assertIn(['Index1Cycles', '8'], rows)
+        self.assertIn(['Index2Cycles', '4'], rows)
+        data = rows[rows.index(['[BCLConvert_Data]']) + 2:]
+        self.assertEqual(data[0], [
+            '1', self.library1.barcode, 'GTAAATGC', 'TTAC',
+            self.request.name,
+        ])
+        self.assertEqual(len(data), 3)
+
+    def test_sample_sheet_v2_single_index(self):
+        self.library1.index_i5 = ''
+        self.library1.save()
+        self.load_flowcell('NovaSeq X Plus')
+        response = self.download()
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+
+        self.assertNotIn('Index2Cycles', [x[0] for x in rows if x])
+        data = rows[rows.index(['[BCLConvert_Data]']) + 1:]
+        self.assertEqual(
+            data[0], ['Lane', 'Sample_ID', 'Index', 'Sample_Project'])
+        self.assertEqual(data[1], [
+            '1', self.library1.barcode, 'GTAAATGC', self.request.name,
+        ])
+
+    def test_parse_read_length(self):
+        self.assertEqual(parse_read_length('2x75'), [75, 75])
+        self.assertEqual(parse_read_length('2 x 150'), [150, 150])
+        self.assertEqual(parse_read_length('1x50'), [50])
+        self.assertEqual(parse_read_length('75'), [75])
+
+        # Names without cycles have no reads
+        self.assertEqual(parse_read_length('Other'), [])
+        self.assertEqual(parse_read_length('x75'), [])
+        self.assertEqual(parse_read_length(''), [])
+        self.assertEqual(parse_read_length(None), [])
+
+    def test_unknown_read_length(self):
+        self.load_flowcell('NovaSeq X Plus')
+        sample_sheet = SampleSheet.load(
+            self.flowcell, [self.lane1.pk, self.lane2.pk])
+
+        # The sample's read length ('Read Length') is ignored
+        self.assertEqual(
+            [x.read_length for x in sample_sheet.records],
+            ['2x75', 'Read Length', 'Read Length'],
+        )
+        self.assertEqual(sample_sheet.reads, [75, 75])
+
+    def test_record_in_several_requests(self):
+        create_request(self.user).libraries.add(self.library1)
+        self.load_flowcell('NovaSeq X Plus')
+        response = self.download()
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+
+        data = rows[rows.index(['[BCLConvert_Data]']) + 2:]
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0][1], self.library1.barcode)
+        self.assertEqual(data[0][4], self.request.name)
+
+    def test_sample_sheet_split(self):
+        self.load_flowcell('HiSeq3000')
+        response = self.download(version='v2', split='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        # The archive is streamed lane by lane
+        chunks = [x for x in response.streaming_content if x]
+        self.assertGreater(len(chunks), 1)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        f_id = self.flowcell.flowcell_id
+        self.assertEqual(sorted(archive.namelist()), [
+            f'{f_id}_L1_SampleSheet.csv',
+            f'{f_id}_L2_SampleSheet.csv',
+        ])
+        lane2 = archive.read(f'{f_id}_L2_SampleSheet.csv').decode('utf-8')
+        self.assertIn('[BCLConvert_Data]', lane2)
+        self.assertNotIn(self.library1.barcode, lane2)
+
+    def test_invalid_version(self):
+        self.load_flowcell('HiSeq3000')
+        response = self.download(version='v3')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
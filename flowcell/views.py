@@ -1,13 +1,14 @@
+import io
 import csv
 import json
+import zipfile
 import logging
-import unicodedata
 import itertools
 import datetime
 
 from django.apps import apps
 from django.db.models import Prefetch, Q, F
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
 from rest_framework import viewsets
@@ -19,8 +20,10 @@ from xlwt import Workbook, XFStyle
 
 from common.views import CsrfExemptSessionAuthentication
 from common.mixins import MultiEditMixin
+from common.utils import Echo, StreamBuffer
 
 from .models import Sequencer, Lane, Flowcell
+from .sample_sheets import SampleSheet, get_writer_class
 from .serializers import (
     SequencerSerializer,
     FlowcellSerializer,
@@ -32,8 +35,7 @@ from .serializers import (
 from django.conf import settings
 
 ReadLength = apps.get_model('library_sample_shared', 'ReadLength')
-IndexI7 = apps.get_model('library_sample_shared', 'IndexI7')
-IndexI5 = apps.get_model('library_sample_shared', 'IndexI5')
+Request = apps.get_model('request', 'Request')
 Library = apps.get_model('library', 'Library')
 Sample = apps.get_model('sample', 'Sample')
 Pool = apps.get_model('index_generator', 'Pool')
@@ -97,15 +99,27 @@ class FlowcellViewSet(MultiEditMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = LaneSerializer
 
     def get_queryset(self):
+        request_qs = Request.objects.only('name')
+
         libraries_qs = Library.objects.filter(
-            ~Q(status=-1)).select_related('read_length', 'index_type').only(
-                'read_length', 'index_type',
-                'equal_representation_nucleotides')
+            ~Q(status=-1)).select_related(
+                'read_length', 'library_protocol',
+            ).prefetch_related(
+                Prefetch('request', queryset=request_qs),
+            ).only(
+                'read_length__name', 'library_protocol__name', 'index_i7',
+                'index_i5', 'equal_representation_nucleotides',
+            )
 
         samples_qs = Sample.objects.filter(
-            ~Q(status=-1)).select_related('read_length', 'index_type').only(
-                'read_length', 'index_type',
-                'equal_representation_nucleotides')
+            ~Q(status=-1)).select_related(
+                'read_length', 'library_protocol',
+            ).prefetch_related(
+                Prefetch('request', queryset=request_qs),
+            ).only(
+                'read_length__name', 'library_protocol__name', 'index_i7',
+                'index_i5', 'equal_representation_nucleotides',
+            )
 
         lanes_qs = Lane.objects.filter(completed=False).select_related(
             'pool',
@@ -260,107 +274,69 @@ class FlowcellViewSet(MultiEditMixin, viewsets.ReadOnlyModelViewSet):
     @action(methods=['post'], detail=False,
             authentication_classes=[CsrfExemptSessionAuthentication])
     def download_sample_sheet(self, request):
-        """ Generate Benchtop Protocol as XLS file for selected lanes. """
-
-        def create_row(lane, record):
-            index_i7 = IndexI7.objects.filter(
-                index=record.index_i7,
-                index_type=record.index_type
-            )
-            index_i7_id = index_i7[0].index_id if index_i7 else ''
-
-            index_i5 = IndexI5.objects.filter(
-                index=record.index_i5,
-                index_type=record.index_type
-            )
-            index_i5_id = index_i5[0].index_id if index_i5 else ''
-
-            request_name = unicodedata.normalize(
-                'NFKD', record.request.get().name)
-            request_name = str(request_name.encode('ASCII', 'ignore'), 'utf-8')
-
-            library_protocol = unicodedata.normalize(
-                'NFKD', record.library_protocol.name)
-            library_protocol = str(
-                library_protocol.encode('ASCII', 'ignore'), 'utf-8')
-
-            return [
-                lane.name.split()[1],  # Lane
-                record.barcode,        # Sample_ID
-                record.name,           # Sample_Name
-                '',                    # Sample_Plate
-                '',                    # Sample_Well
-                index_i7_id,           # I7_Index_ID
-                record.index_i7,       # index
-                index_i5_id,           # I5_Index_ID
-                record.index_i5,       # index2
-                request_name,          # Sample_Project / Request ID
-                library_protocol,      # Description / Library Protocol
-            ]
-
-        response = HttpResponse(content_type='text/csv')
+        """
+        Generate Sample Sheet as CSV file for selected lanes. The version
+        (v1, v2) defaults to the one of the flowcell's sequencer. If `split`
+        is set, return a ZIP archive with a sample sheet per lane. Both are
+        streamed row by row; the records of the lanes are loaded at once.
+        """
         ids = json.loads(request.data.get('ids', '[]'))
         flowcell_id = request.data.get('flowcell_id', '')
+        version = request.data.get('version', '')
+        split = request.data.get('split', 'false') == 'true'
 
-        writer = csv.writer(response)
-
-        writer.writerow(['[Header]'] + [''] * 10)
-        writer.writerow(['IEMFileVersion', '4'] + [''] * 9)
-        writer.writerow(['Date', '11/3/2016'] + [''] * 9)
-        writer.writerow(['Workflow', 'GenerateFASTQ'] + [''] * 9)
-        writer.writerow(['Application', 'HiSeq FASTQ Only'] + ['' * 9])
-        writer.writerow(['Assay', 'Nextera XT'] + [''] * 9)
-        writer.writerow(['Description'] + [''] * 10)
-        writer.writerow(['Chemistry', 'Amplicon'] + [''] * 9)
-        writer.writerow([''] * 11)
-        writer.writerow(['[Reads]'] + [''] * 10)
-        writer.writerow(['75'] + [''] * 10)
-        writer.writerow(['75'] + [''] * 10)
-        writer.writerow([''] * 11)
-        writer.writerow(['[Settings]'] + [''] * 10)
-        writer.writerow(['ReverseComplement', '0'] + [''] * 9)
-        writer.writerow(['Adapter', 'CTGTCTCTTATACACATCT'] + [''] * 9)
-        writer.writerow([''] * 11)
-        writer.writerow(['[Data]'] + [''] * 10)
-
-        writer.writerow([
-            'Lane',
-            'Sample_ID',
-            'Sample_Name',
-            'Sample_Plate',
-            'Sample_Well',
-            'I7_Index_ID',
-            'index',
-            'I5_Index_ID',
-            'index2',
-            'Sample_Project',
-            'Description',
-        ])
-
-        flowcell = Flowcell.objects.get(pk=flowcell_id)
-        f_name = '%s_SampleSheet.csv' % flowcell.flowcell_id
-        response['Content-Disposition'] = 'attachment; filename="%s"' % f_name
+        flowcell = Flowcell.objects.select_related('sequencer').get(
+            pk=flowcell_id)
 
-        lanes = Lane.objects.filter(pk__in=ids).order_by('name')
+        try:
+            writer_class = get_writer_class(flowcell.sequencer.name, version)
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, 400)
 
-        rows = []
-        for lane in lanes:
-            records = list(itertools.chain(
-                lane.pool.libraries.all().filter(~Q(status=-1)),
-                lane.pool.samples.all().filter(~Q(status=-1))
-            ))
+        sample_sheet = SampleSheet.load(flowcell, ids)
 
-            for record in records:
-                row = create_row(lane, record)
-                rows.append(row)
+        if split:
+            response = StreamingHttpResponse(
+                stream_sample_sheets(sample_sheet, writer_class),
+                content_type='application/zip',
+            )
+            f_name = '%s_SampleSheets.zip' % flowcell.flowcell_id
 
-        rows = sorted(rows, key=lambda x: (x[0], x[1][3:]))
-        for row in rows:
-            writer.writerow(row)
+        else:
+            csv_writer = csv.writer(Echo())
+            response = StreamingHttpResponse(
+                (csv_writer.writerow(row)
+                 for row in writer_class(sample_sheet).get_rows()),
+                content_type='text/csv',
+            )
+            f_name = '%s_SampleSheet.csv' % flowcell.flowcell_id
 
+        response['Content-Disposition'] = 'attachment; filename="%s"' % f_name
         return response
 
 
+def stream_sample_sheets(sample_sheet, writer_class):
+    """
+    Generate the chunks of a ZIP archive with a sample sheet per lane,
+    compressed as the rows are written.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for lane_sample_sheet in sample_sheet.split():
+            writer = writer_class(lane_sample_sheet)
+            with io.TextIOWrapper(
+                archive.open(writer.get_filename(), 'w'),
+                encoding='utf-8',
+                newline='',
+            ) as f:
+                csv_writer = csv.writer(f)
+                for row in writer.get_rows():
+                    csv_writer.writerow(row)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
 class FlowcellAnalysisViewSet(viewsets.ViewSet):
     permission_classes = [IsAdminUser]
 
@@ -0,0 +1,206 @@
+import time
+import random
+import string
+import statistics
+import tracemalloc
+from collections import namedtuple
+
+from django.apps import apps
+
+from common.utils import QueryCounter
+from .index_generator import IndexGenerator
+
+Organism = apps.get_model('library_sample_shared', 'Organism')
+ConcentrationMethod = apps.get_model(
+    'library_sample_shared', 'ConcentrationMethod')
+ReadLength = apps.get_model('library_sample_shared', 'ReadLength')
+LibraryProtocol = apps.get_model('library_sample_shared', 'LibraryProtocol')
+LibraryType = apps.get_model('library_sample_shared', 'LibraryType')
+IndexType = apps.get_model('library_sample_shared', 'IndexType')
+IndexI7 = apps.get_model('library_sample_shared', 'IndexI7')
+IndexI5 = apps.get_model('library_sample_shared', 'IndexI5')
+IndexPair = apps.get_model('library_sample_shared', 'IndexPair')
+NucleicAcidType = apps.get_model('sample', 'NucleicAcidType')
+Sample = apps.get_model('sample', 'Sample')
+
+Workload = namedtuple('Workload', [
+    'name', 'format', 'is_dual', 'index_length', 'num_indices',
+    'num_samples',
+])
+
+# Plate layouts (rows, columns)
+PLATES = {96: (8, 12), 384: (16, 24)}
+
+WORKLOADS = [
+    Workload('tube-single-8nt-10', 'single', False, 8, 96, 10),
+    Workload('tube-single-12nt-90', 'single', False, 12, 96, 90),
+    Workload('tube-dual-8nt-96', 'single', True, 8, 96, 96),
+    Workload('tube-dual-10nt-384', 'single', True, 10, 96, 384),
+    Workload('tube-dual-24nt-50', 'single', True, 24, 24, 50),
+    Workload('plate96-single-8nt-5', 'plate', False, 8, 96, 5),
+    Workload('plate96-dual-8nt-96', 'plate', True, 8, 96, 96),
+    Workload('plate384-dual-10nt-384', 'plate', True, 10, 384, 384),
+    Workload('plate384-dual-12nt-200', 'plate', True, 12, 384, 200),
+]
+
+
+class IndexGeneratorBenchmark:
+    """
+    Build synthetic index catalogs and samples, and measure the wall time,
+    the number of queries, and the peak memory of
+    `IndexGenerator.generate()`. The data and the generator's random
+    choices only depend on `seed`.
+
+    Meant to be run against an empty (test) database.
+    """
+
+    def __init__(self, seed=0, strategy=None, repeat=3):
+        self.seed = seed
+        self.strategy = strategy
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self._num_catalogs = 0
+        self._shared = None
+
+    def run(self, workload):
+        """ Run a given workload and return its measurements. """
+        index_type = self.create_catalog(workload)
+        sample_ids = self.create_samples(index_type, workload.num_samples)
+
+        times, queries, memory = [], [], []
+        error = ''
+        for i in range(self.repeat):
+            random.seed(self.seed + i)
+            tracemalloc.start()
+            start = time.perf_counter()
+
+            try:
+                with QueryCounter() as counter:
+                    index_generator = IndexGenerator(
+                        [], sample_ids, None, None, self.strategy)
+                    index_generator.generate()
+            except (ValueError, IndexError) as e:
+                error = str(e)
+            finally:
+                times.append(time.perf_counter() - start)
+                memory.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                queries.append(counter.count)
+
+        return {
+            'workload': workload.name,
+            'samples': workload.num_samples,
+            'time_first': times[0],
+            'time_median': statistics.median(times),
+            'queries': max(queries),
+            'peak_memory': max(memory),
+            'error': error,
+        }
+
+    def create_catalog(self, workload):
+        """ Create an index type with random indices (and index pairs). """
+        self._num_catalogs += 1
+        prefix = f'BM{self._num_catalogs}'
+
+        index_type = IndexType(
+            name=f'Benchmark {workload.name}',
+            is_dual=workload.is_dual,
+            format=workload.format,
+            index_length=str(workload.index_length),
+        )
+        index_type.save()
+
+        sequences = self.random_sequences(
+            workload.index_length, 2 * workload.num_indices)
+
+        IndexI7.objects.bulk_create([
+            IndexI7(prefix=prefix, number=f'{i + 1:03d}', index=sequence)
+            for i, sequence in enumerate(sequences[:workload.num_indices])
+        ])
+        indices_i7 = list(
+            IndexI7.objects.filter(prefix=prefix).order_by('number'))
+        index_type.indices_i7.add(*indices_i7)
+
+        indices_i5 = []
+        if workload.is_dual:
+            IndexI5.objects.bulk_create([
+                IndexI5(prefix=prefix, number=f'{i + 1:03d}', index=sequence)
+                for i, sequence in enumerate(
+                    sequences[workload.num_indices:])
+            ])
+            indices_i5 = list(
+                IndexI5.objects.filter(prefix=prefix).order_by('number'))
+            index_type.indices_i5.add(*indices_i5)
+
+        if workload.format == 'plate':
+            # One unique (dual) index per well
+            rows, columns = PLATES[workload.num_indices]
+            IndexPair.objects.bulk_create([
+                IndexPair(
+                    index_type=index_type,
+                    index1=indices_i7[i],
+                    index2=indices_i5[i] if workload.is_dual else None,
+                    char_coord=string.ascii_uppercase[i // columns],
+                    num_coord=i % columns + 1,
+                )
+                for i in range(rows * columns)
+            ])
+
+        return index_type
+
+    def create_samples(self, index_type, num_samples):
+        """ Create samples of a given index type with random depths. """
+        organism, concentration_method, read_length, library_protocol, \
+            library_type, nucleic_acid_type = self.get_shared_objects()
+
+        prefix = f'B{self._num_catalogs:02d}'
+        Sample.objects.bulk_create([
+            Sample(
+                name=f'{prefix}_{i}',
+                barcode=f'{prefix}{i:06d}',
+                organism=organism,
+                concentration=1.0,
+                concentration_method=concentration_method,
+                read_length=read_length,
+                sequencing_depth=self.rng.choice([5, 10, 20, 50]),
+                library_protocol=library_protocol,
+                library_type=library_type,
+                nucleic_acid_type=nucleic_acid_type,
+                index_type=index_type,
+            )
+            for i in range(num_samples)
+        ])
+
+        return list(Sample.objects.filter(
+            index_type=index_type).values_list('pk', flat=True))
+
+    def get_shared_objects(self):
+        """ Create the objects shared by all samples (only once). """
+        if self._shared is None:
+            library_protocol = LibraryProtocol.objects.create(
+                name='Benchmark', provider='-', catalog='-',
+                explanation='-', input_requirements='-',
+                typical_application='-',
+            )
+            library_type = LibraryType.objects.create(name='Benchmark')
+            library_type.library_protocol.add(library_protocol)
+
+            self._shared = (
+                Organism.objects.create(name='Benchmark'),
+                ConcentrationMethod.objects.create(name='Benchmark'),
+                ReadLength.objects.create(name='Benchmark'),
+                library_protocol,
+                library_type,
+                NucleicAcidType.objects.create(name='Benchmark'),
+            )
+
+        return self._shared
+
+    def random_sequences(self, length, count):
+        """ Return a given number of unique random index sequences. """
+        sequences = []
+        while len(sequences) < count:
+            sequence = ''.join(self.rng.choice('ACGT') for _ in range(length))
+            if sequence not in sequences:
+                sequences.append(sequence)
+        return sequences
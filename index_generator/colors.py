@@ -0,0 +1,96 @@
+import numpy as np
+
+# Red/green encoding of the nucleotides: A/C are read in the red channel,
+# G/T in the green one. Anything else (padding, N) has no color.
+RED, GREEN, NO_COLOR = 0, 1, -1
+
+COLOR_TABLE = np.full(256, NO_COLOR, dtype=np.int8)
+COLOR_TABLE[[ord('A'), ord('C')]] = RED
+COLOR_TABLE[[ord('G'), ord('T')]] = GREEN
+
+
+def encode_colors(sequences, length=None):
+    """
+    Encode index sequences as a red/green matrix with one row per sequence
+    and one column per cycle. Shorter sequences are padded with `NO_COLOR`.
+    """
+    if length is None:
+        length = max(map(len, sequences), default=0)
+
+    matrix = np.full((len(sequences), length), NO_COLOR, dtype=np.int8)
+    for i, sequence in enumerate(sequences):
+        sequence = sequence[:length].encode('ascii', 'replace')
+        matrix[i, :len(sequence)] = COLOR_TABLE[
+            np.frombuffer(sequence, dtype=np.uint8)]
+
+    return matrix
+
+
+class ColorDistribution:
+    """
+    Total sequencing depth read in the green and in the red channel for each
+    cycle of a pool of indices.
+
+    The distribution is updated in place, in O(L), when an index is added
+    to the pool, and candidates are scored against it without modifying
+    (or copying) it. The number of cycles is fixed when the distribution
+    is created, longer indices are truncated and shorter ones padded.
+    """
+
+    def __init__(self, length):
+        self.green = np.zeros(length)
+        self.red = np.zeros(length)
+        self.total_depth = 0.0
+
+    def __len__(self):
+        return len(self.green)
+
+    @classmethod
+    def from_indices(cls, indices, depths):
+        """ Create the distribution of given indices (and their depths). """
+        distribution = cls(len(indices[0]) if indices else 0)
+        color_matrix = encode_colors(indices, len(distribution))
+        depths = np.array(depths[:len(indices)], dtype=float)
+
+        distribution.green += (color_matrix == GREEN).T.dot(depths)
+        distribution.red += (color_matrix == RED).T.dot(depths)
+        distribution.total_depth += depths.sum()
+        return distribution
+
+    def add(self, index, depth):
+        """ Add an index sequence read with a given depth to the pool. """
+        colors = encode_colors([index], len(self))[0]
+        self.green += depth * (colors == GREEN)
+        self.red += depth * (colors == RED)
+        self.total_depth += depth
+
+    def scores(self, color_matrix, depth):
+        """
+        Return the per-cycle scores of the pool extended with each candidate
+        (rows of the red/green matrix) read with a given depth.
+
+        Score is an absolute difference between the sequencing depths of
+        the two channels divided by the total sequencing depth (in %).
+        Cycles without a base in the candidate index are not scored.
+        """
+        color_matrix = self.fit(color_matrix)
+        green = self.green + depth * (color_matrix == GREEN)
+        red = self.red + depth * (color_matrix == RED)
+
+        scores = np.where(
+            (green > 0) & (red > 0),
+            np.abs(green - red) / (self.total_depth + depth) * 100,
+            100.0,
+        )
+        return np.where(color_matrix != NO_COLOR, scores, 0.0)
+
+    def fit(self, color_matrix):
+        """ Truncate or pad a red/green matrix to the number of cycles. """
+        color_matrix = color_matrix[:, :len(self)]
+        if color_matrix.shape[1] < len(self):
+            color_matrix = np.pad(
+                color_matrix,
+                ((0, 0), (0, len(self) - color_matrix.shape[1])),
+                'constant', constant_values=NO_COLOR,
+            )
+        return color_matrix
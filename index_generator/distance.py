@@ -0,0 +1,90 @@
+from collections import namedtuple
+
+import numpy as np
+
+# 2-bit encoding of the nucleotides, anything else is treated as A
+NUCLEOTIDE_TABLE = np.zeros(256, dtype=np.uint64)
+for _i, _nucleotide in enumerate('ACGT'):
+    NUCLEOTIDE_TABLE[ord(_nucleotide)] = _i
+
+MAX_LENGTH = 32  # 2 bits per nucleotide in 64 bits
+
+# Bit masks covering the first N nucleotides of a packed index
+PREFIX_MASKS = np.array(
+    [(1 << (2 * x)) - 1 for x in range(MAX_LENGTH)] + [2 ** 64 - 1],
+    dtype=np.uint64,
+)
+
+# Low bit of each nucleotide
+LOW_BITS = np.uint64(int('01' * MAX_LENGTH, 2))
+
+POPCOUNT_TABLE = np.array([bin(x).count('1') for x in range(256)],
+                          dtype=np.uint8)
+
+PackedIndices = namedtuple('PackedIndices', ['codes', 'lengths'])
+
+
+def encode_nucleotides(sequences):
+    """
+    Pack index sequences into 64-bit integers (2 bits per nucleotide,
+    the first nucleotide in the lowest bits).
+    """
+    sequences = [x[:MAX_LENGTH] for x in sequences]
+    lengths = np.array([len(x) for x in sequences], dtype=np.uint8)
+    width = int(lengths.max()) if len(sequences) else 0
+
+    if width == 0:
+        codes = np.zeros(len(sequences), dtype=np.uint64)
+        return PackedIndices(codes, lengths)
+
+    # The padding is ignored when comparing indices (see `PREFIX_MASKS`)
+    data = ''.join(x.ljust(width, 'A') for x in sequences)
+    values = NUCLEOTIDE_TABLE[np.frombuffer(
+        data.encode('ascii', 'replace'), dtype=np.uint8,
+    ).reshape(len(sequences), width)]
+    shifts = np.arange(0, 2 * width, 2, dtype=np.uint64)
+    codes = np.bitwise_or.reduce(values << shifts, axis=1)
+
+    return PackedIndices(codes, lengths)
+
+
+def hamming_distances(a, b):
+    """
+    Return the matrix of Hamming distances between two sets of packed
+    indices. Indices of different lengths are compared over the length
+    of the shorter one.
+    """
+    mask = PREFIX_MASKS[np.minimum(a.lengths[:, None], b.lengths[None, :])]
+    diff = (a.codes[:, None] ^ b.codes[None, :]) & mask
+    mismatches = (diff | (diff >> np.uint64(1))) & LOW_BITS
+    return POPCOUNT_TABLE[
+        mismatches.view(np.uint8).reshape(mismatches.shape + (8,))
+    ].sum(axis=-1)
+
+
+def collision_matrix(candidates_i7, candidates_i5, pool_i7, pool_i5,
+                     min_distance):
+    """
+    Return a boolean matrix telling which candidate index pairs collide
+    with which index pairs of the pool.
+
+    Two index pairs collide if both their indices I7 and their indices I5
+    are closer than `min_distance`, i.e., the samples cannot be told apart
+    by any of the index reads.
+    """
+    return (
+        (hamming_distances(candidates_i7, pool_i7) < min_distance) &
+        (hamming_distances(candidates_i5, pool_i5) < min_distance)
+    )
+
+
+def find_collisions(indices_i7, indices_i5, min_distance):
+    """
+    Return the list of position pairs (i, j), i < j, of colliding
+    index pairs (Index I7, Index I5) given as sequences.
+    """
+    packed_i7 = encode_nucleotides(indices_i7)
+    packed_i5 = encode_nucleotides(indices_i5)
+    collisions = np.triu(collision_matrix(
+        packed_i7, packed_i5, packed_i7, packed_i5, min_distance), 1)
+    return [tuple(map(int, x)) for x in np.argwhere(collisions)]
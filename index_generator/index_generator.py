@@ -1,13 +1,26 @@
 import re
+import sys
+import uuid
 import random
 import string
 import itertools
+import threading
 from collections import namedtuple, OrderedDict, defaultdict, Counter
 
+import numpy as np
 from django.apps import apps
+from common.cache import get_cache
+from common.utils import QueryCounter
+
+from .colors import ColorDistribution, encode_colors
+from .distance import (
+    encode_nucleotides,
+    hamming_distances,
+    collision_matrix,
+    find_collisions,
+)
+from .solver import BeamSearchSolver
 
-IndexI7 = apps.get_model('library_sample_shared', 'IndexI7')
-IndexI5 = apps.get_model('library_sample_shared', 'IndexI5')
 IndexPair = apps.get_model('library_sample_shared', 'IndexPair')
 Library = apps.get_model('library', 'Library')
 Sample = apps.get_model('sample', 'Sample')
@@ -15,6 +28,123 @@ Sample = apps.get_model('sample', 'Sample')
 Pair = namedtuple('Pair', ['index1', 'index2', 'coordinate'])
 
 
+def intern(value):
+    """ Intern a string value, leave anything else (e.g., None) as is. """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Index:
+    """
+    Compact, immutable representation of an index in the registry.
+
+    Strings are interned, so that the sequences, prefixes, and numbers
+    shared by many indices are only stored once. Fields can be read as
+    `index['prefix']`, like the dicts returned by the API, which are only
+    created by `to_dict()` (see `IndexGenerator.result`).
+    """
+    __slots__ = ('format', 'index_type', 'read_type', 'prefix', 'number',
+                 'index', 'coordinate', 'is_library')
+
+    def __init__(self, format='', index_type='', read_type='', prefix='',
+                 number='', index='', coordinate='', is_library=False):
+        set_field = super().__setattr__
+        set_field('format', intern(format))
+        set_field('index_type', index_type)
+        set_field('read_type', intern(read_type))
+        set_field('prefix', intern(prefix))
+        set_field('number', intern(number))
+        set_field('index', intern(index))
+        set_field('coordinate', intern(coordinate))
+        set_field('is_library', is_library)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Index is immutable.')
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Index):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __reduce__(self):
+        return (Index, self.astuple())
+
+    def __repr__(self):
+        return f'Index({self.prefix}{self.number}, {self.index})'
+
+    def astuple(self):
+        return tuple(getattr(self, x) for x in self.__slots__)
+
+    def to_dict(self):
+        return dict(zip(self.__slots__, self.astuple()))
+
+
+class IndexRegistryCache:
+    """
+    Process-wide cache of fetched and sorted indices i7/i5, index pairs,
+    and their red/green matrices, shared by all `IndexRegistry` instances.
+
+    All entries are dropped once the catalog version, which is stored in
+    the results cache shared by all processes and changed by
+    `invalidate()`, differs from the one the entries were built for.
+    """
+    VERSION_KEY = 'index_registry_version'
+
+    def __init__(self):
+        self._entries = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, create):
+        """
+        Return the entry for a given key, or build it using `create()`
+        if it is not in the cache yet.
+        """
+        version = self.get_version()
+
+        with self._lock:
+            if version != self._version:
+                self._entries = {}
+                self._version = version
+            entry = self._entries.get(key)
+
+        if entry is None:
+            entry = create()
+
+            # Don't store the entry if the catalog has changed meanwhile
+            if self.get_version() == version:
+                with self._lock:
+                    if self._version == version:
+                        self._entries[key] = entry
+
+        return entry
+
+    @classmethod
+    def get_version(cls):
+        version = get_cache().get(cls.VERSION_KEY)
+        if version is None:
+            version = cls.invalidate()
+        return version
+
+    @classmethod
+    def invalidate(cls):
+        """ Mark all cached entries (in all processes) as outdated. """
+        version = uuid.uuid4().hex
+        get_cache().set(cls.VERSION_KEY, version, None)
+        return version
+
+
+registry_cache = IndexRegistryCache()
+
+
 class IndexRegistry:
     """
     Class for storing fetched and sorted indices i7/i5 and index pairs.
@@ -23,6 +153,7 @@ class IndexRegistry:
     def __init__(self, mode, index_types, start_coord='A1', direction='right'):
         self.indices = {}
         self.pairs = {}
+        self.cache_keys = {}
 
         # In case if an empty string was passed
         start_coord = start_coord if start_coord else 'A1'
@@ -34,6 +165,9 @@ class IndexRegistry:
 
         # Fetch indices and index pairs
         for index_type in self.index_types:
+            self.cache_keys[index_type.pk] = (
+                index_type.pk, self.mode, start_coord, direction)
+
             if index_type.format == 'single':
                 self.fetch_indices(index_type)
             else:
@@ -41,10 +175,16 @@ class IndexRegistry:
 
     def fetch_indices(self, index_type):
         """ Fetch indices i7 and i5 for a given index type. """
-        if index_type.pk not in self.indices.keys():
-            self.indices[index_type.pk] = {'i7': [], 'i5': []}
+        self.indices[index_type.pk] = registry_cache.get_or_create(
+            self.cache_keys[index_type.pk] + ('indices',),
+            lambda: self.load_indices(index_type),
+        )
+
+    def load_indices(self, index_type):
+        """ Load indices i7 and i5 for a given index type from the db. """
+        indices = {'i7': [], 'i5': []}
 
-        self.indices[index_type.pk]['i7'] = self.to_list(
+        indices['i7'] = self.to_list(
             index_type.format,
             index_type.pk,
             index_type.read_type,
@@ -52,20 +192,32 @@ class IndexRegistry:
         )
 
         if self.mode == 'dual':
-            self.indices[index_type.pk]['i5'] = self.to_list(
+            indices['i5'] = self.to_list(
                 index_type.format,
                 index_type.pk,
                 index_type.read_type,
                 index_type.indices_i5.all(),
             )
 
+        return indices
+
     def fetch_pairs(self, index_type, char_coord, num_coord, direction):
         """
         Fetch index pairs (Index i7 + Index i5) for a given index type,
         start coordinate, and direction.
         """
-        if index_type.pk not in self.pairs.keys():
-            self.pairs[index_type.pk] = []
+        self.pairs[index_type.pk] = registry_cache.get_or_create(
+            self.cache_keys[index_type.pk] + ('pairs',),
+            lambda: self.load_pairs(
+                index_type, char_coord, num_coord, direction),
+        )
+
+    def load_pairs(self, index_type, char_coord, num_coord, direction):
+        """
+        Load index pairs for a given index type from the db, sorted
+        according to the chosen start coordinate and direction.
+        """
+        pairs = []
 
         index_pairs = IndexPair.objects.filter(
             index_type=index_type).select_related('index1', 'index2')
@@ -94,23 +246,24 @@ class IndexRegistry:
         index_pairs = index_pairs[start_idx:] + index_pairs[:start_idx]
 
         for pair in index_pairs:
-            index1 = self.create_index_dict(
+            index1 = self.create_index(
                 index_type.format, index_type.pk, index_type.read_type,
                 pair.index1.prefix, pair.index1.number,
                 pair.index1.index, pair.coordinate,
                 )
 
             if self.mode == 'dual':
-                index2 = self.create_index_dict(
+                index2 = self.create_index(
                     index_type.format, index_type.pk, index_type.read_type,
                     pair.index2.prefix, pair.index2.number,
                     pair.index2.index, pair.coordinate,
                 )
             else:
-                index2 = self.create_index_dict()
+                index2 = self.create_index()
+
+            pairs.append(Pair(index1, index2, pair.coordinate))
 
-            self.pairs[index_type.pk].append(
-                Pair(index1, index2, pair.coordinate))
+        return pairs
 
     def get_diagonal(self, index_pairs):
         """ Sort index pairs diagonally. """
@@ -151,25 +304,83 @@ class IndexRegistry:
         """ Return a list of index pairs for a given index type id. """
         return self.pairs.get(index_type_id, [])
 
+    def get_color_matrix(self, index_type_id, index_group):
+        """
+        Return the red/green matrix of the indices for a given index type id
+        and index group. Rows follow the order of `get_indices()`.
+        """
+        return self.get_cached(
+            index_type_id, index_group,
+            lambda: encode_colors([
+                x['index']
+                for x in self.get_indices(index_type_id, index_group)
+            ]),
+        )
+
+    def get_pairs_color_matrix(self, index_type_id):
+        """
+        Return the red/green matrix of the concatenated index pairs
+        (Index I7 + Index I5) for a given index type id. Rows follow
+        the order of `get_pairs()`.
+        """
+        return self.get_cached(
+            index_type_id, 'pair_colors',
+            lambda: encode_colors([
+                x.index1['index'] + x.index2['index']
+                for x in self.get_pairs(index_type_id)
+            ]),
+        )
+
+    def get_packed_indices(self, index_type_id, index_group):
+        """
+        Return the bit-packed indices for a given index type id and
+        index group. Items follow the order of `get_indices()`.
+        """
+        return self.get_cached(
+            index_type_id, ('packed', index_group),
+            lambda: encode_nucleotides([
+                x['index']
+                for x in self.get_indices(index_type_id, index_group)
+            ]),
+        )
+
+    def get_packed_pairs(self, index_type_id):
+        """
+        Return the bit-packed indices I7 and I5 of the index pairs for
+        a given index type id. Items follow the order of `get_pairs()`.
+        """
+        return self.get_cached(
+            index_type_id, ('packed', 'pairs'),
+            lambda: (
+                encode_nucleotides([
+                    x.index1['index'] for x in self.get_pairs(index_type_id)
+                ]),
+                encode_nucleotides([
+                    x.index2['index'] for x in self.get_pairs(index_type_id)
+                ]),
+            ),
+        )
+
+    def get_cached(self, index_type_id, name, create):
+        """
+        Return a shared registry cache entry for a given index type id,
+        or build it using `create()`.
+        """
+        if index_type_id not in self.cache_keys:
+            return create()
+        return registry_cache.get_or_create(
+            self.cache_keys[index_type_id] + (name,), create)
+
     def to_list(self, format, index_type, read_type, indices):
-        """ Return a list of index dicts. """
-        return list(map(lambda x: self.create_index_dict(
+        """ Return a list of `Index` records. """
+        return list(map(lambda x: self.create_index(
             format, index_type, read_type, x.prefix, x.number, x.index), indices))
 
     @staticmethod
-    def create_index_dict(format='', index_type='', read_type='', prefix='',
-                          number='', index='', coordinate='',
-                          is_library=False):
-        return {
-            'format': format,
-            'index_type': index_type,
-            'read_type' : read_type,
-            'prefix': prefix,
-            'number': number,
-            'index': index,
-            'coordinate': coordinate,
-            'is_library': is_library,
-        }
+    def create_index(format='', index_type='', read_type='', prefix='',
+                     number='', index='', coordinate='', is_library=False):
+        return Index(format, index_type, read_type, prefix, number, index,
+                     coordinate, is_library)
 
     @staticmethod
     def split_coordinate(coordinate):
@@ -196,11 +407,30 @@ class IndexGenerator:
     index_length = 0
     format = ''
     mode = ''
+    strategy = 'random'
+    min_distance = 0
     MAX_ATTEMPTS = 30
     MAX_RANDOM_SAMPLES = 5
+    STRATEGIES = ('random', 'beam')
+    BEAM_WIDTH = 8
+    SOLVER_TIME_LIMIT = 5.0  # seconds
+    MAX_CANDIDATES = 4096  # combinations of tube indices I7 and I5
 
-    def __init__(self, library_ids, sample_ids, start_coord, direction):
+    def __init__(self, library_ids, sample_ids, start_coord, direction,
+                 strategy=None, min_distance=None):
         self._result = []
+        self.metadata = {}
+
+        self.strategy = strategy if strategy else 'random'
+        if self.strategy not in self.STRATEGIES:
+            raise ValueError('Invalid strategy.')
+
+        try:
+            self.min_distance = int(min_distance) if min_distance else 0
+        except (TypeError, ValueError):
+            self.min_distance = -1
+        if self.min_distance < 0:
+            raise ValueError('Invalid minimum distance.')
 
         self.libraries = Library.objects.filter(
             pk__in=library_ids
@@ -242,22 +472,26 @@ class IndexGenerator:
             'barcode',
         )
 
-        self.num_libraries = len(self.libraries)
-        self.num_samples = len(self.samples)
+        with QueryCounter() as counter:
+            self.num_libraries = len(self.libraries)
+            self.num_samples = len(self.samples)
 
-        if self.num_samples == 0:
-            raise ValueError('No samples provided.')
+            if self.num_samples == 0:
+                raise ValueError('No samples provided.')
 
-        records = list(itertools.chain(self.libraries, self.samples))
-        read_lengths = [x.read_length for x in records]
-        if len(set(read_lengths)) != 1:
-            raise ValueError(
-                'Read Length must be the same for all libraries and samples.')
+            records = list(itertools.chain(self.libraries, self.samples))
+            read_lengths = [x.read_length for x in records]
+            if len(set(read_lengths)) != 1:
+                raise ValueError(
+                    'Read Length must be the same for all libraries ' +
+                    'and samples.')
+
+            index_types = self.validate_index_types(records)
 
-        index_types = self.validate_index_types(records)
+            self.index_registry = IndexRegistry(
+                self.mode, index_types, start_coord, direction)
 
-        self.index_registry = IndexRegistry(
-            self.mode, index_types, start_coord, direction)
+        self.metadata['queries'] = counter.count
 
     def validate_index_types(self, records):
         """ Check the compatibility of provided libraries and samples. """
@@ -289,9 +523,19 @@ class IndexGenerator:
 
     def generate(self):
         """ Main method that generates indices. """
+        with QueryCounter() as counter:
+            result = self.generate_indices()
+        self.metadata['queries'] += counter.count
+        return result
+
+    def generate_indices(self):
+        """ Generate indices using the chosen strategy. """
         if self.num_libraries > 0:
             self.add_libraries_to_result()
 
+        if self.strategy == 'beam':
+            return self.generate_optimal()
+
         # If a single sample was selected, then add it directly to the result
         if not any(self._result) and self.num_samples == 1:
             index_i7, index_i5 = self.find_random(self.samples[0])
@@ -367,7 +611,7 @@ class IndexGenerator:
                 tube_samples, depths, 'i7', init_i7)
             if self.mode == 'single':
                 indices_i5 = [
-                    self.index_registry.create_index_dict()] * len(indices_i7)
+                    self.index_registry.create_index()] * len(indices_i7)
             else:
                 indices_i5 = self.find_indices(
                     tube_samples, depths, 'i5', init_i5)
@@ -375,10 +619,9 @@ class IndexGenerator:
             # Ensure uniqueness
             i7_extracted = [x['index'] for x in indices_i7]
             i5_extracted = [x['index'] for x in indices_i5]
-            all_pairs = list(zip(i7_extracted, i5_extracted))
 
             # If all pairs are unique, exit. Otherwise, re-generate the indices
-            if len(all_pairs) == len(set(all_pairs)):
+            if not self.has_collisions(i7_extracted, i5_extracted):
                 is_ok = True
 
             attempt += 1
@@ -398,18 +641,148 @@ class IndexGenerator:
 
         return self.result
 
+    def generate_optimal(self):
+        """
+        Assign indices to all samples at once, minimizing the worst
+        per-cycle color imbalance of the pool (see `BeamSearchSolver`).
+        Unlike `generate()`, the result is deterministic.
+        """
+        init_pairs = [(x['index_i7'], x['index_i5']) for x in self._result]
+        init_depths = [x['sequencing_depth'] for x in self._result]
+        assignment = {}
+
+        # If the number of samples with index type 'plate' is large enough,
+        # or read_type is "long", take pairs in the selected order
+        plate_samples = [
+            x for x in self.samples if x.index_type.format == 'plate']
+        if len(plate_samples) > self.MAX_RANDOM_SAMPLES or \
+                self.samples[0].index_type.read_type == 'long':
+            pairs = self.find_pairs_fixed(plate_samples, init_pairs)
+            for sample, pair in zip(plate_samples, pairs):
+                assignment[sample.pk] = pair
+                init_pairs.append(pair)
+                init_depths.append(sample.sequencing_depth)
+
+        samples = [x for x in self.samples if x.pk not in assignment]
+        candidates = {}
+        for sample in samples:
+            if sample.index_type.pk not in candidates:
+                candidates[sample.index_type.pk] = self.get_candidates(
+                    sample.index_type)
+
+        solver = BeamSearchSolver(
+            self.BEAM_WIDTH, self.SOLVER_TIME_LIMIT, self.min_distance)
+        picks, score, avg_score = solver.solve(
+            encode_colors([x[0]['index'] + x[1]['index'] for x in init_pairs]),
+            init_depths,
+            [(x[0]['index'], x[1]['index']) for x in init_pairs],
+            {k: (v[1], v[2]) for k, v in candidates.items()},
+            [(x.index_type.pk, x.sequencing_depth) for x in samples],
+        )
+
+        for sample, pick in zip(samples, picks):
+            assignment[sample.pk] = candidates[sample.index_type.pk][0][pick]
+
+        for sample in self.samples:
+            index_i7, index_i5 = assignment[sample.pk]
+            self._result.append(
+                self.create_result_dict(sample, index_i7, index_i5))
+
+        self.metadata.update({
+            'strategy': self.strategy,
+            'score': score,
+            'avg_score': avg_score,
+        })
+
+        return self.result
+
+    def get_candidates(self, index_type):
+        """
+        Return the index pairs (Index I7, Index I5) which can be assigned to
+        a sample of a given index type, their red/green matrix and their
+        uniqueness keys.
+
+        Tube indices I7 and I5 can be freely combined, but only the first
+        `MAX_CANDIDATES` combinations (see `combine_indices()`) are
+        considered, so that the candidates of large index types stay small.
+        """
+        def create():
+            if index_type.format == 'plate':
+                pairs = [
+                    (x.index1, x.index2)
+                    for x in self.index_registry.get_pairs(index_type.pk)
+                ]
+                color_matrix = self.index_registry.get_pairs_color_matrix(
+                    index_type.pk)
+            else:
+                indices_i7 = self.index_registry.get_indices(
+                    index_type.pk, 'i7')
+                color_matrix_i7 = self.index_registry.get_color_matrix(
+                    index_type.pk, 'i7')
+
+                if self.mode == 'dual':
+                    indices_i5 = self.index_registry.get_indices(
+                        index_type.pk, 'i5')
+                    color_matrix_i5 = self.index_registry.get_color_matrix(
+                        index_type.pk, 'i5')
+                    positions = np.array(list(itertools.islice(
+                        self.combine_indices(
+                            len(indices_i7), len(indices_i5)),
+                        self.MAX_CANDIDATES,
+                    )), dtype=np.int64).reshape(-1, 2)
+                    pairs = [
+                        (indices_i7[i], indices_i5[j]) for i, j in positions
+                    ]
+                    color_matrix = np.hstack([
+                        color_matrix_i7[positions[:, 0]],
+                        color_matrix_i5[positions[:, 1]],
+                    ])
+                else:
+                    empty_index = self.index_registry.create_index()
+                    pairs = [(x, empty_index) for x in indices_i7]
+                    color_matrix = color_matrix_i7
+
+            keys = [(x[0]['index'], x[1]['index']) for x in pairs]
+            return pairs, color_matrix, keys
+
+        return self.index_registry.get_cached(
+            index_type.pk, 'candidates', create)
+
+    @staticmethod
+    def combine_indices(num_i7, num_i5):
+        """
+        Generate the positions (I7, I5) of all combinations of the indices
+        I7 and I5, diagonal by diagonal: every I7 is combined with the I5
+        at the same position, then with the next one, and so on. The first
+        combinations thus contain every I7 (and as many I5) as possible.
+        """
+        for offset in range(num_i5):
+            for i in range(num_i7):
+                yield i, (i + offset) % num_i5
+
     def add_libraries_to_result(self):
         """ Add all libraries directly to the result. """
 
-        def idx_dict(class_model, index, index_type):
-            idx = class_model.objects.filter(
-                index=index, index_type=index_type)
+        # Build a lookup of the (prefetched) indices of the libraries'
+        # index types to avoid querying them for each library
+        indices = {}
+        for index_type in {x.index_type for x in self.libraries}:
+            for index_group, index_list in [
+                ('i7', index_type.indices_i7.all()),
+                ('i5', index_type.indices_i5.all()),
+            ]:
+                for idx in index_list:
+                    indices.setdefault(
+                        (index_group, index_type.pk, idx.index), idx)
+
+        def idx_dict(index_group, index, index_type):
+            idx = indices.get((index_group, index_type.pk, index))
             if idx:
-                idx = self.index_registry.create_index_dict(
-                    index_type.format, index_type.pk, index_type.read_type, idx[0].prefix,
-                    idx[0].number, idx[0].index, is_library=True)
+                idx = self.index_registry.create_index(
+                    index_type.format, index_type.pk, index_type.read_type, idx.prefix,
+                    idx.number, idx.index, is_library=True)
             else:
-                idx = self.index_registry.create_index_dict(
+                idx = self.index_registry.create_index(
                     index=index, is_library=True)
             return idx
 
@@ -417,12 +790,12 @@ class IndexGenerator:
         with_index = []
 
         for library in self.libraries:
-            index_i7 = idx_dict(IndexI7, library.index_i7, library.index_type)
-            index_i5 = self.index_registry.create_index_dict(is_library=True)
+            index_i7 = idx_dict('i7', library.index_i7, library.index_type)
+            index_i5 = self.index_registry.create_index(is_library=True)
 
             if self.mode == 'dual':
                 index_i5 = idx_dict(
-                    IndexI5, library.index_i5, library.index_type)
+                    'i5', library.index_i5, library.index_type)
 
             d = self.create_result_dict(library, index_i7, index_i5)
             if d['index_i7']['prefix'] != '':
@@ -442,7 +815,7 @@ class IndexGenerator:
         if sample.index_type.format == 'single':
             index_i7 = random.choice(
                 self.index_registry.get_indices(sample.index_type.pk, 'i7'))
-            index_i5 = self.index_registry.create_index_dict()
+            index_i5 = self.index_registry.create_index()
             if self.mode == 'dual':
                 index_i5 = random.choice(
                     self.index_registry.get_indices(
@@ -460,14 +833,17 @@ class IndexGenerator:
             return init_indices
 
         indices = list(init_indices)
+        color_distribution = self.calculate_color_distribution(
+            [x['index'] for x in indices], depths)
 
         for sample in samples:
             index = self.find_index(
-                sample, index_group, indices, depths)
+                sample, index_group, indices, color_distribution)
             if 'index' not in index:
                 raise ValueError('Index not found.')
             index = index['index']
             indices.append(index)
+            color_distribution.add(index['index'], depths[len(indices) - 1])
 
         if len(indices) == len(init_indices) + len(samples):
             library_indices = [x for x in indices if x['is_library']]
@@ -481,36 +857,54 @@ class IndexGenerator:
                          'for the selected samples.')
 
 
-    def find_index(self, sample, index_group, current_indices, depths):
+    def find_index(self, sample, index_group, current_indices,
+                   color_distribution):
         """ Helper function for `find_indices()`. """
         indices_in_result = [x['index'] for x in current_indices]
         result_index = {'avg_score': 100.0}
 
-        indices = list(self.index_registry.get_indices(
-            sample.index_type.pk, index_group))
-        random.shuffle(indices)
+        indices = self.index_registry.get_indices(
+            sample.index_type.pk, index_group)
+        order = list(range(len(indices)))
+        random.shuffle(order)
 
         # Ensure uniqueness
         if self.mode == 'single':
-            indices = [
-                x for x in indices
-                if x['index'] not in indices_in_result
-            ]
-
-        # Calculate color distribution
-        color_distribution, total_depth = self.calculate_color_distribution(
-            indices_in_result, depths, sample)
-
-        for index in indices:
-            if sample.index_type.read_type == 'long':
-                result_index = {'avg_score': 999, 'index': index}  # don't need to check score
-            else:
-                converted_index = self.convert_index(index['index'])
-                scores = self.calculate_scores(
-                    sample, converted_index, color_distribution, total_depth)
-                avg_score = sum(scores) / self.index_length
-                if avg_score < result_index['avg_score']:
-                    result_index = {'avg_score': avg_score, 'index': index}
+            used = set(indices_in_result)
+            order = [i for i in order if indices[i]['index'] not in used]
+
+        # Prefer indices far enough from all indices in the result. In dual
+        # mode indices may repeat within a group as long as the pairs differ,
+        # so if no index is far enough, the pairs are checked afterwards
+        if self.min_distance > 1 and order and indices_in_result:
+            packed = self.index_registry.get_packed_indices(
+                sample.index_type.pk, index_group)
+            distances = hamming_distances(
+                packed, encode_nucleotides(indices_in_result))
+            blocked = (distances < self.min_distance).any(axis=1)
+            allowed = [i for i in order if not blocked[i]]
+            if allowed or self.mode == 'single':
+                order = allowed
+
+        if not order:
+            return result_index
+
+        if sample.index_type.read_type == 'long':
+            # Don't need to check the score
+            return {'avg_score': 999, 'index': indices[order[-1]]}
+
+        color_matrix = self.index_registry.get_color_matrix(
+            sample.index_type.pk, index_group)
+        scores = self.calculate_scores(
+            sample, color_matrix[order], color_distribution)
+        avg_scores = scores.sum(axis=1) / self.index_length
+
+        best = int(np.argmin(avg_scores))
+        if avg_scores[best] < result_index['avg_score']:
+            result_index = {
+                'avg_score': float(avg_scores[best]),
+                'index': indices[order[best]],
+            }
 
         return result_index
 
@@ -519,13 +913,17 @@ class IndexGenerator:
         if not any(samples):
             return init_pairs
         pairs = list(init_pairs)
+        color_distribution = self.calculate_color_distribution(
+            [self.pair_sequence(x) for x in pairs], depths)
 
         for sample in samples:
-            pair = self.find_pair(sample, depths, pairs)
+            pair = self.find_pair(sample, pairs, color_distribution)
             if 'pair' not in pair:
                 raise ValueError('Pair not found.')
             pair = pair['pair']
             pairs.append(pair)
+            color_distribution.add(
+                self.pair_sequence(pair), depths[len(pairs) - 1])
 
         if len(pairs) == len(init_pairs) + len(samples):
             library_pairs = [x for x in pairs if x[0]['is_library']]
@@ -537,50 +935,52 @@ class IndexGenerator:
         raise ValueError('Could not generate index pairs for the ' +
                          'selected samples.')
 
-    def find_pair(self, sample, depths, current_pairs):
+    def find_pair(self, sample, current_pairs, color_distribution):
         """ Helper function for `find_pairs()`. """
         result_pair = {'avg_score': 100.0}
-        pairs = list(self.index_registry.get_pairs(sample.index_type.pk))
-        random.shuffle(pairs)
+        pairs = self.index_registry.get_pairs(sample.index_type.pk)
+        order = list(range(len(pairs)))
+        random.shuffle(order)
 
         # Ensure uniqueness
         if self.mode == 'single':
-            pairs = [
-                x for x in pairs
-                if (x.index1, x.index2) not in current_pairs
+            order = [
+                i for i in order
+                if (pairs[i].index1, pairs[i].index2) not in current_pairs
             ]
 
-        if self.mode == 'single':
-            indices_in_result = list(map(
-                lambda x: x[0]['index'], current_pairs))
-        else:
-            indices_in_result = list(map(
-                lambda x: x[0]['index'] + x[1]['index'],
-                current_pairs,
-            ))
-
-        # Calculate color distribution
-        index_length = len(indices_in_result[0])
-        color_distribution, total_depth = self.calculate_color_distribution(
-            indices_in_result, depths, sample)
-
-        for pair in pairs:
-            if sample.index_type.read_type == 'long':
-                result_pair = {
-                    'avg_score': 999,
-                    'pair': (pair.index1, pair.index2),
-                }
-            else:
-                converted_index = self.convert_index(
-                    self._concat_index_pair(pair))
-                scores = self.calculate_scores(
-                    sample, converted_index, color_distribution, total_depth)
-                avg_score = sum(scores) / index_length
-                if avg_score < result_pair['avg_score']:
-                    result_pair = {
-                        'avg_score': avg_score,
-                        'pair': (pair.index1, pair.index2),
-                    }
+        if self.min_distance > 1 and order:
+            packed_i7, packed_i5 = self.index_registry.get_packed_pairs(
+                sample.index_type.pk)
+            blocked = collision_matrix(
+                packed_i7, packed_i5,
+                encode_nucleotides([x[0]['index'] for x in current_pairs]),
+                encode_nucleotides([x[1]['index'] for x in current_pairs]),
+                self.min_distance,
+            ).any(axis=1)
+            order = [i for i in order if not blocked[i]]
+
+        if not order:
+            return result_pair
+
+        if sample.index_type.read_type == 'long':
+            # Don't need to check the score
+            pair = pairs[order[-1]]
+            return {'avg_score': 999, 'pair': (pair.index1, pair.index2)}
+
+        color_matrix = self.index_registry.get_pairs_color_matrix(
+            sample.index_type.pk)
+        scores = self.calculate_scores(
+            sample, color_matrix[order], color_distribution)
+        avg_scores = scores.sum(axis=1) / max(len(color_distribution), 1)
+
+        best = int(np.argmin(avg_scores))
+        if avg_scores[best] < result_pair['avg_score']:
+            pair = pairs[order[best]]
+            result_pair = {
+                'avg_score': float(avg_scores[best]),
+                'pair': (pair.index1, pair.index2),
+            }
 
         return result_pair
 
@@ -606,31 +1006,59 @@ class IndexGenerator:
                     x for x in pairs
                     if (x.index1['index'], x.index2['index']) not in indices_in_result
                 ]
+            if self.min_distance > 1:
+                pairs = self.skip_colliding_pairs(
+                    pairs, indices_in_result, len(samples))
             if len(samples) > len(pairs):
                 raise IndexError(f'Not enough indices of type {sample.index_type} for given number of samples')
             for i, sample in enumerate(samples):
                 pair = pairs[i]
                 result.append((pair.index1, pair.index2))
+                indices_in_result.append(
+                    (pair.index1['index'], pair.index2['index']))
 
         return result
 
-    def calculate_color_distribution(self, indices, sequencing_depths, sample):
-        total_depth = 0
-        index_length = len(indices[0])
-        color_distribution = [{'G': 0, 'R': 0} for _ in range(index_length)]
-        for i, index in enumerate(indices):
-            idx = self.convert_index(index)
-            for cycle in range(index_length):
-                color = idx[cycle]
-                color_distribution[cycle][color] += sequencing_depths[i]
-            total_depth += sequencing_depths[i]
-        total_depth += sample.sequencing_depth
-        return color_distribution, total_depth
+    def skip_colliding_pairs(self, pairs, init_pairs, num_pairs):
+        """
+        Return the first `num_pairs` index pairs, in the given order, which
+        don't collide with the initial pairs nor with each other.
+        """
+        result = []
+        pool_i7 = [x[0] for x in init_pairs]
+        pool_i5 = [x[1] for x in init_pairs]
 
-    def calculate_scores(self, current_sample, current_converted_index,
-                         current_color_distribution, total_depth):
+        for pair in pairs:
+            if len(result) == num_pairs:
+                break
+
+            is_colliding = collision_matrix(
+                encode_nucleotides([pair.index1['index']]),
+                encode_nucleotides([pair.index2['index']]),
+                encode_nucleotides(pool_i7),
+                encode_nucleotides(pool_i5),
+                self.min_distance,
+            ).any()
+
+            if not is_colliding:
+                result.append(pair)
+                pool_i7.append(pair.index1['index'])
+                pool_i5.append(pair.index2['index'])
+
+        return result
+
+    def calculate_color_distribution(self, indices, sequencing_depths):
+        """
+        Calculate the total sequencing depth read in the green and in the red
+        channel for each cycle of given indices.
+        """
+        return ColorDistribution.from_indices(indices, sequencing_depths)
+
+    def calculate_scores(self, current_sample, color_matrix,
+                         color_distribution):
         """
-        Calculate the scores for a given sample.
+        Calculate the scores of all candidate indices (rows of the
+        red/green matrix) for a given sample.
 
         Score is an absolute difference between the sequencing depths of
         the two indices divided by the total sequencing depth (in %).
@@ -640,26 +1068,26 @@ class IndexGenerator:
 
         If the score > 60%, then the indices are not compatible.
         """
-        distribution = list(current_color_distribution)
-        result = []
-
-        for cycle in range(len(current_converted_index)):
-            color = current_converted_index[cycle]
-            distribution[cycle][color] += current_sample.sequencing_depth
+        return color_distribution.scores(
+            color_matrix, current_sample.sequencing_depth)
 
-            if distribution[cycle]['G'] > 0 and distribution[cycle]['R'] > 0:
-                difference = abs((distribution[cycle]['G'] -
-                                  distribution[cycle]['R']) /
-                                 total_depth) * 100
-                result.append(difference)
-            else:
-                result.append(100.0)
+    def pair_sequence(self, pair):
+        """ Return the sequence of an index pair read by the sequencer. """
+        if self.mode == 'single':
+            return pair[0]['index']
+        return pair[0]['index'] + pair[1]['index']
 
-        return result
+    def has_collisions(self, indices_i7, indices_i5):
+        """
+        Check if any two index pairs (Index I7, Index I5) are identical or,
+        if a minimum distance is set, closer than the minimum distance.
+        """
+        if self.min_distance > 1:
+            return any(find_collisions(
+                indices_i7, indices_i5, self.min_distance))
 
-    def _concat_index_pair(self, pair):
-        return pair.index1['index'] + pair.index2['index'] \
-            if self.mode == 'dual' else pair.index1['index']
+        pairs = list(zip(indices_i7, indices_i5))
+        return len(pairs) != len(set(pairs))
 
     @property
     def result(self):
@@ -670,6 +1098,8 @@ class IndexGenerator:
             index_i7 = record['index_i7']
             index_i5 = record['index_i5']
             rec = dict(record)
+            rec['index_i7'] = index_i7.to_dict()
+            rec['index_i5'] = index_i5.to_dict()
 
             rec['coordinate'] = index_i7['coordinate']
             rec['index_i7_id'] = index_i7['prefix'] + index_i7['number']
@@ -0,0 +1,79 @@
+import json
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from index_generator.benchmarks import IndexGeneratorBenchmark, WORKLOADS
+from index_generator.index_generator import IndexGenerator
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the index generator on synthetic plate/tube workloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, dest='seed',
+                            help='random seed')
+        parser.add_argument('--repeat', type=int, default=3, dest='repeat',
+                            help='number of runs per workload')
+        parser.add_argument('--strategy', type=str, default=None,
+                            choices=IndexGenerator.STRATEGIES,
+                            dest='strategy', help='assignment strategy')
+        parser.add_argument('--workload', type=str, default='',
+                            dest='workload',
+                            help='only run workloads containing this string')
+        parser.add_argument('--max-time', type=float, default=None,
+                            dest='max_time',
+                            help='fail if any median time (s) exceeds this')
+        parser.add_argument('--keepdb', action='store_true', dest='keepdb',
+                            help='keep the benchmark database')
+        parser.add_argument('--json', action='store_true', dest='json',
+                            help='print the results as JSON')
+
+    def handle(self, *args, **options):
+        workloads = [x for x in WORKLOADS if options['workload'] in x.name]
+        if not workloads:
+            raise CommandError('No workloads match the given name.')
+
+        # The benchmark creates its own data, never touch the real database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+
+        try:
+            benchmark = IndexGeneratorBenchmark(
+                options['seed'], options['strategy'], options['repeat'])
+            results = [benchmark.run(x) for x in workloads]
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.write_table(results)
+
+        slow = [
+            x['workload'] for x in results
+            if options['max_time'] is not None and
+            x['time_median'] > options['max_time']
+        ]
+        if slow:
+            raise CommandError(
+                'Time limit exceeded: {}.'.format(', '.join(slow)))
+
+    def write_table(self, results):
+        row = '{:<26} {:>7} {:>10} {:>10} {:>8} {:>10}  {}'
+        self.stdout.write(row.format(
+            'Workload', 'Samples', 'First (s)', 'Median (s)', 'Queries',
+            'Peak (KB)', 'Error'))
+
+        for x in results:
+            self.stdout.write(row.format(
+                x['workload'],
+                x['samples'],
+                '{:.3f}'.format(x['time_first']),
+                '{:.3f}'.format(x['time_median']),
+                x['queries'],
+                x['peak_memory'] // 1024,
+                x['error'],
+            ))
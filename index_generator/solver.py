@@ -0,0 +1,222 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .colors import RED, GREEN, NO_COLOR
+from .distance import PackedIndices, encode_nucleotides, collision_matrix
+
+State = namedtuple('State', ['green', 'red', 'used', 'blocked', 'picks'])
+
+
+class BeamSearchSolver:
+    """
+    Deterministic assignment of indices to samples using beam search.
+
+    Samples are placed one by one, from the highest sequencing depth to the
+    lowest. At each step every partial assignment kept in the beam is
+    extended with every candidate which is not in the pool yet, and only
+    `beam_width` extensions with the lowest worst-cycle color imbalance
+    are kept. Once `time_limit` (in seconds) is exceeded, the search
+    continues greedily, i.e., only the best partial assignment is extended
+    (even if the limit is exceeded while a step is being expanded).
+
+    If `min_distance` is greater than 1, candidates colliding with an index
+    pair already in the pool (see `distance.collision_matrix()`) are
+    skipped as well.
+    """
+
+    def __init__(self, beam_width=8, time_limit=5.0, min_distance=0):
+        self.beam_width = beam_width
+        self.time_limit = time_limit
+        self.min_distance = min_distance
+        self._key_ids = {}
+
+    def solve(self, init_colors, init_depths, init_keys, candidates, samples):
+        """
+        Find the best candidate for each sample.
+
+        `init_colors`, `init_depths` and `init_keys` describe the indices
+        which are already in the pool. `candidates` maps a group id to
+        a pair (red/green matrix, uniqueness keys), and `samples` is a list
+        of (group id, sequencing depth) tuples. Uniqueness keys are
+        (Index I7, Index I5) sequences.
+
+        Return the list of chosen candidate positions (one per sample),
+        the worst-cycle score and the average score of the resulting pool.
+        """
+        self._key_ids = {}
+        init_ids = self.to_ids(init_keys)
+        groups = {
+            group: (matrix, self.to_ids(keys))
+            for group, (matrix, keys) in candidates.items()
+        }
+
+        width = max(
+            [init_colors.shape[1]] + [x.shape[1] for x, _ in groups.values()])
+        init_colors = self.pad(init_colors, width)
+        groups = {
+            group: (self.pad(matrix, width), ids)
+            for group, (matrix, ids) in groups.items()
+        }
+
+        depths = np.array(init_depths, dtype=float)
+        used = np.zeros(len(self._key_ids), dtype=bool)
+        used[init_ids] = True
+
+        packed, blocked = {}, None
+        if self.min_distance > 1:
+            packed = {
+                group: self.pack(keys)
+                for group, (_, keys) in candidates.items()
+            }
+            blocked = self.block(packed, self.pack(init_keys), {
+                group: np.zeros(len(x.codes), dtype=bool)
+                for group, (x, _) in packed.items()
+            })
+
+        beam = [State(
+            (init_colors == GREEN).T.dot(depths),
+            (init_colors == RED).T.dot(depths),
+            used,
+            blocked,
+            None,
+        )]
+        total_depth = depths.sum()
+
+        # Place the samples with the highest sequencing depth first
+        order = sorted(range(len(samples)), key=lambda i: -samples[i][1])
+        deadline = time.monotonic() + self.time_limit
+
+        for i in order:
+            group, depth = samples[i]
+            matrix, ids = groups[group]
+            total_depth += depth
+            beam_width = self.beam_width \
+                if time.monotonic() < deadline else 1
+
+            worst_scores, avg_scores, origins = [], [], []
+            for state_idx, state in enumerate(beam):
+                # The beam is sorted, so the best assignment is always kept
+                if state_idx and time.monotonic() >= deadline:
+                    break
+
+                scores = self.calculate_scores(
+                    state.green + depth * (matrix == GREEN),
+                    state.red + depth * (matrix == RED),
+                    total_depth,
+                )
+                worst = scores.max(axis=1) if scores.size else \
+                    np.zeros(len(matrix))
+                worst[state.used[ids]] = np.inf
+                if state.blocked is not None:
+                    worst[state.blocked[group]] = np.inf
+                worst_scores.append(worst)
+                avg_scores.append(scores.mean(axis=1) if scores.size else
+                                  np.zeros(len(matrix)))
+                origins.extend((state_idx, x) for x in range(len(matrix)))
+
+            worst_scores = np.concatenate(worst_scores)
+            avg_scores = np.concatenate(avg_scores)
+            best = [
+                x for x in np.lexsort((avg_scores, worst_scores))[:beam_width]
+                if np.isfinite(worst_scores[x])
+            ]
+
+            if not best:
+                raise ValueError('Not enough unique indices for the ' +
+                                 'selected samples.')
+
+            new_beam = []
+            for x in best:
+                state_idx, candidate = origins[x]
+                state = beam[state_idx]
+                used = state.used.copy()
+                used[ids[candidate]] = True
+
+                blocked = state.blocked
+                if blocked is not None:
+                    blocked = self.block(packed, tuple(
+                        PackedIndices(
+                            x.codes[candidate:candidate + 1],
+                            x.lengths[candidate:candidate + 1],
+                        )
+                        for x in packed[group]
+                    ), blocked)
+
+                new_beam.append(State(
+                    state.green + depth * (matrix[candidate] == GREEN),
+                    state.red + depth * (matrix[candidate] == RED),
+                    used,
+                    blocked,
+                    (i, candidate, state.picks),  # linked list of picks
+                ))
+            beam = new_beam
+
+        best = beam[0]
+        scores = self.calculate_scores(best.green, best.red, total_depth)
+        worst_score = float(scores.max()) if scores.size else 0.0
+        avg_score = float(scores.mean()) if scores.size else 0.0
+
+        picks = [None] * len(samples)
+        node = best.picks
+        while node is not None:
+            i, candidate, node = node
+            picks[i] = candidate
+
+        return picks, worst_score, avg_score
+
+    def to_ids(self, keys):
+        """ Map hashable uniqueness keys to integer ids. """
+        return np.array([
+            self._key_ids.setdefault(key, len(self._key_ids)) for key in keys
+        ], dtype=np.int64)
+
+    def block(self, packed, pool, blocked):
+        """
+        Return the masks of candidates which are blocked, updated with
+        the candidates colliding with given index pairs.
+        """
+        pool_i7, pool_i5 = pool
+        if not len(pool_i7.codes):
+            return blocked
+
+        return {
+            group: blocked[group] | collision_matrix(
+                candidates_i7, candidates_i5, pool_i7, pool_i5,
+                self.min_distance,
+            ).any(axis=1)
+            for group, (candidates_i7, candidates_i5) in packed.items()
+        }
+
+    @staticmethod
+    def pack(keys):
+        """ Pack the indices I7 and I5 of given uniqueness keys. """
+        return (
+            encode_nucleotides([x[0] for x in keys]),
+            encode_nucleotides([x[1] for x in keys]),
+        )
+
+    @staticmethod
+    def pad(matrix, width):
+        """ Pad a red/green matrix with `NO_COLOR` up to a given width. """
+        if matrix.shape[1] >= width:
+            return matrix
+        return np.pad(
+            matrix, ((0, 0), (0, width - matrix.shape[1])),
+            'constant', constant_values=NO_COLOR,
+        )
+
+    @staticmethod
+    def calculate_scores(green, red, total_depth):
+        """
+        Calculate the per-cycle scores (see
+        `IndexGenerator.calculate_scores()`). Cycles without any base
+        are not scored.
+        """
+        scores = np.where(
+            (green > 0) & (red > 0),
+            np.abs(green - red) / total_depth * 100,
+            100.0,
+        )
+        return np.where(green + red > 0, scores, 0.0)
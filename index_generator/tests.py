@@ -1,9 +1,16 @@
 import json
+import shutil
 import string
+import tempfile
 from collections import namedtuple
 
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TransactionTestCase, override_settings
+
 from common.tests import BaseTestCase
-from common.utils import get_random_name
+from common.utils import get_random_name, QueryCounter
 
 from request.tests import create_request
 from library_sample_shared.tests import create_index_type as _create_index_type
@@ -21,7 +28,14 @@ from library.models import Library
 from sample.models import Sample
 
 from .models import Pool, PoolSize
-from .index_generator import IndexRegistry, IndexGenerator
+from .index_generator import (
+    IndexRegistry, IndexRegistryCache, IndexGenerator, encode_colors,
+)
+from .index_generator import Index as RegistryIndex
+from .distance import encode_nucleotides, hamming_distances, find_collisions
+from .colors import ColorDistribution
+from .benchmarks import IndexGeneratorBenchmark, Workload
+from .views import get_executor
 
 
 Index = namedtuple('Index', ['prefix', 'number', 'index'])
@@ -434,6 +448,72 @@ class TestIndexRegistry(BaseTestCase):
             ['B4', 'C5', 'A4', 'B5', 'A5', 'E1', 'D1', 'E2']
         )
 
+    def test_compact_indices(self):
+        index_registry = IndexRegistry('dual', [self.index_type2])
+        pair = index_registry.pairs[self.index_type2.pk][0]
+        self.assertIsInstance(pair.index1, RegistryIndex)
+        self.assertFalse(hasattr(pair.index1, '__dict__'))
+        self.assertEqual(pair.index1['coordinate'], 'A1')
+        self.assertEqual(pair.index1.to_dict(), {
+            'format': 'plate',
+            'index_type': self.index_type2.pk,
+            'read_type': pair.index1.read_type,
+            'prefix': pair.index1.prefix,
+            'number': pair.index1.number,
+            'index': pair.index1.index,
+            'coordinate': 'A1',
+            'is_library': False,
+        })
+
+    def test_cached_registry(self):
+        index_registry1 = IndexRegistry('dual', [self.index_type2], 'B4')
+        with self.assertNumQueries(0):
+            index_registry2 = IndexRegistry('dual', [self.index_type2], 'B4')
+        self.assertEqual(
+            index_registry1.pairs[self.index_type2.pk],
+            index_registry2.pairs[self.index_type2.pk],
+        )
+
+    def test_cached_registry_invalidation(self):
+        index_registry = IndexRegistry('single', [self.index_type1])
+        self.assertEqual(
+            len(index_registry.indices[self.index_type1.pk]['i7']), 6)
+
+        index = IndexI7(prefix='Z', number='01', index='ACGTAC')
+        index.save()
+        self.index_type1.indices_i7.add(index)
+
+        index_type = IndexType.objects.get(pk=self.index_type1.pk)
+        index_registry = IndexRegistry('single', [index_type])
+        self.assertEqual(
+            len(index_registry.indices[self.index_type1.pk]['i7']), 7)
+
+    def test_cached_registry_invalidation_other_process(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        results_cache = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }
+
+        with override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'results': results_cache,
+        }):
+            IndexRegistry('single', [self.index_type1])
+            with self.assertNumQueries(0):
+                IndexRegistry('single', [self.index_type1])
+
+            # Another process invalidates the registries through its own
+            # instance of the results cache
+            other_cache = FileBasedCache(location, {})
+            other_cache.set(IndexRegistryCache.VERSION_KEY, 'other', None)
+
+            with self.assertNumQueries(1):
+                IndexRegistry('single', [self.index_type1])
+
     def test_invalid_start_coordinate(self):
         with self.assertRaises(ValueError) as context:
             IndexRegistry('dual', [self.index_type2], 'test')
@@ -537,6 +617,45 @@ class TestIndexGenerator(BaseTestCase):
             samples__id__in=[sample1.pk, sample2.pk]
         ).distinct().count(), 1)
 
+    def test_save_pool_query_count(self):
+        """
+        Ensure the number of queries doesn't depend on the number of
+        samples.
+        """
+        def save_pool(num_samples):
+            samples = [
+                create_sample(
+                    get_random_name(),
+                    read_length=self.read_length,
+                    index_type=self.index_type2,
+                )
+                for _ in range(num_samples)
+            ]
+
+            with QueryCounter() as counter:
+                response = self.client.post(
+                    '/api/index_generator/save_pool/', {
+                        'pool_size_id': self.pool_size.pk,
+                        'samples': json.dumps([
+                            {
+                                'pk': sample.pk,
+                                'index_i7': INDICES_2[i].index,
+                                'index_i5': INDICES_3[i].index,
+                            }
+                            for i, sample in enumerate(samples)
+                        ]),
+                    })
+            self.assertEqual(response.status_code, 200)
+
+            for i, sample in enumerate(samples):
+                sample.refresh_from_db()
+                self.assertEqual(sample.index_i7, INDICES_2[i].index)
+                self.assertEqual(sample.index_i5, INDICES_3[i].index)
+
+            return counter.count
+
+        self.assertEqual(save_pool(1), save_pool(4))
+
     def test_one_sample_format_tube_mode_single(self):
         """ Generate index for one sample (format=tube, mode=single). """
         sample = create_sample(
@@ -850,6 +969,195 @@ class TestIndexGenerator(BaseTestCase):
         # Check index pairs order
         self.assertEqual(index_pairs, correct_pairs)
 
+    def test_beam_strategy_format_tube_mode_dual(self):
+        """ Ensure the beam search solver generates unique index pairs. """
+        samples = [
+            create_sample(
+                get_random_name(),
+                read_length=self.read_length,
+                index_type=self.index_type2,
+            ).pk
+            for _ in range(4)
+        ]
+
+        response = self.client.post('/api/index_generator/generate_indices/', {
+            'samples': json.dumps(samples),
+            'strategy': 'beam',
+        })
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['data']), 4)
+        self.assertEqual(data['metadata']['strategy'], 'beam')
+        self.assertLessEqual(data['metadata']['score'], 100.0)
+
+        pairs = [(x['index_i7_id'], x['index_i5_id']) for x in data['data']]
+        self.assertEqual(len(pairs), len(set(pairs)))
+
+        # The result must be deterministic
+        response = self.client.post('/api/index_generator/generate_indices/', {
+            'samples': json.dumps(samples),
+            'strategy': 'beam',
+        })
+        self.assertEqual(response.json()['data'], data['data'])
+
+    def test_combine_indices(self):
+        positions = list(IndexGenerator.combine_indices(3, 2))
+        self.assertEqual(len(set(positions)), 6)
+        self.assertEqual(
+            sorted(positions), [(i, j) for i in range(3) for j in range(2)])
+
+        # The first combinations contain every I7 and as many I5
+        self.assertEqual(positions[:3], [(0, 0), (1, 1), (2, 0)])
+
+    def test_candidates_bounded(self):
+        class BoundedIndexGenerator(IndexGenerator):
+            MAX_CANDIDATES = 4
+
+        sample = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type2,
+        )
+        index_generator = BoundedIndexGenerator([], [sample.pk], None, None)
+        pairs, color_matrix, keys = index_generator.get_candidates(
+            self.index_type2)
+
+        self.assertEqual(len(pairs), 4)
+        self.assertEqual(len(set(keys)), 4)
+        self.assertEqual(len({x[0]['index'] for x in pairs}), 4)
+        self.assertTrue(np.array_equal(color_matrix, encode_colors(
+            [x[0]['index'] + x[1]['index'] for x in pairs])))
+
+    def test_beam_strategy_formats_plate_and_tube_mode_dual(self):
+        sample1 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type2,
+        )
+        sample2 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type5,
+        )
+        sample3 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type5,
+        )
+
+        response = self.client.post('/api/index_generator/generate_indices/', {
+            'samples': json.dumps([sample1.pk, sample2.pk, sample3.pk]),
+            'strategy': 'beam',
+        })
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['data']), 3)
+
+        for item in data['data']:
+            if item['pk'] == sample1.pk:
+                continue
+            self.assertEqual(IndexPair.objects.filter(
+                index_type=self.index_type5,
+                index1__index=item['index_i7']['index'],
+                index2__index=item['index_i5']['index'],
+            ).count(), 1)
+
+    def test_min_distance_format_tube_mode_single(self):
+        """ Ensure generated indices are not closer than the min distance. """
+        samples = [
+            create_sample(
+                get_random_name(),
+                read_length=self.read_length,
+                index_type=self.index_type1,
+            ).pk
+            for _ in range(3)
+        ]
+
+        for strategy in ['random', 'beam']:
+            response = self.client.post(
+                '/api/index_generator/generate_indices/', {
+                    'samples': json.dumps(samples),
+                    'strategy': strategy,
+                    'min_distance': 5,
+                })
+            data = response.json()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['success'])
+
+            indices = [x['index_i7']['index'] for x in data['data']]
+            self.assertEqual(find_collisions(indices, [''] * 3, 5), [])
+
+    def test_min_distance_format_tube_mode_dual(self):
+        """ Ensure generated pairs are not closer than the min distance. """
+        samples = [
+            create_sample(
+                get_random_name(),
+                read_length=self.read_length,
+                index_type=self.index_type2,
+            ).pk
+            for _ in range(4)
+        ]
+
+        for strategy in ['random', 'beam']:
+            response = self.client.post(
+                '/api/index_generator/generate_indices/', {
+                    'samples': json.dumps(samples),
+                    'strategy': strategy,
+                    'min_distance': 3,
+                })
+            data = response.json()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['success'])
+            self.assertEqual(len(data['data']), 4)
+
+            indices_i7 = [x['index_i7']['index'] for x in data['data']]
+            indices_i5 = [x['index_i5']['index'] for x in data['data']]
+            self.assertEqual(find_collisions(indices_i7, indices_i5, 3), [])
+
+    @override_settings(INDEX_GENERATOR_WORKERS=1)
+    def test_generate_indices_batch(self):
+        sample1 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type1,
+        )
+        sample2 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type2,
+        )
+
+        response = self.client.post(
+            '/api/index_generator/generate_indices_batch/', {
+                'pools': json.dumps([
+                    {'samples': [sample1.pk]},
+                    {'samples': [sample2.pk], 'strategy': 'beam'},
+                    {'samples': []},
+                ]),
+            })
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['data']), 3)
+
+        self.assertTrue(data['data'][0]['success'])
+        self.assertEqual(data['data'][0]['data'][0]['pk'], sample1.pk)
+        self.assertTrue(data['data'][1]['success'])
+        self.assertEqual(data['data'][1]['data'][0]['pk'], sample2.pk)
+        self.assertFalse(data['data'][2]['success'])
+        self.assertEqual(data['data'][2]['message'], 'No samples provided.')
+        self.assertIn('time', data['data'][0])
+
+    def test_generate_indices_batch_no_pools(self):
+        response = self.client.post(
+            '/api/index_generator/generate_indices_batch/')
+        data = response.json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['message'], 'No pools have been provided.')
+
     def test_libraries_and_samples_format_tube_mode_single(self):
         index_i7_ids = [x.index_id for x in self.index_type1.indices_i7.all()]
 
@@ -878,6 +1186,46 @@ class TestIndexGenerator(BaseTestCase):
         self.assertEqual(data['data'][0]['index_i7_id'], 'A06')
         self.assertIn(data['data'][1]['index_i7_id'], index_i7_ids)
 
+    def test_libraries_query_count(self):
+        """
+        Ensure the number of queries doesn't depend on the number of
+        libraries.
+        """
+        def generate(num_libraries):
+            libraries = []
+            for i in range(num_libraries):
+                library = create_library(
+                    get_random_name(),
+                    read_length=self.read_length,
+                    index_type=self.index_type2,
+                )
+                library.index_i7 = INDICES_2[i].index
+                library.index_i5 = INDICES_3[i].index
+                library.save()
+                libraries.append(library.pk)
+
+            sample = create_sample(
+                get_random_name(),
+                read_length=self.read_length,
+                index_type=self.index_type2,
+            )
+
+            response = self.client.post(
+                '/api/index_generator/generate_indices/', {
+                    'libraries': json.dumps(libraries),
+                    'samples': json.dumps([sample.pk]),
+                })
+            data = response.json()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['success'])
+            self.assertEqual(
+                [x['index_i7_id'] for x in data['data']][:num_libraries],
+                [f'B0{i + 1}' for i in range(num_libraries)],
+            )
+            return data['metadata']['queries']
+
+        self.assertEqual(generate(1), generate(4))
+
     def test_libraries_and_samples_format_tube_mode_dual(self):
         index_i7_ids = [x.index_id for x in self.index_type2.indices_i7.all()]
         index_i5_ids = [x.index_id for x in self.index_type2.indices_i5.all()]
@@ -1116,6 +1464,81 @@ class TestIndexGenerator(BaseTestCase):
         self.assertEqual(
             data['message'], 'Some of the indices are not unique.')
 
+    def test_save_pool_too_similar(self):
+        """ Ensure error is thrown if a pool contains near collisions. """
+        sample1 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type1,
+        )
+        sample2 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type1,
+        )
+
+        response = self.client.post('/api/index_generator/save_pool/', {
+            'pool_size_id': self.pool_size.pk,
+            'min_distance': 3,
+            'samples': json.dumps([
+                {
+                    'pk': sample1.pk,
+                    'index_i7': 'GTAAAT',
+                    'index_i5': '',
+                },
+                {
+                    'pk': sample2.pk,
+                    'index_i7': 'GTAAAC',
+                    'index_i5': '',
+                },
+            ]),
+        })
+        data = response.json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(
+            data['message'], 'Some of the indices are too similar.')
+
+    def test_save_pool_index_i5_not_set(self):
+        """
+        Ensure nothing is saved if one of the samples has no I5 index.
+        """
+        sample1 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type2,
+        )
+        sample2 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type2,
+        )
+
+        response = self.client.post('/api/index_generator/save_pool/', {
+            'pool_size_id': self.pool_size.pk,
+            'samples': json.dumps([
+                {
+                    'pk': sample1.pk,
+                    'index_i7': INDICES_2[0].index,
+                    'index_i5': INDICES_3[0].index,
+                },
+                {
+                    'pk': sample2.pk,
+                    'index_i7': INDICES_2[1].index,
+                    'index_i5': '',
+                },
+            ]),
+        })
+        data = response.json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(
+            data['message'], f'Index I5 is not set for "{sample2.name}".')
+
+        sample1.refresh_from_db()
+        self.assertIsNone(sample1.index_i7)
+        self.assertFalse(Pool.objects.filter(samples=sample1).exists())
+
     def test_not_enough_indices_format_tube_mode_single(self):
         """ Ensure error is thrown if the number of samples is greater than
         the number of unique indices. """
@@ -1180,6 +1603,42 @@ class TestIndexGenerator(BaseTestCase):
         self.assertEqual(
             data['message'], f'Index I7 is not set for "{sample.name}".')
 
+    def test_save_pool_missing_index_i7_min_distance(self):
+        """ Ensure a missing index I7 is reported before near collisions. """
+        sample1 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type1,
+        )
+        sample2 = create_sample(
+            get_random_name(),
+            read_length=self.read_length,
+            index_type=self.index_type1,
+        )
+
+        response = self.client.post('/api/index_generator/save_pool/', {
+            'pool_size_id': self.pool_size.pk,
+            'min_distance': 3,
+            'samples': json.dumps([
+                {
+                    'pk': sample1.pk,
+                    'index_i7': 'GTAAAT',
+                    'index_i5': '',
+                },
+                {
+                    'pk': sample2.pk,
+                    'index_i7': None,
+                    'index_i5': '',
+                },
+            ]),
+        })
+
+        data = response.json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(
+            data['message'], f'Index I7 is not set for "{sample2.name}".')
+
     def test_save_pool_missing_index_i5(self):
         sample = create_sample(
             get_random_name(),
@@ -1214,6 +1673,18 @@ class TestIndexGenerator(BaseTestCase):
         self.assertFalse(data['success'])
         self.assertEqual(data['message'], 'No samples provided.')
 
+    def test_invalid_strategy(self):
+        sample = create_sample(
+            get_random_name(), index_type=self.index_type1)
+        response = self.client.post('/api/index_generator/generate_indices/', {
+            'samples': json.dumps([sample.pk]),
+            'strategy': 'foo',
+        })
+        self.assertEqual(response.status_code, 400)
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['message'], 'Invalid strategy.')
+
     def test_read_length(self):
         """ Ensure error is thrown if Read Length is not the same. """
         library = create_library(get_random_name())
@@ -1310,6 +1781,56 @@ class TestIndexGenerator(BaseTestCase):
         converted_index = IndexGenerator.convert_index('ATCACG')
         self.assertEqual(converted_index, 'RGRRRG')
 
+    def test_color_encoding(self):
+        color_matrix = encode_colors(['ATCACG', 'GTA'])
+        self.assertEqual(color_matrix.tolist(), [
+            [0, 1, 0, 0, 0, 1],
+            [1, 1, 0, -1, -1, -1],
+        ])
+
+    def test_hamming_distances(self):
+        indices = encode_nucleotides(['GTAAAT', 'GTAAAC', 'CATTTA', 'GTA'])
+        self.assertEqual(hamming_distances(indices, indices).tolist(), [
+            [0, 1, 6, 0],
+            [1, 0, 6, 0],
+            [6, 6, 0, 3],
+            [0, 0, 3, 0],
+        ])
+
+    def test_find_collisions(self):
+        self.assertEqual(find_collisions(
+            ['GTAAAT', 'GTAAAC', 'GTAAAT'],
+            ['CATTTA', 'CATTTA', 'GTAAAT'],
+            2,
+        ), [(0, 1)])
+
+    def test_scores_calculation(self):
+        sample = create_sample(get_random_name(), save=False)
+        sample.sequencing_depth = 10
+        index_generator = IndexGenerator.__new__(IndexGenerator)
+        distribution = index_generator.calculate_color_distribution(
+            ['ATCACG'], [10])
+        scores = index_generator.calculate_scores(
+            sample, encode_colors(['TATGTA', 'ATCACG']), distribution)
+        self.assertEqual(scores.tolist(), [[0.0] * 6, [100.0] * 6])
+
+    def test_incremental_color_distribution(self):
+        indices = ['ATCACG', 'CGATGT', 'TTAGGC', 'TGACCA']
+        depths = [50, 20, 10, 5]
+        distribution = ColorDistribution.from_indices(indices[:1], depths)
+        for i, index in enumerate(indices[1:], 1):
+            distribution.add(index, depths[i])
+
+        expected = ColorDistribution.from_indices(indices, depths)
+        self.assertEqual(distribution.green.tolist(), expected.green.tolist())
+        self.assertEqual(distribution.red.tolist(), expected.red.tolist())
+        self.assertEqual(distribution.total_depth, 85)
+
+        # Scoring candidates doesn't modify the distribution
+        distribution.scores(encode_colors(['GGGGGG', 'ATC']), 10)
+        self.assertEqual(distribution.green.tolist(), expected.green.tolist())
+        self.assertEqual(distribution.total_depth, 85)
+
     def test_result_dict_creation(self):
         sample = create_sample(get_random_name())
         result_dict = IndexGenerator.create_result_dict(sample, {}, {})
@@ -1322,3 +1843,67 @@ class TestIndexGenerator(BaseTestCase):
             'index_i7': {},
             'index_i5': {},
         })
+
+    def test_benchmark(self):
+        benchmark = IndexGeneratorBenchmark(repeat=2)
+        for workload in [
+            Workload('tube', 'single', True, 8, 10, 5),
+            Workload('plate', 'plate', True, 8, 96, 5),
+        ]:
+            result = benchmark.run(workload)
+            self.assertEqual(result['workload'], workload.name)
+            self.assertEqual(result['samples'], 5)
+            self.assertEqual(result['error'], '')
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_memory'], 0)
+
+
+@override_settings(INDEX_GENERATOR_WORKERS=2)
+class TestIndexGeneratorBatch(TransactionTestCase):
+    """
+    Batch generation in worker threads. The data must be committed for
+    the workers' own database connections to see it.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        User.objects.create_user(
+            email='test@test.io', password='foo-bar', is_staff=True)
+        self.client.login(email='test@test.io', password='foo-bar')
+
+        self.read_length = ReadLength(name=get_random_name())
+        self.read_length.save()
+        self.index_type1 = create_index_type(INDICES_1)
+        self.index_type2 = create_index_type(INDICES_2, INDICES_3)
+
+    def test_generate_indices_batch_workers(self):
+        samples = [
+            create_sample(
+                get_random_name(),
+                read_length=self.read_length,
+                index_type=index_type,
+            )
+            for index_type in [self.index_type1, self.index_type2]
+        ]
+
+        response = self.client.post(
+            '/api/index_generator/generate_indices_batch/', {
+                'pools': json.dumps([
+                    {'samples': [samples[0].pk]},
+                    {'samples': [samples[1].pk], 'strategy': 'beam'},
+                    {'samples': [0]},
+                ]),
+            })
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+
+        # The results are returned in the order of the pools
+        self.assertEqual(
+            [x['success'] for x in data['data']], [True, True, False])
+        self.assertEqual(data['data'][0]['data'][0]['pk'], samples[0].pk)
+        self.assertEqual(data['data'][1]['data'][0]['pk'], samples[1].pk)
+        self.assertTrue(data['data'][1]['data'][0]['index_i5']['index'])
+
+        # The worker threads are shared by all requests
+        self.assertIs(get_executor(), get_executor())
@@ -1,9 +1,13 @@
 import json
+import time
 import logging
 import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from django.apps import apps
-from django.db.models import Prefetch, Q
+from django.db import connections, transaction
+from django.db.models import Prefetch, Q, Case, When, Value, CharField
 
 from rest_framework import viewsets
 from rest_framework.response import Response
@@ -14,6 +18,7 @@ from common.mixins import LibrarySampleMultiEditMixin
 
 from .models import Pool, PoolSize
 from .index_generator import IndexGenerator
+from .distance import find_collisions
 from .serializers import (
     PoolSizeSerializer,
     IndexGeneratorSerializer,
@@ -32,6 +37,80 @@ IndexType = apps.get_model('library_sample_shared','IndexType')
 
 logger = logging.getLogger('db')
 
+# Worker threads of the batch generation, shared by all requests
+executor = None
+executor_lock = threading.Lock()
+
+
+def generate_pool(pool):
+    """
+    Generate indices for a given pool definition. Used by the batch
+    generation, possibly in a worker thread.
+    """
+    start = time.time()
+
+    try:
+        index_generator = IndexGenerator(
+            pool.get('libraries', []),
+            pool.get('samples', []),
+            pool.get('start_coord', None),
+            pool.get('direction', None),
+            pool.get('strategy', None),
+            pool.get('min_distance', None),
+        )
+        result = {
+            'success': True,
+            'data': index_generator.generate(),
+            'metadata': index_generator.metadata,
+        }
+    except Exception as e:
+        result = {'success': False, 'message': str(e)}
+
+    result['time'] = time.time() - start
+    return result
+
+
+def generate_pool_in_thread(pool):
+    """
+    Generate indices for a pool in a worker thread, and close the
+    database connections of the thread afterwards.
+    """
+    try:
+        return generate_pool(pool)
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    """
+    Return the thread pool of the batch generation, created on first use
+    with `INDEX_GENERATOR_WORKERS` threads. The NumPy scoring releases the
+    GIL, so the pools are generated in parallel.
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.INDEX_GENERATOR_WORKERS,
+                thread_name_prefix='index-generator',
+            )
+    return executor
+
+
+def update_indices(samples, batch_size=200):
+    """
+    Set the indices of given samples with one UPDATE query per batch.
+    """
+    for i in range(0, len(samples), batch_size):
+        batch = samples[i:i + batch_size]
+        Sample.objects.filter(pk__in=[x['pk'] for x in batch]).update(**{
+            field: Case(
+                *[When(pk=x['pk'], then=Value(x[field])) for x in batch],
+                output_field=CharField(),
+            )
+            for field in ['index_i7', 'index_i5']
+        })
+
 
 class MoveOtherMixin:
     """ Move the `Other` option to the end of the returning list. """
@@ -151,6 +230,8 @@ class IndexGeneratorViewSet(viewsets.ViewSet, LibrarySampleMultiEditMixin):
         samples = json.loads(request.data.get('samples', '[]'))
         start_coord = request.data.get('start_coord', None)
         direction = request.data.get('direction', None)
+        strategy = request.data.get('strategy', None)
+        min_distance = request.data.get('min_distance', None)
 
         try:
             index_generator = IndexGenerator(
@@ -158,11 +239,48 @@ class IndexGeneratorViewSet(viewsets.ViewSet, LibrarySampleMultiEditMixin):
                 samples,
                 start_coord,
                 direction,
+                strategy,
+                min_distance,
             )
             data = index_generator.generate()
         except Exception as e:
             return Response({'success': False, 'message': str(e)}, 400)
-        return Response({'success': True, 'data': data})
+        return Response({
+            'success': True,
+            'data': data,
+            'metadata': index_generator.metadata,
+        })
+
+    @action(methods=['post'], detail=False)
+    def generate_indices_batch(self, request):
+        """
+        Generate indices for multiple pools at once. Each pool definition
+        contains the same parameters as `generate_indices`. The pools are
+        generated in parallel by up to `INDEX_GENERATOR_WORKERS` threads;
+        the response is returned once all of them are done.
+        """
+        start = time.time()
+
+        try:
+            pools = json.loads(request.data.get('pools', '[]'))
+            if not any(pools):
+                raise ValueError('No pools have been provided.')
+
+            workers = min(settings.INDEX_GENERATOR_WORKERS, len(pools))
+            if workers > 1:
+                data = list(get_executor().map(
+                    generate_pool_in_thread, pools))
+            else:
+                data = list(map(generate_pool, pools))
+
+        except Exception as e:
+            return Response({'success': False, 'message': str(e)}, 400)
+
+        return Response({
+            'success': True,
+            'data': data,
+            'time': time.time() - start,
+        })
 
     @action(methods=['post'], detail=False)
     def save_pool(self, request):
@@ -179,51 +297,61 @@ class IndexGeneratorViewSet(viewsets.ViewSet, LibrarySampleMultiEditMixin):
             if not any(libraries) and not any(samples):
                 raise ValueError('No libraries nor samples have been provided')
 
+            try:
+                min_distance = int(request.data.get('min_distance') or 0)
+            except ValueError:
+                raise ValueError('Invalid minimum distance.')
+
             try:
                 pool_size = PoolSize.objects.get(pk=pool_size_id)
             except (ValueError, PoolSize.DoesNotExist):
                 raise ValueError('Invalid Pool Size id.')
 
-            pool = Pool(user=request.user, size=pool_size)
-            pool.save()
-
             library_ids = [x['pk'] for x in libraries]
             sample_ids = [x['pk'] for x in samples]
 
+            # Check all samples' indices before changing anything
+            sample_objects = Sample.objects.select_related(
+                'index_type').only('name', 'index_type__is_dual').in_bulk(
+                    sample_ids)
+            for s in samples:
+                sample = sample_objects.get(s['pk'])
+                if sample is None:
+                    raise ValueError('Invalid sample id.')
+
+                if not s['index_i7']:
+                    raise ValueError(
+                        f'Index I7 is not set for "{sample.name}".')
+
+                if sample.index_type.is_dual and not s['index_i5']:
+                    raise ValueError(
+                        f'Index I5 is not set for "{sample.name}".')
+
             # Check all indices on uniqueness
             pairs = list(map(
                 lambda x: (x['index_i7'], x['index_i5']), libraries + samples))
             if len(pairs) != len(set(pairs)):
                 raise ValueError('Some of the indices are not unique.')
 
-            try:
-                for s in samples:
-                    sample = Sample.objects.get(pk=s['pk'])
-                    dual = sample.index_type.is_dual
-                    index_i7 = s['index_i7']
-                    index_i5 = s['index_i5']
-
-                    if index_i7 == '':
-                        raise ValueError(
-                            f'Index I7 is not set for "{sample.name}".')
+            # Check all indices on near collisions. Records without an
+            # index I7 can't be told apart by distance, so they are skipped
+            indexed = [x for x in pairs if x[0]]
+            if min_distance > 1 and any(find_collisions(
+                    [x[0] for x in indexed],
+                    [x[1] or '' for x in indexed],
+                    min_distance)):
+                raise ValueError('Some of the indices are too similar.')
 
-                    if dual and index_i5 == '':
-                        raise ValueError(
-                            f'Index I5 is not set for "{sample.name}".')
+            with transaction.atomic():
+                pool = Pool(user=request.user, size=pool_size)
+                pool.save()
 
-                    # Update sample fields
-                    sample.index_i7 = index_i7
-                    sample.index_i5 = index_i5
-                    sample.save(update_fields=['index_i7', 'index_i5'])
+                update_indices(samples)
 
-            except ValueError as e:
-                pool.delete()
-                raise e
+                pool.libraries.add(*library_ids)
+                pool.samples.add(*sample_ids)
 
         except Exception as e:
             return Response({'success': False, 'message': str(e)}, 400)
 
-        pool.libraries.add(*library_ids)
-        pool.samples.add(*sample_ids)
-
         return Response({'success': True})
@@ -2,6 +2,8 @@ from django.contrib import admin
 
 from .models import (
     InvoicingReport,
+    InvoicingPeriod,
+    Invoice,
     FixedCosts,
     LibraryPreparationCosts,
     SequencingCosts,
@@ -29,3 +31,18 @@ class SequencingCostsAdmin(admin.ModelAdmin):
     search_fields = ('sequencer__name', 'read_length__name', 'price',)
     list_display = ('sequencer', 'read_length', 'price_amount',)
     list_filter = ('sequencer', 'read_length',)
+
+
+@admin.register(InvoicingPeriod)
+class InvoicingPeriodAdmin(admin.ModelAdmin):
+    list_display = ('month', 'closed',)
+    list_filter = ('closed',)
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ('month', 'request', 'version', 'outdated',
+                    'superseded', 'total_costs',)
+    list_filter = ('month', 'outdated', 'superseded',)
+    search_fields = ('request__name',)
+    readonly_fields = ('update_time',)
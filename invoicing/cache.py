@@ -0,0 +1,3 @@
+# Key of the cached billing periods (see `InvoicingViewSet.billing_periods`),
+# deleted by the signals when a flowcell or an invoicing report is changed
+BILLING_PERIODS_KEY = 'invoicing-billing-periods'
@@ -0,0 +1,238 @@
+import logging
+import itertools
+from decimal import Decimal
+from collections import Counter, defaultdict, namedtuple
+
+from django.apps import apps
+from django.db.models import Sum
+
+from .models import FixedCosts, LibraryPreparationCosts, SequencingCosts
+
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+Pool = apps.get_model('index_generator', 'Pool')
+Lane = apps.get_model('flowcell', 'Lane')
+
+logger = logging.getLogger('db')
+
+
+class LaneShare(namedtuple('LaneShare', ['fraction', 'lanes'])):
+    """
+    Share of a request in a pool: the fraction of the pool's sequencing
+    depth (rounded to two decimals) and the number of lanes the pool is
+    loaded on.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_depths(cls, depth, total_depth, lanes):
+        fraction = round(depth / total_depth, 2) if total_depth else 0
+        return cls(Decimal(str(fraction)), lanes)
+
+    @property
+    def value(self):
+        """ Return the number of lanes the share amounts to. """
+        return self.fraction * self.lanes
+
+    def __str__(self):
+        fraction = float(self.fraction)
+        return f'{1 if fraction == 1 else fraction}*{self.lanes}'
+
+
+class CostCalculator:
+    """
+    Costs of the requests of a billing month, priced with the price
+    tables loaded once.
+    """
+
+    def __init__(self, year, month):
+        self.month = (int(year), int(month))
+
+        self.fixed_costs = dict(
+            FixedCosts.objects.values_list('sequencer', 'price'))
+        self.preparation_costs = dict(
+            LibraryPreparationCosts.objects.values_list(
+                'library_protocol', 'price'))
+        self.quality_control_costs = LibraryPreparationCosts.objects.filter(
+            library_protocol__name='Quality Control',
+        ).values_list('price', flat=True).first()
+        self.sequencing_costs = {
+            (sequencer, read_length): price
+            for sequencer, read_length, price
+            in SequencingCosts.objects.values_list(
+                'sequencer', 'read_length', 'price')
+        }
+
+    def get_costs(self, flowcells, num_records, is_samples, library_protocol):
+        """
+        Return the costs of a request. The fixed and sequencing costs are
+        billed for the shares on the month's flowcells; the preparation
+        costs for the records billed in the month.
+        """
+        fixed_costs = sequencing_costs = Decimal(0)
+        for flowcell in flowcells:
+            create_time = flowcell['flowcell_create_time']
+            if (create_time.year, create_time.month) != self.month:
+                continue
+
+            sequencer = flowcell['sequencer']
+            for pool in flowcell['pools']:
+                share = LaneShare(pool['fraction'], pool['lanes'])
+                fixed_costs += self.fixed_costs.get(sequencer, 0) * \
+                    share.value
+                sequencing_costs += self.sequencing_costs.get(
+                    (sequencer, pool['read_length']), 0) * share.value
+
+        if is_samples:
+            price = self.preparation_costs.get(library_protocol, 0)
+        elif self.quality_control_costs is not None:
+            price = self.quality_control_costs
+        else:
+            logger.error('Preparation Cost for libraries is not set.')
+            price = 0
+        preparation_costs = price * num_records
+
+        variable_costs = sequencing_costs + preparation_costs
+        return {
+            'fixed_costs': fixed_costs,
+            'sequencing_costs': sequencing_costs,
+            'preparation_costs': preparation_costs,
+            'variable_costs': variable_costs,
+            'total_costs': fixed_costs + variable_costs,
+        }
+
+
+class InvoicingEngine:
+    """
+    Lane shares and costs of the requests of a billing month. The
+    flowcells, lanes, pools and records of all requests are loaded with a
+    fixed number of bulk queries and everything is computed in memory.
+
+    The requests are expected to have their flowcells (with sequencers),
+    libraries and samples prefetched, as in `InvoicingViewSet.get_queryset`.
+    """
+
+    def __init__(self, requests, year, month):
+        self.requests = list(requests)
+        self.calculator = CostCalculator(year, month)
+        self._invoices = {}
+        self.load()
+
+    def load(self):
+        request_ids = [x.pk for x in self.requests]
+        flowcell_ids = {
+            flowcell.pk
+            for request in self.requests
+            for flowcell in request.flowcell.all()
+        }
+
+        # Number of lanes of each pool per flowcell
+        lanes = defaultdict(Counter)
+        for flowcell_id, pool_id in Lane.objects.filter(
+            flowcell__in=flowcell_ids,
+        ).values_list('flowcell', 'pool').order_by():
+            lanes[flowcell_id][pool_id] += 1
+
+        pool_ids = {x for counts in lanes.values() for x in counts}
+        pool_names = dict(Pool.objects.filter(
+            pk__in=pool_ids).values_list('pk', 'name'))
+
+        # Total sequencing depth of each pool
+        total_depths = Counter()
+        for model in [Library, Sample]:
+            for pool_id, depth in model.objects.filter(
+                pool__in=pool_ids,
+            ).values_list('pool').annotate(
+                depth=Sum('sequencing_depth'),
+            ).order_by():
+                total_depths[pool_id] += depth or 0
+
+        # Libraries and samples of each request per pool. The read length
+        # of a pool is the one of the request's first library (or sample)
+        records = {}
+        for key, model in [('libraries', Library), ('samples', Sample)]:
+            for x in model.objects.filter(
+                request__in=request_ids,
+                pool__in=pool_ids,
+            ).values(
+                'pk', 'request', 'pool', 'sequencing_depth', 'read_length',
+            ).order_by('pk'):
+                item = records.setdefault((x['request'], x['pool']), {
+                    'read_length': x['read_length'],
+                    'depth': 0,
+                    'libraries': [],
+                    'samples': [],
+                })
+                item['depth'] += x['sequencing_depth']
+                item[key].append(x['pk'])
+
+        for request in self.requests:
+            flowcells = []
+            request_pool_ids = set()
+
+            for flowcell in request.flowcell.all():
+                count = lanes[flowcell.pk]
+                pools = []
+
+                for pool_id in sorted(count):
+                    item = records.get((request.pk, pool_id))
+                    if item is None:
+                        continue
+
+                    share = LaneShare.from_depths(
+                        item['depth'], total_depths[pool_id], count[pool_id])
+
+                    request_pool_ids.add(pool_id)
+                    pools.append({
+                        'name': pool_names[pool_id],
+                        'read_length': item['read_length'],
+                        'percentage': str(share),
+                        'fraction': share.fraction,
+                        'lanes': share.lanes,
+                        'libraries': item['libraries'],
+                        'samples': item['samples'],
+                    })
+
+                flowcells.append({
+                    'flowcell_id': flowcell.flowcell_id,
+                    'sequencer': flowcell.sequencer_id,
+                    'pools': pools,
+                    'flowcell_create_month': flowcell.create_time.month,
+                    'flowcell_create_year': flowcell.create_time.year,
+                    'flowcell_create_time': flowcell.create_time,
+                })
+
+            self._invoices[request.pk] = self.get_invoice(
+                request, flowcells, request_pool_ids, pool_names)
+
+    def get_invoice(self, request, flowcells, pool_ids, pool_names):
+        libraries = request.libraries.all()
+        samples = request.samples.all()
+        is_samples = len(libraries) == 0
+        protocols = {
+            x.library_protocol_id for x in itertools.chain(samples, libraries)
+        }
+        library_protocol = protocols.pop() if protocols else ''
+
+        # The preparation costs are billed in the month of the request's
+        # first flowcell
+        first = min(x['flowcell_create_time'] for x in flowcells) \
+            if flowcells else None
+        num_records = 0
+        if first and (first.year, first.month) == self.calculator.month:
+            num_records = len(samples) if is_samples else len(libraries)
+
+        invoice = {
+            'pool': [pool_names[x] for x in sorted(pool_ids)],
+            'percentage': flowcells,
+            'num_libraries_samples': '{} {}'.format(
+                num_records, 'samples' if is_samples else 'libraries'),
+            'library_protocol': library_protocol,
+        }
+        invoice.update(self.calculator.get_costs(
+            flowcells, num_records, is_samples, library_protocol))
+        return invoice
+
+    def get_invoice_data(self, request, key):
+        """ Return a value of the request's invoicing row. """
+        return self._invoices[request.pk][key]
@@ -0,0 +1,120 @@
+from django.apps import apps
+
+from xlsxwriter import Workbook
+
+from .models import FixedCosts, LibraryPreparationCosts, SequencingCosts
+
+ReadLength = apps.get_model('library_sample_shared', 'ReadLength')
+LibraryProtocol = apps.get_model('library_sample_shared', 'LibraryProtocol')
+
+HEADER = [
+    'Request ID',
+    'Cost Unit',
+    'Sequencer',
+    'Date + Flowcell ID',
+    'Pool ID',
+    '% of Lanes',
+    'Read Length',
+    '# of Libraries/Samples',
+    'Library Preparation Protocol',
+    'Fixed Costs',
+    'Sequencing Costs',
+    'Preparation Costs',
+    'Variable Costs',
+    'Total Costs',
+]
+
+
+def get_invoicing_rows(months):
+    """
+    Generate the rows of the invoicing rows of each month (as returned by
+    the invoicing list). The months are consumed one at a time, and the
+    read length and protocol names are resolved with one query each per
+    month.
+    """
+    for invoices in months:
+        yield from get_month_rows(invoices)
+
+
+def get_month_rows(invoices):
+    """ Generate the rows of given invoicing rows of a month. """
+    read_length_ids = {x for item in invoices for x in item['read_length']}
+    read_lengths = dict(ReadLength.objects.filter(
+        pk__in=read_length_ids).values_list('pk', 'name'))
+
+    protocol_ids = {x['library_protocol'] for x in invoices}
+    protocols = dict(LibraryProtocol.objects.filter(
+        pk__in=[x for x in protocol_ids if x != '']).values_list('pk', 'name'))
+
+    for item in invoices:
+        sequencers = '; '.join(
+            sorted({x['sequencer_name'] for x in item['sequencer']}))
+        percentage = '; '.join(
+            ', '.join(y['percentage'] for y in x['pools'])
+            for x in item['percentage']
+        )
+        names = '; '.join(sorted(
+            read_lengths[x] for x in item['read_length']
+            if x in read_lengths
+        ))
+
+        yield [
+            item['request'],
+            item['cost_unit'],
+            sequencers,
+            '; '.join(item['flowcell']),
+            '; '.join(item['pool']),
+            percentage,
+            names,
+            item['num_libraries_samples'],
+            protocols.get(item['library_protocol'], ''),
+            item['fixed_costs'],
+            item['sequencing_costs'],
+            item['preparation_costs'],
+            item['variable_costs'],
+            item['total_costs'],
+        ]
+
+
+def get_price_sheets():
+    """ Return the title, header and rows of each price table. """
+    return [
+        ('Fixed Costs', ['Sequencer', 'Price'], (
+            [x.sequencer.name, x.price]
+            for x in FixedCosts.objects.select_related('sequencer')
+        )),
+        ('Preparation Costs', ['Library Protocol', 'Price'], (
+            [x.library_protocol.name, x.price]
+            for x in LibraryPreparationCosts.objects.select_related(
+                'library_protocol')
+        )),
+        ('Sequencing Costs', ['Sequencer + Read Length', 'Price'], (
+            [f'{x.sequencer.name} {x.read_length.name}', x.price]
+            for x in SequencingCosts.objects.select_related(
+                'sequencer', 'read_length')
+        )),
+    ]
+
+
+def write_xlsx(file, months):
+    """
+    Write the invoicing report of given months (each a list of invoicing
+    rows) to a file (or file-like object). The worksheets are written row
+    by row in constant memory mode, so only the rows of one month are kept
+    in memory at a time.
+    """
+    workbook = Workbook(file, {'constant_memory': True})
+    font_style = workbook.add_format({'text_wrap': True})
+    font_style_bold = workbook.add_format({'bold': True})
+
+    sheets = [('Invoicing', HEADER, get_invoicing_rows(months))] + \
+        get_price_sheets()
+
+    for title, header, rows in sheets:
+        worksheet = workbook.add_worksheet(title)
+        worksheet.set_column(0, len(header) - 1, 31)
+        worksheet.write_row(0, 0, header, font_style_bold)
+        for row_num, row in enumerate(rows, 1):
+            worksheet.write_row(row_num, 0, row, font_style)
+
+    workbook.close()
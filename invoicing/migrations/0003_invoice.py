@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import month.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('request', '0001_initial'),
+        ('invoicing', '0002_auto_20181121_1255'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', month.models.MonthField(db_index=True, verbose_name='Month')),
+                ('sequencing_date', models.DateTimeField(verbose_name='Sequencing Date')),
+                ('version', models.PositiveIntegerField(default=1, verbose_name='Version')),
+                ('outdated', models.BooleanField(default=False, verbose_name='Outdated')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='Update Time')),
+                ('fixed_costs', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('sequencing_costs', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('preparation_costs', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('variable_costs', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('total_costs', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('data', models.TextField(verbose_name='Data')),
+                ('request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='request.Request', verbose_name='Request')),
+            ],
+            options={
+                'verbose_name': 'Invoice',
+                'verbose_name_plural': 'Invoices',
+                'ordering': ['month', 'sequencing_date', 'request'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InvoicingPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', month.models.MonthField(unique=True, verbose_name='Month')),
+                ('closed', models.BooleanField(default=False, help_text='The invoices of a closed month are not recomputed.', verbose_name='Closed')),
+            ],
+            options={
+                'verbose_name': 'Invoicing Period',
+                'verbose_name_plural': 'Invoicing Periods',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together=set([('month', 'request')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0003_invoice'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='invoice',
+            options={'ordering': ['month', 'sequencing_date', 'request', 'version'], 'verbose_name': 'Invoice', 'verbose_name_plural': 'Invoices'},
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='superseded',
+            field=models.BooleanField(default=False, verbose_name='Superseded'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together=set([('month', 'request', 'version')]),
+        ),
+    ]
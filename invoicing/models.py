@@ -1,3 +1,4 @@
+import json
 import calendar
 
 from django.db import models
@@ -6,6 +7,7 @@ from month.models import MonthField
 from common.models import DateTimeMixin
 from library_sample_shared.models import LibraryProtocol, ReadLength
 from flowcell.models import Sequencer
+from request.models import Request
 
 
 class InvoicingReport(DateTimeMixin):
@@ -73,3 +75,71 @@ class SequencingCosts(models.Model):
 
     def __str__(self):
         return f'{self.sequencer.name} {self.read_length.name}'
+
+
+class InvoicingPeriod(models.Model):
+    month = MonthField('Month', unique=True)
+    closed = models.BooleanField(
+        'Closed',
+        default=False,
+        help_text='The invoices of a closed month are not recomputed.',
+    )
+
+    class Meta:
+        verbose_name = 'Invoicing Period'
+        verbose_name_plural = 'Invoicing Periods'
+        ordering = ['-month']
+
+    def __str__(self):
+        return f'{calendar.month_name[self.month.month]} {self.month.year}'
+
+
+class Invoice(models.Model):
+    """
+    Computed invoice of a request in a billing month. An invoice is marked
+    as outdated when the request's flowcells, pools, records or the prices
+    change, and recomputed the next time the month is listed, unless the
+    month is closed. A recomputed invoice is stored as a new version and
+    the previous versions are kept as superseded.
+    """
+    COSTS = [
+        'fixed_costs',
+        'sequencing_costs',
+        'preparation_costs',
+        'variable_costs',
+        'total_costs',
+    ]
+
+    month = MonthField('Month', db_index=True)
+    request = models.ForeignKey(
+        Request, verbose_name='Request', related_name='invoices',
+        on_delete=models.SET_NULL, null=True, blank=True)
+    sequencing_date = models.DateTimeField('Sequencing Date')
+    version = models.PositiveIntegerField('Version', default=1)
+    outdated = models.BooleanField('Outdated', default=False)
+    superseded = models.BooleanField('Superseded', default=False)
+    update_time = models.DateTimeField('Update Time', auto_now=True)
+
+    fixed_costs = models.DecimalField(max_digits=14, decimal_places=4)
+    sequencing_costs = models.DecimalField(max_digits=14, decimal_places=4)
+    preparation_costs = models.DecimalField(max_digits=14, decimal_places=4)
+    variable_costs = models.DecimalField(max_digits=14, decimal_places=4)
+    total_costs = models.DecimalField(max_digits=14, decimal_places=4)
+
+    # Serialized invoicing row (flowcells, pools, shares, etc.)
+    data = models.TextField('Data')
+
+    class Meta:
+        verbose_name = 'Invoice'
+        verbose_name_plural = 'Invoices'
+        unique_together = ('month', 'request', 'version',)
+        ordering = ['month', 'sequencing_date', 'request', 'version']
+
+    def __str__(self):
+        return f'{self.month}: {self.get_data().get("request")}'
+
+    def get_data(self):
+        """ Return the invoicing row with the stored costs. """
+        data = json.loads(self.data)
+        data.update({x: getattr(self, x) for x in self.COSTS})
+        return data
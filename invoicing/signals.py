@@ -0,0 +1,186 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete, m2m_changed,
+)
+from django.dispatch import receiver
+
+from common.cache import get_cache
+
+from .cache import BILLING_PERIODS_KEY
+from .models import (
+    InvoicingReport,
+    InvoicingPeriod,
+    Invoice,
+    FixedCosts,
+    LibraryPreparationCosts,
+    SequencingCosts,
+)
+
+Request = apps.get_model('request', 'Request')
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+Pool = apps.get_model('index_generator', 'Pool')
+Lane = apps.get_model('flowcell', 'Lane')
+Flowcell = apps.get_model('flowcell', 'Flowcell')
+
+# Actions after which (or before which, for removals) the invoices of the
+# affected requests are outdated
+M2M_ACTIONS = ['post_add', 'pre_remove', 'pre_clear']
+
+# Fields of libraries and samples the costs depend on
+COST_FIELDS = ['sequencing_depth', 'read_length_id', 'library_protocol_id']
+
+
+def outdate_invoices(requests=None, pools=None):
+    """
+    Mark the invoices of given requests and of the requests with records
+    in given pools as outdated (all if neither is given). The invoices of
+    closed months are left untouched.
+    """
+    invoices = Invoice.objects.filter(
+        outdated=False, superseded=False).exclude(
+        month__in=InvoicingPeriod.objects.filter(
+            closed=True).values('month'))
+
+    if requests is not None or pools is not None:
+        query = Q()
+        if requests is not None:
+            query |= Q(request__in=requests)
+        if pools is not None:
+            query |= Q(request__libraries__pool__in=pools) | \
+                Q(request__samples__pool__in=pools)
+        invoices = invoices.filter(query)
+
+    invoices.update(outdated=True)
+
+
+@receiver(post_save, sender=Request)
+def outdate_invoices_request(sender, instance, **kwargs):
+    outdate_invoices(requests=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Request.libraries.through)
+@receiver(m2m_changed, sender=Request.samples.through)
+def outdate_invoices_request_records(sender, instance, action, reverse,
+                                     pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+
+    if not reverse:
+        requests = [instance.pk]
+    elif pk_set:
+        requests = pk_set
+    else:
+        requests = instance.request.all()
+    outdate_invoices(requests=requests)
+
+
+@receiver(pre_save, sender=Library)
+@receiver(pre_save, sender=Sample)
+def store_invoicing_changed(sender, instance, update_fields, **kwargs):
+    """
+    Check if a record's fields the costs depend on are being changed.
+    New records and saves of other fields only are skipped without
+    querying the database.
+    """
+    names = set(COST_FIELDS) | {x[:-3] for x in COST_FIELDS}
+    if instance._state.adding or (
+            update_fields is not None and not names & update_fields):
+        instance._invoicing_changed = False
+        return
+
+    instance._invoicing_changed = not sender.objects.filter(
+        pk=instance.pk,
+        **{field: getattr(instance, field) for field in COST_FIELDS}
+    ).exists()
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_save, sender=Sample)
+@receiver(pre_delete, sender=Library)
+@receiver(pre_delete, sender=Sample)
+def outdate_invoices_record(sender, instance, signal, **kwargs):
+    """
+    A record's sequencing depth, read length, or protocol affect its
+    requests' invoices and the shares of all requests of its pools.
+    """
+    if signal is post_save and \
+            not getattr(instance, '_invoicing_changed', False):
+        return
+
+    outdate_invoices(
+        requests=instance.request.all(), pools=instance.pool.all())
+
+
+@receiver(m2m_changed, sender=Pool.libraries.through)
+@receiver(m2m_changed, sender=Pool.samples.through)
+def outdate_invoices_pool_records(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+
+    if not reverse:
+        outdate_invoices(pools=[instance.pk])
+    else:
+        outdate_invoices(
+            requests=instance.request.all(),
+            pools=pk_set if pk_set else instance.pool.all(),
+        )
+
+
+@receiver(post_save, sender=Lane)
+@receiver(pre_delete, sender=Lane)
+def outdate_invoices_lane(sender, instance, **kwargs):
+    outdate_invoices(pools=[instance.pool_id])
+
+
+@receiver(post_save, sender=Flowcell)
+@receiver(pre_delete, sender=Flowcell)
+def outdate_invoices_flowcell(sender, instance, **kwargs):
+    outdate_invoices(requests=instance.requests.all())
+
+
+@receiver(m2m_changed, sender=Flowcell.lanes.through)
+@receiver(m2m_changed, sender=Flowcell.requests.through)
+def outdate_invoices_flowcell_relations(sender, instance, action, reverse,
+                                        pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+
+    if reverse:
+        if sender is Flowcell.requests.through:
+            requests = [instance.pk]
+        else:
+            requests = Request.objects.filter(flowcell__lanes=instance)
+    elif sender is Flowcell.requests.through and pk_set:
+        requests = set(pk_set) | set(
+            instance.requests.values_list('pk', flat=True))
+    else:
+        requests = instance.requests.all()
+    outdate_invoices(requests=requests)
+
+
+@receiver(post_save, sender=FixedCosts)
+@receiver(post_save, sender=LibraryPreparationCosts)
+@receiver(post_save, sender=SequencingCosts)
+@receiver(post_delete, sender=FixedCosts)
+@receiver(post_delete, sender=LibraryPreparationCosts)
+@receiver(post_delete, sender=SequencingCosts)
+def outdate_invoices_prices(sender, instance, **kwargs):
+    """ Price changes affect the invoices of all open months. """
+    outdate_invoices()
+
+
+@receiver(post_save, sender=Flowcell)
+@receiver(post_save, sender=InvoicingReport)
+@receiver(post_delete, sender=Flowcell)
+@receiver(post_delete, sender=InvoicingReport)
+def invalidate_billing_periods(sender, using, **kwargs):
+    """
+    Invalidate the billing periods once the current transaction is
+    committed, so that no concurrent request caches the old periods.
+    """
+    transaction.on_commit(
+        lambda: get_cache().delete(BILLING_PERIODS_KEY), using=using)
@@ -1,28 +1,48 @@
+import io
+import csv
 import json
 import pytz
+import zipfile
+from decimal import Decimal
+from functools import reduce
 from datetime import datetime
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
 from django.core.urlresolvers import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
 
 from month import Month
 
+from common.cache import get_cache
 from common.tests import BaseTestCase, BaseAPITestCase
-from common.utils import get_random_name
+from common.utils import get_random_name, QueryCounter
 from library_sample_shared.tests import (
     create_read_length,
     create_library_protocol,
 )
-from flowcell.tests import create_sequencer, create_flowcell
-
+from library.tests import create_library
+from request.tests import create_request
+from index_generator.tests import create_pool
+from flowcell.tests import create_sequencer, create_lane, create_flowcell
+
+from .cache import BILLING_PERIODS_KEY
+from .engine import LaneShare
+from .exports import get_invoicing_rows
 from .models import (
     InvoicingReport,
+    InvoicingPeriod,
+    Invoice,
     FixedCosts,
     LibraryPreparationCosts,
     SequencingCosts,
 )
 
+User = get_user_model()
+
 
 def create_fixed_cost(sequencer, price):
     fixed_cost = FixedCosts(sequencer=sequencer, price=price)
@@ -39,6 +59,35 @@ def create_preparation_cost(library_protocol, price):
     return preparation_cost
 
 
+def create_sequenced_pool(user, depths, num_lanes=1, sequencer=None):
+    """
+    Create a pool with a library of a new request per sequencing depth,
+    and load it on a flowcell's lanes.
+    """
+    sequencer = sequencer or create_sequencer(get_random_name())
+    flowcell = create_flowcell(get_random_name(), sequencer)
+    pool = create_pool(user)
+
+    requests = []
+    for depth in depths:
+        library = create_library(get_random_name())
+        library.sequencing_depth = depth
+        library.save()
+
+        request = create_request(user)
+        request.sequenced = True
+        request.save()
+        request.libraries.add(library)
+        pool.libraries.add(library)
+        flowcell.requests.add(request)
+        requests.append(request)
+
+    flowcell.lanes.add(*[
+        create_lane(f'Lane {i + 1}', pool) for i in range(num_lanes)])
+
+    return flowcell, pool, requests
+
+
 def create_sequencing_cost(sequencer, read_length, price):
     sequencing_cost = SequencingCosts(
         sequencer=sequencer,
@@ -49,6 +98,46 @@ def create_sequencing_cost(sequencer, read_length, price):
     return sequencing_cost
 
 
+def get_baseline_costs(item):
+    """
+    Return the costs of an invoicing row computed as the former
+    `InvoicingSerializer.to_representation` did.
+    """
+    fixed_costs = dict(FixedCosts.objects.values_list('sequencer', 'price'))
+    preparation_costs = dict(LibraryPreparationCosts.objects.values_list(
+        'library_protocol', 'price'))
+    sequencing_costs = {
+        f'{sequencer}_{read_length}': price
+        for sequencer, read_length, price in SequencingCosts.objects
+        .values_list('sequencer', 'read_length', 'price')
+    }
+
+    fixed = sequencing = Decimal(0)
+    for flowcell in item['percentage']:
+        for pool in flowcell['pools']:
+            share = reduce(lambda x, y: Decimal(x) * Decimal(y),
+                           pool['percentage'].split('*'))
+            fixed += fixed_costs.get(flowcell['sequencer'], 0) * share
+            key = f"{flowcell['sequencer']}_{pool['read_length']}"
+            sequencing += sequencing_costs.get(key, 0) * share
+
+    num, kind = item['num_libraries_samples'].split(' ')
+    if kind == 'samples':
+        preparation = preparation_costs.get(
+            item['library_protocol'], 0) * Decimal(num)
+    else:
+        preparation = LibraryPreparationCosts.objects.get(
+            library_protocol__name='Quality Control').price * Decimal(num)
+
+    return {
+        'fixed_costs': float(fixed),
+        'sequencing_costs': float(sequencing),
+        'preparation_costs': float(preparation),
+        'variable_costs': float(sequencing + preparation),
+        'total_costs': float(fixed + sequencing + preparation),
+    }
+
+
 # Models
 
 class TestInvoicingReport(BaseTestCase):
@@ -96,6 +185,18 @@ class TestSequencingCostsModel(BaseTestCase):
         self.assertEqual(self.cost.price_amount, f'{self.cost.price} €')
 
 
+class TestLaneShare(BaseTestCase):
+    def test_from_depths(self):
+        share = LaneShare.from_depths(1, 4, 2)
+        self.assertEqual(share, (Decimal('0.25'), 2))
+        self.assertEqual(share.value, Decimal('0.5'))
+        self.assertEqual(str(share), '0.25*2')
+
+    def test_whole_pool(self):
+        self.assertEqual(str(LaneShare.from_depths(3, 3, 1)), '1*1')
+        self.assertEqual(str(LaneShare.from_depths(0, 3, 1)), '0.0*1')
+
+
 # Views
 
 class TestFixedCostsViewSet(BaseAPITestCase):
@@ -215,11 +316,16 @@ class TestSequencingCostsViewSet(BaseAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
 class TestInvoicingViewSet(BaseAPITestCase):
     """ Tests for the main Invoicing ViewSet. """
 
     def setUp(self):
-        self.create_user()
+        get_cache().clear()
+        self.user = self.create_user()
         self.login()
 
     # def tearDown(self):
@@ -243,6 +349,285 @@ class TestInvoicingViewSet(BaseAPITestCase):
             {'name': 'December 2017', 'value': [2017, 12], 'report_url': ''},
         ])
 
+    def test_invoicing_list(self):
+        sequencer = create_sequencer(get_random_name())
+        create_fixed_cost(sequencer, 100)
+        flowcell, pool, (request1, request2) = create_sequenced_pool(
+            self.user, [1, 3], num_lanes=2, sequencer=sequencer)
+
+        response = self.client.get(reverse('invoicing-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = {x['request']: x for x in response.json()}
+        self.assertEqual(set(data), {request1.name, request2.name})
+
+        item = data[request1.name]
+        self.assertEqual(item['pool'], [pool.name])
+        self.assertEqual(len(item['percentage']), 1)
+        self.assertEqual(item['percentage'][0]['flowcell_id'],
+                         flowcell.flowcell_id)
+        self.assertEqual(item['percentage'][0]['pools'][0]['percentage'],
+                         '0.25*2')
+        self.assertEqual(item['num_libraries_samples'], '1 libraries')
+        self.assertEqual(float(item['fixed_costs']), 50)
+
+        item = data[request2.name]
+        self.assertEqual(item['percentage'][0]['pools'][0]['percentage'],
+                         '0.75*2')
+        self.assertEqual(float(item['fixed_costs']), 150)
+
+    def test_invoicing_costs(self):
+        sequencer = create_sequencer(get_random_name())
+        _, _, (request1, request2) = create_sequenced_pool(
+            self.user, [1, 1], num_lanes=2, sequencer=sequencer)
+        read_length = request1.libraries.get().read_length
+
+        create_fixed_cost(sequencer, 100)
+        create_sequencing_cost(sequencer, read_length, 10)
+        create_preparation_cost(
+            create_library_protocol('Quality Control'), 5)
+
+        response = self.client.get(reverse('invoicing-list'))
+        data = {x['request']: x for x in response.json()}
+        item = data[request1.name]
+
+        pool = item['percentage'][0]['pools'][0]
+        self.assertEqual((pool['fraction'], pool['lanes']), (0.5, 2))
+        self.assertEqual(item['fixed_costs'], 100)
+        self.assertEqual(item['sequencing_costs'], 10)
+        self.assertEqual(item['preparation_costs'], 5)
+        self.assertEqual(item['variable_costs'], 15)
+        self.assertEqual(item['total_costs'], 115)
+
+        # The second request's library has another read length
+        self.assertEqual(data[request2.name]['sequencing_costs'], 0)
+
+    def test_invoicing_costs_baseline(self):
+        """
+        Ensure the costs match the rules of the former serializer: a pool
+        is priced with the read length of the request's first record, and
+        the preparation with one of the request's protocols.
+        """
+        sequencer = create_sequencer(get_random_name())
+        _, pool, (request,) = create_sequenced_pool(
+            self.user, [1], num_lanes=2, sequencer=sequencer)
+        first = request.libraries.get()
+
+        library = create_library(get_random_name())
+        library.sequencing_depth = 3
+        library.save()
+        request.libraries.add(library)
+        pool.libraries.add(library)
+
+        create_fixed_cost(sequencer, 100)
+        create_sequencing_cost(sequencer, first.read_length, 10)
+        create_sequencing_cost(sequencer, library.read_length, 20)
+        create_preparation_cost(
+            create_library_protocol('Quality Control'), 5)
+
+        response = self.client.get(reverse('invoicing-list'))
+        item = response.json()[0]
+        self.assertEqual(
+            item['percentage'][0]['pools'][0]['read_length'],
+            first.read_length.pk,
+        )
+        self.assertEqual(item, dict(item, **get_baseline_costs(item)))
+        self.assertEqual(item['sequencing_costs'], 20)
+        self.assertEqual(item['preparation_costs'], 10)
+
+    def test_invoicing_list_query_count(self):
+        """
+        Ensure the number of queries doesn't depend on the number of
+        requests.
+        """
+        def get_count():
+            with QueryCounter() as counter:
+                response = self.client.get(reverse('invoicing-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return counter.count
+
+        # The first listing of a sequenced month creates its invoicing period
+        create_sequenced_pool(self.user, [1])
+        get_count()
+
+        create_sequenced_pool(self.user, [1])
+        count = get_count()
+
+        create_sequenced_pool(self.user, [1, 2, 3])
+        self.assertEqual(get_count(), count)
+
+    def test_invoicing_list_other_months(self):
+        """
+        Ensure listing a month without flowcells writes nothing, and an
+        invalid month is rejected.
+        """
+        create_sequenced_pool(self.user, [1])
+
+        response = self.client.get(
+            reverse('invoicing-list'), {'year': 1900, 'month': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [])
+        self.assertFalse(InvoicingPeriod.objects.exists())
+
+        for month in [13, 'x']:
+            response = self.client.get(
+                reverse('invoicing-list'), {'month': month})
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertFalse(response.json()['success'])
+
+    def test_invoices_recomputed(self):
+        """ Ensure only the outdated invoices are recomputed. """
+        flowcell, pool, (request1, request2) = create_sequenced_pool(
+            self.user, [1, 3])
+        _, _, (request3,) = create_sequenced_pool(self.user, [1])
+
+        response = self.client.get(reverse('invoicing-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Invoice.objects.count(), 3)
+        self.assertFalse(Invoice.objects.filter(outdated=True).exists())
+
+        # Other changes of the records don't outdate the invoices
+        library = request2.libraries.get()
+        library.name = get_random_name()
+        library.save()
+        library.save(update_fields=['name'])
+        self.assertFalse(Invoice.objects.filter(outdated=True).exists())
+
+        # Changing a record of a pool outdates all requests of the pool
+        library.sequencing_depth = 1
+        library.save()
+        self.assertEqual(
+            set(Invoice.objects.filter(outdated=True).values_list(
+                'request', flat=True)),
+            {request1.pk, request2.pk},
+        )
+
+        response = self.client.get(reverse('invoicing-list'))
+        data = {x['request']: x for x in response.json()}
+        self.assertEqual(
+            data[request1.name]['percentage'][0]['pools'][0]['percentage'],
+            '0.5*1')
+        self.assertEqual(
+            dict(Invoice.objects.filter(superseded=False).values_list(
+                'request', 'version')),
+            {request1.pk: 2, request2.pk: 2, request3.pk: 1},
+        )
+
+        # The previous versions are kept
+        self.assertEqual(
+            sorted(Invoice.objects.filter(superseded=True).values_list(
+                'request', 'version')),
+            [(request1.pk, 1), (request2.pk, 1)],
+        )
+
+        # The invoice of a request no longer sequenced is superseded too
+        request3.sequenced = False
+        request3.save()
+        response = self.client.get(reverse('invoicing-list'))
+        self.assertNotIn(
+            request3.name, [x['request'] for x in response.json()])
+        self.assertTrue(Invoice.objects.get(request=request3).superseded)
+
+        request3.sequenced = True
+        request3.save()
+        response = self.client.get(reverse('invoicing-list'))
+        self.assertIn(request3.name, [x['request'] for x in response.json()])
+        self.assertEqual(
+            Invoice.objects.get(request=request3, superseded=False).version, 2)
+
+    def test_closed_month_frozen(self):
+        sequencer = create_sequencer(get_random_name())
+        fixed_cost = create_fixed_cost(sequencer, 100)
+        _, _, (request,) = create_sequenced_pool(
+            self.user, [1], sequencer=sequencer)
+
+        self.client.get(reverse('invoicing-list'))
+
+        # Listing a month creates its (locked) invoicing period
+        today = datetime.today()
+        period = InvoicingPeriod.objects.get(
+            month=Month(today.year, today.month))
+        period.closed = True
+        period.save()
+
+        fixed_cost.price = 200
+        fixed_cost.save()
+
+        # Requests without an invoice are not invoiced in a closed month
+        create_sequenced_pool(self.user, [1], sequencer=sequencer)
+
+        response = self.client.get(reverse('invoicing-list'))
+        self.assertEqual(
+            [x['request'] for x in response.json()], [request.name])
+        self.assertEqual(float(response.json()[0]['fixed_costs']), 100)
+        self.assertEqual(Invoice.objects.get().version, 1)
+
+    def test_download_xlsx(self):
+        _, _, (request,) = create_sequenced_pool(self.user, [1])
+
+        response = self.client.get(reverse('invoicing-download'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('.xlsx', response['Content-Disposition'])
+
+        content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            workbook = archive.read('xl/workbook.xml').decode('utf-8')
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        for name in ['Invoicing', 'Fixed Costs', 'Sequencing Costs']:
+            self.assertIn(name, workbook)
+        self.assertIn(request.name, sheet)
+
+    def test_download_csv(self):
+        today = datetime.today()
+        _, pool, (request,) = create_sequenced_pool(self.user, [1])
+        read_length = request.libraries.get().read_length
+
+        response = self.client.get(reverse('invoicing-download'), {
+            'file_format': 'csv',
+            'start': f'{today.year - 1}-{today.month:02d}',
+            'end': f'{today.year}-{today.month:02d}',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][0], 'Request ID')
+        self.assertEqual(rows[1][0], request.name)
+        self.assertEqual(rows[1][4], pool.name)
+        self.assertEqual(rows[1][5], '1*1')
+        self.assertEqual(rows[1][6], read_length.name)
+
+    def test_invoicing_rows_by_month(self):
+        """ Ensure the months are consumed one at a time. """
+        _, _, (request,) = create_sequenced_pool(self.user, [1])
+        invoices = self.client.get(reverse('invoicing-list')).json()
+        consumed = []
+
+        def get_months():
+            for month in range(2):
+                consumed.append(month)
+                yield invoices
+
+        rows = get_invoicing_rows(get_months())
+        self.assertEqual(next(rows)[0], request.name)
+        self.assertEqual(consumed, [0])
+        self.assertEqual(len(list(rows)), 1)
+        self.assertEqual(consumed, [0, 1])
+
+    def test_download_invalid_period(self):
+        response = self.client.get(reverse('invoicing-download'), {
+            'start': '2018-05',
+            'end': '2018-01',
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('invoicing-download'), {
+            'file_format': 'xls',
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_report_upload(self):
         month = datetime.now().strftime('%Y-%m')
         response = self.client.post(reverse('invoicing-upload'), {
@@ -252,3 +637,66 @@ class TestInvoicingViewSet(BaseAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
             InvoicingReport.objects.filter(month=month).count(), 1)
+
+
+class TestBillingPeriodsCache(TransactionTestCase):
+    """
+    Cached billing periods. The cache is cleared when the changes are
+    committed, so the data must be committed.
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        User.objects.create_user(
+            email='test@test.io', password='foo-bar', is_staff=True)
+        self.client.login(email='test@test.io', password='foo-bar')
+
+    def test_billing_periods_reports(self):
+        sequencer = create_sequencer(get_random_name())
+        for month in [1, 4]:
+            flowcell = create_flowcell(get_random_name(), sequencer)
+            flowcell.create_time = datetime(
+                2018, month, 1, 12, 0, 0, tzinfo=pytz.UTC)
+            flowcell.save()
+
+        def get_periods():
+            with QueryCounter() as counter:
+                response = self.client.get(
+                    reverse('invoicing-billing-periods'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.data, counter.count
+
+        data, count = get_periods()
+        self.assertEqual(
+            [x['value'] for x in data],
+            [[2018, 1], [2018, 2], [2018, 3], [2018, 4]],
+        )
+        self.assertEqual({x['report_url'] for x in data}, {''})
+
+        # Cached until a report is uploaded
+        self.assertLess(get_periods()[1], count)
+
+        report = InvoicingReport.objects.create(
+            month=Month(2018, 2),
+            report=SimpleUploadedFile('file.txt', b'content'),
+        )
+        data, _ = get_periods()
+        self.assertEqual(
+            data[1]['report_url'], settings.MEDIA_URL + report.report.name)
+        report.report.delete()
+
+    def test_invalidated_on_commit(self):
+        flowcell = create_flowcell(
+            get_random_name(), create_sequencer(get_random_name()))
+        self.client.get(reverse('invoicing-billing-periods'))
+        self.assertIsNotNone(get_cache().get(BILLING_PERIODS_KEY))
+
+        with transaction.atomic():
+            flowcell.create_time = datetime(
+                2018, 1, 1, 12, 0, 0, tzinfo=pytz.UTC)
+            flowcell.save()
+            self.assertIsNotNone(get_cache().get(BILLING_PERIODS_KEY))
+
+        self.assertIsNone(get_cache().get(BILLING_PERIODS_KEY))
+        response = self.client.get(reverse('invoicing-billing-periods'))
+        self.assertEqual(response.data[0]['value'], [2018, 1])
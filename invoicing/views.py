@@ -1,25 +1,31 @@
+import csv
+import json
 import datetime
 import calendar
-import numpy as np
-from dateutil.relativedelta import relativedelta
+import tempfile
+import itertools
 
 from django.apps import apps
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
-from django.db.models import Q, Prefetch, Min
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse
+from django.db.models import Q, Prefetch, Min, Max
 
 from rest_framework import mixins, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser
+from rest_framework.utils.encoders import JSONEncoder
 
 from month import Month
-from xlwt import Workbook, XFStyle
 
+from common.cache import get_cache
+from common.utils import Echo
 from common.views import CsrfExemptSessionAuthentication
 
 from .models import (
     InvoicingReport,
+    InvoicingPeriod,
+    Invoice,
     FixedCosts,
     LibraryPreparationCosts,
     SequencingCosts,
@@ -30,14 +36,17 @@ from .serializers import (
     LibraryPreparationCostsSerializer,
     SequencingCostsSerializer,
 )
+from .exports import HEADER, get_invoicing_rows, write_xlsx
+from .cache import BILLING_PERIODS_KEY
 from django.db import transaction
 Request = apps.get_model('request', 'Request')
-ReadLength = apps.get_model('library_sample_shared', 'ReadLength')
-LibraryProtocol = apps.get_model('library_sample_shared', 'LibraryProtocol')
 Library = apps.get_model('library', 'Library')
 Sample = apps.get_model('sample', 'Sample')
 Flowcell = apps.get_model('flowcell', 'Flowcell')
 
+XLSX_CONTENT_TYPE = \
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
 
 
 
@@ -47,18 +56,23 @@ class InvoicingViewSet(viewsets.ReadOnlyModelViewSet):
 
     serializer_class = InvoicingSerializer
 
-    def get_serializer_context(self):
+    def get_month(self):
+        """ Return the billing month (`year` and `month`, or the current). """
         today = datetime.date.today()
         year = self.request.query_params.get('year', today.year)
         month = self.request.query_params.get('month', today.month)
-        ctx = {'curr_month': month, 'curr_year': year, 'today': today}
-        return ctx
+        return Month(int(year), int(month))
 
-    def get_queryset(self):
-        today = datetime.date.today()
-        year = self.request.query_params.get('year', today.year)
-        month = self.request.query_params.get('month', today.month)
+    def get_serializer_context(self, month=None):
+        month = month or self.get_month()
+        return {
+            'curr_month': month.month,
+            'curr_year': month.year,
+            'today': datetime.date.today(),
+        }
 
+    def get_queryset(self, month=None):
+        month = month or self.get_month()
 
         flowcell_qs = Flowcell.objects.select_related(
             'sequencer',
@@ -76,8 +90,8 @@ class InvoicingViewSet(viewsets.ReadOnlyModelViewSet):
         ).only('read_length', 'library_protocol__name')
 
         queryset = Request.objects.filter(
-            flowcell__create_time__year=year,
-            flowcell__create_time__month=month,
+            flowcell__create_time__year=month.year,
+            flowcell__create_time__month=month.month,
             sequenced=True,
         ).select_related(
             'cost_unit',
@@ -97,45 +111,159 @@ class InvoicingViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-    def list(self,request):
-        queryset = self.filter_queryset(self.get_queryset())
-
-        today = datetime.date.today()
-        year = self.request.query_params.get('year', today.year)
-        month = self.request.query_params.get('month', today.month)
-        ctx = {'curr_month': month, 'curr_year': year, 'today': today}
-        serializer = self.get_serializer(queryset, many=True)
-
-        return Response(serializer.data)
+    def list(self, request):
+        try:
+            month = self.get_month()
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, 400)
+        return Response(self.get_invoices(month))
+
+    def get_invoices(self, month):
+        """
+        Return the invoicing rows of a month. Only the invoices of new
+        requests and the outdated ones are (re)computed.
+
+        A recomputed invoice is stored as a new version, and the previous
+        version is kept as superseded; so is the invoice of a request
+        which is no longer sequenced in the month.
+
+        The invoices of a closed month are frozen: they are neither
+        recomputed nor created for requests which had no invoice when the
+        month was closed, and they are kept for requests which are no
+        longer sequenced in the month.
+
+        The month's invoicing period is locked while its invoices are
+        updated, so that concurrent requests don't compute the same
+        invoices (and fail on the unique month, request and version).
+        Periods are only created for the months from the first to the last
+        flowcell; for other months, only the invoices of a closed period
+        are returned, and nothing is written.
+        """
+        months = self.get_flowcell_months()
+        if months is None or not months[0] <= month <= months[1]:
+            return self.sort_invoices(Invoice.objects.filter(
+                month=month,
+                superseded=False,
+                month__in=InvoicingPeriod.objects.filter(
+                    closed=True).values('month'),
+            ))
 
+        queryset = self.filter_queryset(self.get_queryset(month))
+
+        with transaction.atomic():
+            period, _ = InvoicingPeriod.objects.select_for_update() \
+                .get_or_create(month=month)
+
+            invoices = {
+                x.request_id: x for x in Invoice.objects.filter(
+                    month=month, superseded=False)
+            }
+            if period.closed:
+                return self.sort_invoices(invoices.values())
+
+            request_ids = set(queryset.values_list('pk', flat=True))
+            stale_ids = {
+                x for x in request_ids
+                if x not in invoices or invoices[x].outdated
+            }
+
+            if stale_ids:
+                stale = queryset.filter(pk__in=stale_ids)
+                serializer_class = self.get_serializer_class()
+                data = serializer_class(
+                    stale, many=True,
+                    context=self.get_serializer_context(month),
+                ).data
+
+                # Supersede the stale invoices with new versions
+                versions = dict(Invoice.objects.filter(
+                    month=month, request__in=stale_ids,
+                ).values_list('request').annotate(
+                    version=Max('version'),
+                ).order_by())
+                recomputed = []
+                for request, item in zip(stale, data):
+                    recomputed.append(Invoice(
+                        month=month,
+                        request=request,
+                        sequencing_date=request.sequencing_date,
+                        version=versions.get(request.pk, 0) + 1,
+                        data=json.dumps(item, cls=JSONEncoder),
+                        **{x: item[x] for x in Invoice.COSTS}
+                    ))
+
+                Invoice.objects.filter(
+                    month=month, request__in=stale_ids, superseded=False,
+                ).update(superseded=True)
+                invoices.update({
+                    x.request_id: x
+                    for x in Invoice.objects.bulk_create(recomputed)
+                })
+
+            # Requests that are no longer sequenced in the month
+            removed = [
+                x.pk for key, x in invoices.items() if key not in request_ids
+            ]
+            if removed:
+                Invoice.objects.filter(pk__in=removed).update(superseded=True)
+
+        return self.sort_invoices(
+            x for key, x in invoices.items() if key in request_ids)
+
+    @staticmethod
+    def sort_invoices(invoices):
+        """ Return the rows of given invoices by sequencing date. """
+        return [
+            x.get_data() for x in sorted(
+                invoices,
+                key=lambda x: (x.sequencing_date, x.request_id or 0),
+            )
+        ]
 
     @action(methods=['get'], detail=False)
     def billing_periods(self, request):
-        flowcells = Flowcell.objects.all()
-        data = []
+        """
+        Return the months from the first to the last flowcell with their
+        invoicing reports. The result is cached until a flowcell or a
+        report is changed.
+        """
+        cache = get_cache()
+        data = cache.get(BILLING_PERIODS_KEY)
+        if data is None:
+            data = self.get_billing_periods()
+            cache.set(BILLING_PERIODS_KEY, data)
+        return Response(data)
+
+    @staticmethod
+    def get_flowcell_months():
+        """ Return the months of the first and the last flowcell. """
+        dates = Flowcell.objects.aggregate(
+            start=Min('create_time'), end=Max('create_time'))
+        if dates['start'] is None:
+            return None
+
+        start, end = dates['start'], dates['end']
+        return Month(start.year, start.month), Month(end.year, end.month)
 
-        if flowcells.count() == 0:
-            return Response(data)
-
-        start_date = flowcells.first().create_time
-        end_date = flowcells.last().create_time
-        end_date = end_date + relativedelta(months=1)
-
-        dates = np.arange(start_date, end_date, dtype='datetime64[M]').tolist()
-        for dt in dates:
-            try:
-                report = InvoicingReport.objects.get(
-                    month=dt.strftime('%Y-%m'))
-                report_url = settings.MEDIA_URL + report.report.name
-            except InvoicingReport.DoesNotExist:
-                report_url = ''
+    def get_billing_periods(self):
+        months = self.get_flowcell_months()
+        if months is None:
+            return []
+
+        reports = {
+            (x.month.year, x.month.month): x.report.name
+            for x in InvoicingReport.objects.only('month', 'report')
+        }
+
+        data = []
+        for month in months[0].range(months[1]):
+            report = reports.get((month.year, month.month))
             data.append({
-                'name': dt.strftime('%B %Y'),
-                'value': [dt.year, dt.month],
-                'report_url': report_url,
+                'name': month.first_day().strftime('%B %Y'),
+                'value': [month.year, month.month],
+                'report_url': settings.MEDIA_URL + report if report else '',
             })
-
-        return Response(data)
+        return data
 
     @action(methods=['post'], detail=False,
             authentication_classes=[CsrfExemptSessionAuthentication])
@@ -165,129 +293,50 @@ class InvoicingViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(methods=['get'], detail=False)
     def download(self, request):
-        """ Download Invoicing Report. """
-        today = datetime.date.today()
-        year = self.request.query_params.get('year', today.year)
-        month = int(self.request.query_params.get('month', today.month))
-
-        filename = f'Invoicing_Report_{calendar.month_name[month]}_{year}.xls'
-        response = HttpResponse(content_type='application/ms-excel')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        """
+        Download Invoicing Report of a month (`year` and `month`) or of a
+        range of months (`start` and `end`, YYYY-MM), as XLSX or as CSV
+        (`file_format`).
+        """
+        file_format = request.query_params.get('file_format', 'xlsx')
 
-        queryset = self.filter_queryset(self.get_queryset())
-        data = self.get_serializer(queryset, many=True).data
-
-        wb = Workbook(encoding='utf-8')
-
-        font_style = XFStyle()
-        font_style.alignment.wrap = 1
-        font_style_bold = XFStyle()
-        font_style_bold.font.bold = True
-
-        def write_header(ws, row_num, header):
-            for i, column in enumerate(header):
-                ws.write(row_num, i, column, font_style_bold)
-                ws.col(i).width = 8000
-
-        def write_row(ws, row_num, row):
-            for i in range(len(row)):
-                ws.write(row_num, i, row[i], font_style)
-
-        # First sheet
-        ws = wb.add_sheet('Invoicing')
-        row_num = 0
-        header = [
-            'Request ID',
-            'Cost Unit',
-            'Sequencer',
-            'Date + Flowcell ID',
-            'Pool ID',
-            '% of Lanes',
-            'Read Length',
-            '# of Libraries/Samples',
-            'Library Preparation Protocol',
-            'Fixed Costs',
-            'Sequencing Costs',
-            'Preparation Costs',
-            'Variable Costs',
-            'Total Costs',
-        ]
-        write_header(ws, row_num, header)
-
-        for item in data:
-            row_num += 1
-
-            # cost_units = '; '.join(sorted(item['cost_unit']))
-            sequencers = '; '.join(
-                sorted(list({x['sequencer_name'] for x in item['sequencer']})))
-            flowcells = '; '.join(item['flowcell'])
-            pools = '; '.join(item['pool'])
-
-            percentage = '; '.join(list(
-                map(
-                    lambda x: ', '.join([y['percentage'] for y in x['pools']]),
-                    item['percentage']
-                )
-            ))
-
-            read_lengths = '; '.join(ReadLength.objects.filter(
-                pk__in=item['read_length']
-            ).order_by('name').values_list('name', flat=True))
-
-            protocol = LibraryProtocol.objects.get(pk=item['library_protocol'])
-
-            row = [
-                item['request'],
-                item['cost_unit'],
-                sequencers,
-                flowcells,
-                pools,
-                percentage,
-                read_lengths,
-                item['num_libraries_samples'],
-                protocol.name,
-                item['fixed_costs'],
-                item['sequencing_costs'],
-                item['preparation_costs'],
-                item['variable_costs'],
-                item['total_costs'],
-            ]
-            write_row(ws, row_num, row)
-
-        # Second sheet
-        ws = wb.add_sheet('Fixed Costs')
-        row_num = 0
-        header = ['Sequencer', 'Price']
-        write_header(ws, row_num, header)
-        for item in FixedCosts.objects.all():
-            row_num += 1
-            row = [item.sequencer.name, item.price]
-            write_row(ws, row_num, row)
-
-        # Third sheet
-        ws = wb.add_sheet('Preparation Costs')
-        row_num = 0
-        header = ['Library Protocol', 'Price']
-        write_header(ws, row_num, header)
-        for item in LibraryPreparationCosts.objects.all():
-            row_num += 1
-            row = [item.library_protocol.name, item.price]
-            write_row(ws, row_num, row)
-
-        # Fourth sheet
-        ws = wb.add_sheet('Sequencing Costs')
-        row_num = 0
-        header = ['Sequencer + Read Length', 'Price']
-        write_header(ws, row_num, header)
-        for item in SequencingCosts.objects.all():
-            row_num += 1
-            row = [
-                f'{item.sequencer.name} {item.read_length.name}',
-                item.price,
-            ]
-            write_row(ws, row_num, row)
+        try:
+            if file_format not in ('xlsx', 'csv'):
+                raise ValueError('Invalid file format.')
+
+            start = request.query_params.get('start', None)
+            end = request.query_params.get('end', None)
+            if start and end:
+                start, end = Month.from_string(start), Month.from_string(end)
+                name = f'{start}_{end}'
+            else:
+                start = end = self.get_month()
+                name = f'{calendar.month_name[start.month]}_{start.year}'
+
+            if start > end:
+                raise ValueError('Invalid billing period.')
+
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, 400)
+
+        # The months are computed one by one as the rows are written
+        months = (self.get_invoices(x) for x in start.range(end))
+        filename = f'Invoicing_Report_{name}.{file_format}'
+
+        if file_format == 'csv':
+            writer = csv.writer(Echo())
+            rows = itertools.chain([HEADER], get_invoicing_rows(months))
+            response = StreamingHttpResponse(
+                (writer.writerow(row) for row in rows),
+                content_type='text/csv',
+            )
+        else:
+            file = tempfile.TemporaryFile()
+            write_xlsx(file, months)
+            file.seek(0)
+            response = FileResponse(file, content_type=XLSX_CONTENT_TYPE)
 
-        wb.save(response)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
 
@@ -1,32 +1,44 @@
+from django.apps import apps
 from django.db.models import F, Func, Value
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 
+from sample.models import Sample
 from index_generator.models import Pool
 from .models import LibraryPreparation
 
+RecordTurnaround = apps.get_model('report', 'RecordTurnaround')
+
 
 @receiver(m2m_changed, sender=Pool.samples.through)
-def update_samples(sender, instance, action, **kwargs):
+def update_samples(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    When a sample is added to a pool, set its is_pooled and is_converted
-    to True, update the barcode, and for each sample in the pool create a
+    When samples are added to a pool, set their is_pooled and is_converted
+    to True, update their barcodes, and for each sample create a
     LibraryPreparation object.
     """
-    if action == 'post_add':
-        instance.samples.all().update(
-            is_pooled=True,
-            is_converted=True,
-            barcode=Func(
-                F('barcode'),
-                Value('S'), Value('L'),
-                function='replace',
-            ),
-        )
+    if action != 'post_add' or not pk_set:
+        return
+
+    # Only the newly added samples are in pk_set
+    sample_ids = [instance.pk] if reverse else list(pk_set)
+    Sample.objects.filter(pk__in=sample_ids).update(
+        is_pooled=True,
+        is_converted=True,
+        barcode=Func(
+            F('barcode'),
+            Value('S'), Value('L'),
+            function='replace',
+        ),
+    )
+
+    existing_ids = set(LibraryPreparation.objects.filter(
+        sample__in=sample_ids).values_list('sample', flat=True))
+    new_ids = [x for x in sample_ids if x not in existing_ids]
+    LibraryPreparation.objects.bulk_create([
+        LibraryPreparation(sample_id=x) for x in new_ids
+    ])
 
-        # TODO: maybe there is a better way to create multiple objects at once
-        for sample in instance.samples.all():
-            obj, created = LibraryPreparation.objects.get_or_create(
-                sample=sample)
-            if created:
-                obj.save()
+    # bulk_create() sends no post_save, so update the samples' milestones
+    if new_ids:
+        RecordTurnaround.refresh([], new_ids)
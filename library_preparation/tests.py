@@ -3,7 +3,8 @@ import json
 from django.core.urlresolvers import reverse
 
 from common.tests import BaseTestCase
-from common.utils import get_random_name
+from common.utils import get_random_name, QueryCounter
+from sample.models import Sample
 from sample.tests import create_sample
 from request.models import Request
 from index_generator.tests import create_pool
@@ -51,6 +52,33 @@ class TestLibraryPreparationModel(BaseTestCase):
         self.assertEqual(
             LibraryPreparation.objects.filter(sample=sample).count(), 1)
 
+    def test_create_library_preparation_objects_bulk(self):
+        """
+        Ensure adding samples to a pool takes a constant number of queries
+        and only creates Library Preparation objects for the new samples.
+        """
+        def add_samples(pool, num_samples):
+            samples = [
+                create_sample(get_random_name(), 2)
+                for _ in range(num_samples)
+            ]
+            with QueryCounter() as counter:
+                pool.samples.add(*samples)
+            return samples, counter.count
+
+        pool = create_pool(self.user)
+        samples, num_queries = add_samples(pool, 2)
+        self.assertEqual(add_samples(pool, 10)[1], num_queries)
+
+        # Add a sample to another pool through the reverse relation
+        samples[0].pool.add(create_pool(self.user))
+        self.assertEqual(LibraryPreparation.objects.filter(
+            sample__in=Sample.objects.filter(pool=pool)).count(), 12)
+        self.assertTrue(all(
+            x.is_converted and x.barcode[2] == 'L'
+            for x in Sample.objects.filter(pool=pool)
+        ))
+
 
 # Views
 
@@ -1,6 +1,7 @@
 from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 
+from library.models import Library
 from sample.models import Sample
 from index_generator.models import Pool
 from library_preparation.models import LibraryPreparation
@@ -8,19 +9,24 @@ from .models import Pooling
 
 
 @receiver(m2m_changed, sender=Pool.libraries.through)
-def update_libraries_create_pooling_obj(sender, instance, action, **kwargs):
+def update_libraries_create_pooling_obj(sender, instance, action, reverse,
+                                        pk_set, **kwargs):
     """
-    When a library is added to a pool, set its is_pooled to True, and
+    When libraries are added to a pool, set their is_pooled to True, and
     for each library create a Pooling object.
     """
-    if action == 'post_add':
-        instance.libraries.all().update(is_pooled=True)
+    if action != 'post_add' or not pk_set:
+        return
+
+    # Only the newly added libraries are in pk_set
+    library_ids = [instance.pk] if reverse else list(pk_set)
+    Library.objects.filter(pk__in=library_ids).update(is_pooled=True)
 
-        # TODO: maybe there is a better way to create multiple objects at once
-        for library in instance.libraries.all():
-            obj, created = Pooling.objects.get_or_create(library=library)
-            if created:
-                obj.save()
+    existing_ids = set(Pooling.objects.filter(
+        library__in=library_ids).values_list('library', flat=True))
+    Pooling.objects.bulk_create([
+        Pooling(library_id=x) for x in library_ids if x not in existing_ids
+    ])
 
 
 @receiver(post_save, sender=Sample)
@@ -30,18 +36,14 @@ def create_pooling_objects_sample(sender, instance, **kwargs):
     create a Pooling object for it.
     """
 
-    # Ignore the signal if a sample is not in a pool yet
-    if not instance.is_pooled:
+    # Ignore the signal if a sample is not in a pool yet or hasn't passed
+    # the quality check
+    if not instance.is_pooled or instance.status != 3:
         return
 
-    try:
-        lib_prep_object = LibraryPreparation.objects.get(sample=instance)
-    except LibraryPreparation.DoesNotExist:
-        lib_prep_object = None
-
-    if lib_prep_object and instance.status == 3:
-        # If a sample has an associated Library Preparation object and
-        # passes the quality check, create a Pooling object for the sample
-        obj, created = Pooling.objects.get_or_create(sample=instance)
-        if created:
-            obj.save()
+    # If a sample has an associated Library Preparation object (and no
+    # Pooling object yet), create a Pooling object for the sample
+    if LibraryPreparation.objects.filter(
+        sample=instance, sample__pooling__isnull=True,
+    ).exists():
+        Pooling.objects.create(sample=instance)
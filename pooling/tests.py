@@ -77,6 +77,11 @@ class TestPoolingModel(BaseTestCase):
         pool.libraries.add(library)
         self.assertEqual(Pooling.objects.filter(library=library).count(), 1)
 
+        # Adding the library to another pool doesn't create another object
+        library.pool.add(create_pool(self.user))
+        self.assertEqual(Pooling.objects.filter(library=library).count(), 1)
+        self.assertTrue(library.__class__.objects.get(pk=library.pk).is_pooled)
+
     def test_create_pooling_object_from_sample(self):
         """
         Ensure a Pooling object is created when a sample passed the quality
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from report.models import IndexLookup, RecordFlowcell, RecordTurnaround
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the lookup, rollup, and turnaround tables of the report'
+
+    def handle(self, *args, **options):
+        IndexLookup.refresh()
+        RecordFlowcell.refresh()
+        RecordTurnaround.refresh()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully refreshed the report tables.'))
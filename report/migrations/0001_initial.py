@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('library', '0002_auto_20200227_1634'),
+        ('library_sample_shared', '0009_auto_20210126_1348'),
+        ('sample', '0003_auto_20200227_1634'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexLookup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_group', models.CharField(max_length=2, verbose_name='Index Group')),
+                ('index', models.CharField(max_length=24, verbose_name='Index')),
+                ('index_id', models.CharField(max_length=20, verbose_name='Index ID')),
+                ('index_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library_sample_shared.IndexType', verbose_name='Index Type')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecordFlowcell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flowcell_date', models.DateField(verbose_name='Flowcell create time')),
+                ('sequencers', models.TextField(blank=True, verbose_name='Sequencers')),
+                ('library', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.Library', verbose_name='Library')),
+                ('sample', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sample.Sample', verbose_name='Sample')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='indexlookup',
+            unique_together=set([('index_type', 'index_group', 'index')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_auto_20200227_1634'),
+        ('sample', '0003_auto_20200227_1634'),
+        ('report', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordTurnaround',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, verbose_name='Created')),
+                ('prepared', models.DateTimeField(blank=True, null=True, verbose_name='Prepared')),
+                ('sequenced', models.DateTimeField(blank=True, null=True, verbose_name='Sequenced')),
+                ('library', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.Library', verbose_name='Library')),
+                ('sample', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sample.Sample', verbose_name='Sample')),
+            ],
+        ),
+    ]
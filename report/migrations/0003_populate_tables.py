@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from report.models import (
+    refresh_index_lookup,
+    refresh_record_flowcells,
+    refresh_record_turnarounds,
+)
+
+
+def populate_tables(apps, schema_editor):
+    """ Build the lookup, rollup, and turnaround tables of existing data. """
+    refresh_index_lookup(apps.get_model('report', 'IndexLookup'))
+    refresh_record_flowcells(apps.get_model('report', 'RecordFlowcell'))
+    refresh_record_turnarounds(apps.get_model('report', 'RecordTurnaround'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_sample_shared', '0009_auto_20210126_1348'),
+        ('library_preparation', '0001_initial'),
+        ('index_generator', '0003_poolsize_obsolete'),
+        ('flowcell', '0002_sequencer_obsolete'),
+        ('report', '0002_recordturnaround'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_tables, migrations.RunPython.noop),
+    ]
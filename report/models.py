@@ -0,0 +1,214 @@
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from library_sample_shared.models import IndexType
+from library.models import Library
+from sample.models import Sample
+
+
+def get_records(apps, library_ids, sample_ids):
+    """
+    Return the (field name, model, ids) of given libraries and samples
+    to refresh. If both are None, all records are refreshed (ids = None).
+    """
+    Library = apps.get_model('library', 'Library')
+    Sample = apps.get_model('sample', 'Sample')
+
+    if library_ids is None and sample_ids is None:
+        return [('library', Library, None), ('sample', Sample, None)]
+
+    return [
+        (field, model, ids)
+        for field, model, ids in [
+            ('library', Library, library_ids),
+            ('sample', Sample, sample_ids),
+        ]
+        if ids
+    ]
+
+
+def refresh_index_lookup(model, index_type_ids=None):
+    """
+    Rebuild the lookup for given index types (all if None). If several
+    indices of an index type share a sequence, the first one is used.
+
+    `model` is `IndexLookup`, or its historical version in a migration.
+    """
+    IndexType = model._meta.apps.get_model(
+        'library_sample_shared', 'IndexType')
+    index_types = IndexType.objects.prefetch_related(
+        'indices_i7', 'indices_i5')
+    if index_type_ids is not None:
+        index_types = index_types.filter(pk__in=index_type_ids)
+
+    entries = {}
+    for index_type in index_types:
+        for index_group, indices in [
+            ('i7', index_type.indices_i7.all()),
+            ('i5', index_type.indices_i5.all()),
+        ]:
+            for index in sorted(indices, key=lambda x: x.pk):
+                entries.setdefault(
+                    (index_type.pk, index_group, index.index),
+                    index.prefix + index.number,
+                )
+
+    with transaction.atomic():
+        lookups = model.objects.all()
+        if index_type_ids is not None:
+            lookups = lookups.filter(index_type_id__in=index_type_ids)
+        lookups.delete()
+
+        model.objects.bulk_create([
+            model(index_type_id=index_type_id, index_group=index_group,
+                  index=index, index_id=index_id)
+            for (index_type_id, index_group, index), index_id
+            in entries.items()
+        ])
+
+
+def refresh_record_flowcells(model, library_ids=None, sample_ids=None):
+    """
+    Rebuild the rollup for given libraries and samples (all records
+    if both are None).
+
+    The create date is the one in UTC, as in the export query the rollup
+    replaces (`create_time::date` on a UTC database connection).
+
+    `model` is `RecordFlowcell`, or its historical version in a migration.
+    """
+    with transaction.atomic():
+        for field, record_model, ids in get_records(
+                model._meta.apps, library_ids, sample_ids):
+            rollups = model.objects.filter(**{f'{field}__isnull': False})
+            queryset = record_model.objects.filter(
+                pool__lane__flowcell__isnull=False)
+            if ids is not None:
+                rollups = rollups.filter(**{f'{field}__in': ids})
+                queryset = queryset.filter(pk__in=ids)
+            rollups.delete()
+
+            sequencers = defaultdict(set)
+            for pk, create_time, sequencer in queryset.values_list(
+                'pk',
+                'pool__lane__flowcell__create_time',
+                'pool__lane__flowcell__sequencer__name',
+            ).distinct():
+                if timezone.is_aware(create_time):
+                    create_time = create_time.astimezone(timezone.utc)
+                sequencers[(pk, create_time.date())].add(sequencer)
+
+            model.objects.bulk_create([
+                model(**{
+                    f'{field}_id': pk,
+                    'flowcell_date': date,
+                    'sequencers': ', '.join(sorted(names)),
+                })
+                for (pk, date), names in sequencers.items()
+            ])
+
+
+def refresh_record_turnarounds(model, library_ids=None, sample_ids=None):
+    """
+    Rebuild the milestones of given libraries and samples (all records
+    if both are None).
+
+    `model` is `RecordTurnaround`, or its historical version in a
+    migration.
+    """
+    with transaction.atomic():
+        for field, record_model, ids in get_records(
+                model._meta.apps, library_ids, sample_ids):
+            turnarounds = model.objects.filter(**{f'{field}__isnull': False})
+            queryset = record_model.objects.all()
+            if ids is not None:
+                turnarounds = turnarounds.filter(**{f'{field}__in': ids})
+                queryset = queryset.filter(pk__in=ids)
+            turnarounds.delete()
+
+            fields = ['pk', 'create_time', 'sequenced']
+            if field == 'sample':
+                fields.append('librarypreparation__create_time')
+
+            model.objects.bulk_create([
+                model(**{
+                    f'{field}_id': x[0],
+                    'created': x[1],
+                    'sequenced': x[2],
+                    'prepared': x[3] if len(x) > 3 else None,
+                })
+                for x in queryset.annotate(sequenced=models.Min(
+                    'pool__lane__flowcell__create_time',
+                )).values_list(*fields)
+            ])
+
+
+class IndexLookup(models.Model):
+    """
+    Index ID (prefix + number) of every index sequence of an index type,
+    used by the database export instead of a subquery per record.
+    """
+    index_type = models.ForeignKey(IndexType, verbose_name='Index Type')
+    index_group = models.CharField('Index Group', max_length=2)
+    index = models.CharField('Index', max_length=24)
+    index_id = models.CharField('Index ID', max_length=20)
+
+    class Meta:
+        unique_together = ('index_type', 'index_group', 'index')
+
+    def __str__(self):
+        return f'{self.index_id} ({self.index_group}): {self.index}'
+
+    @classmethod
+    def refresh(cls, index_type_ids=None):
+        """ Rebuild the lookup for given index types (all if None). """
+        refresh_index_lookup(cls, index_type_ids)
+
+
+class RecordFlowcell(models.Model):
+    """
+    Create date and sequencers of the flowcells a library or a sample has
+    been loaded on, one row per record and flowcell create date.
+    """
+    library = models.ForeignKey(
+        Library, verbose_name='Library', related_name='+',
+        null=True, blank=True)
+    sample = models.ForeignKey(
+        Sample, verbose_name='Sample', related_name='+',
+        null=True, blank=True)
+    flowcell_date = models.DateField('Flowcell create time')
+    sequencers = models.TextField('Sequencers', blank=True)
+
+    def __str__(self):
+        return f'{self.library or self.sample}: {self.flowcell_date}'
+
+    @classmethod
+    def refresh(cls, library_ids=None, sample_ids=None):
+        """ Rebuild the rollup for given records (all if both None). """
+        refresh_record_flowcells(cls, library_ids, sample_ids)
+
+
+class RecordTurnaround(models.Model):
+    """
+    Workflow milestones of a library or a sample: creation, library
+    preparation (samples only), and the first flowcell it was loaded on.
+    """
+    library = models.OneToOneField(
+        Library, verbose_name='Library', related_name='+',
+        null=True, blank=True)
+    sample = models.OneToOneField(
+        Sample, verbose_name='Sample', related_name='+',
+        null=True, blank=True)
+    created = models.DateTimeField('Created', db_index=True)
+    prepared = models.DateTimeField('Prepared', null=True, blank=True)
+    sequenced = models.DateTimeField('Sequenced', null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.library or self.sample}: {self.created}'
+
+    @classmethod
+    def refresh(cls, library_ids=None, sample_ids=None):
+        """ Rebuild the milestones of given records (all if both None). """
+        refresh_record_turnarounds(cls, library_ids, sample_ids)
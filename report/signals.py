@@ -0,0 +1,204 @@
+from django.apps import apps
+from django.db.models.signals import (
+    post_save, pre_delete, post_delete, m2m_changed,
+)
+from django.dispatch import receiver
+
+from .models import IndexLookup, RecordFlowcell, RecordTurnaround
+
+IndexI7 = apps.get_model('library_sample_shared', 'IndexI7')
+IndexI5 = apps.get_model('library_sample_shared', 'IndexI5')
+IndexType = apps.get_model('library_sample_shared', 'IndexType')
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+LibraryPreparation = apps.get_model(
+    'library_preparation', 'LibraryPreparation')
+Pool = apps.get_model('index_generator', 'Pool')
+Sequencer = apps.get_model('flowcell', 'Sequencer')
+Flowcell = apps.get_model('flowcell', 'Flowcell')
+Lane = apps.get_model('flowcell', 'Lane')
+
+
+def get_records(pools):
+    """ Return the ids of the libraries and samples of given pools. """
+    return (
+        list(pools.values_list('libraries', flat=True).distinct()),
+        list(pools.values_list('samples', flat=True).distinct()),
+    )
+
+
+def refresh_records(library_ids, sample_ids):
+    """
+    Rebuild the flowcell rollup and the turnaround milestones of given
+    libraries and samples.
+    """
+    library_ids = [x for x in library_ids if x is not None]
+    sample_ids = [x for x in sample_ids if x is not None]
+    RecordFlowcell.refresh(library_ids, sample_ids)
+    RecordTurnaround.refresh(library_ids, sample_ids)
+
+
+# Index ID lookup
+
+@receiver(post_save, sender=IndexI7)
+@receiver(post_save, sender=IndexI5)
+def refresh_index_lookup(sender, instance, **kwargs):
+    """ When an index is changed, rebuild its index types' lookups. """
+    IndexLookup.refresh(list(
+        instance.index_type.values_list('pk', flat=True)))
+
+
+@receiver(post_delete, sender=IndexI7)
+@receiver(post_delete, sender=IndexI5)
+def refresh_index_lookup_all(sender, **kwargs):
+    """ When an index is deleted, rebuild all lookups. """
+    IndexLookup.refresh()
+
+
+@receiver(m2m_changed, sender=IndexType.indices_i7.through)
+@receiver(m2m_changed, sender=IndexType.indices_i5.through)
+def refresh_index_lookup_indices(sender, instance, action, reverse,
+                                 pk_set, **kwargs):
+    """
+    When indices are added to or removed from an index type, rebuild
+    the lookup of the index type.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    if not reverse:
+        IndexLookup.refresh([instance.pk])
+    elif pk_set:
+        IndexLookup.refresh(list(pk_set))
+    else:
+        IndexLookup.refresh()
+
+
+# Flowcell rollup and turnaround
+
+@receiver(post_save, sender=Library)
+@receiver(post_save, sender=Sample)
+def create_record_turnaround(sender, instance, created, **kwargs):
+    """ When a library or a sample is created, add its milestones. """
+    if created:
+        if sender is Library:
+            RecordTurnaround.refresh([instance.pk], [])
+        else:
+            RecordTurnaround.refresh([], [instance.pk])
+
+
+@receiver(post_save, sender=LibraryPreparation)
+def update_record_turnaround_prepared(sender, instance, created, **kwargs):
+    """ When a sample is prepared, update its milestones. """
+    if created:
+        RecordTurnaround.objects.filter(sample_id=instance.sample_id).update(
+            prepared=instance.create_time)
+
+
+@receiver(post_delete, sender=LibraryPreparation)
+def update_record_turnaround_unprepared(sender, instance, **kwargs):
+    """ When a library preparation is deleted, update the milestones. """
+    RecordTurnaround.objects.filter(sample_id=instance.sample_id).update(
+        prepared=None)
+
+
+@receiver(m2m_changed, sender=Pool.libraries.through)
+@receiver(m2m_changed, sender=Pool.samples.through)
+def refresh_record_flowcells_pool(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    """
+    When libraries or samples are added to or removed from a pool,
+    rebuild their rollup.
+    """
+    is_library = sender is Pool.libraries.through
+
+    if action == 'pre_clear' and not reverse:
+        records = instance.libraries if is_library else instance.samples
+        instance._report_records = list(
+            records.values_list('pk', flat=True))
+        return
+
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    if reverse:
+        record_ids = [instance.pk]
+    elif action == 'post_clear':
+        record_ids = getattr(instance, '_report_records', [])
+    else:
+        record_ids = list(pk_set)
+
+    if is_library:
+        refresh_records(record_ids, [])
+    else:
+        refresh_records([], record_ids)
+
+
+@receiver(m2m_changed, sender=Flowcell.lanes.through)
+def refresh_record_flowcells_lanes(sender, instance, action, reverse,
+                                   pk_set, **kwargs):
+    """
+    When lanes are added to or removed from a flowcell, rebuild the rollup
+    of the records of the lanes' pools.
+    """
+    if action == 'pre_clear' and not reverse:
+        instance._report_records = get_records(
+            Pool.objects.filter(lane__flowcell=instance))
+        return
+
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    if reverse:
+        records = get_records(Pool.objects.filter(lane=instance))
+    elif action == 'post_clear':
+        records = getattr(instance, '_report_records', ([], []))
+    else:
+        records = get_records(Pool.objects.filter(lane__pk__in=pk_set))
+
+    refresh_records(*records)
+
+
+@receiver(post_save, sender=Flowcell)
+def refresh_record_flowcells_flowcell(sender, instance, created, **kwargs):
+    """ When a flowcell is changed, rebuild the rollup of its records. """
+    if not created:
+        refresh_records(*get_records(
+            Pool.objects.filter(lane__flowcell=instance)))
+
+
+@receiver(post_save, sender=Lane)
+def refresh_record_flowcells_lane(sender, instance, created, **kwargs):
+    """ When a lane is changed, rebuild the rollup of its pool's records. """
+    if not created:
+        refresh_records(*get_records(Pool.objects.filter(lane=instance)))
+
+
+@receiver(post_save, sender=Sequencer)
+def refresh_record_flowcells_sequencer(sender, instance, created, **kwargs):
+    """ When a sequencer is renamed, rebuild the rollup of its records. """
+    if not created:
+        refresh_records(*get_records(
+            Pool.objects.filter(lane__flowcell__sequencer=instance)))
+
+
+@receiver(pre_delete, sender=Flowcell)
+@receiver(pre_delete, sender=Lane)
+@receiver(pre_delete, sender=Pool)
+def store_record_flowcells_records(sender, instance, **kwargs):
+    """ Remember the records affected by the deletion of an object. """
+    if sender is Flowcell:
+        pools = Pool.objects.filter(lane__flowcell=instance)
+    elif sender is Lane:
+        pools = Pool.objects.filter(lane=instance)
+    else:
+        pools = Pool.objects.filter(pk=instance.pk)
+    instance._report_records = get_records(pools)
+
+
+@receiver(post_delete, sender=Flowcell)
+@receiver(post_delete, sender=Lane)
+@receiver(post_delete, sender=Pool)
+def refresh_record_flowcells_deleted(sender, instance, **kwargs):
+    """ When an object is deleted, rebuild the rollup of its records. """
+    refresh_records(*getattr(instance, '_report_records', ([], [])))
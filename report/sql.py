@@ -1,3 +1,14 @@
+# Barcodes (e.g., 18L000123) are sorted by year and number, followed by
+# malformed barcodes. Must match `DatabaseQuery.barcode_key`
+BARCODE_ORDER = '''
+CASE WHEN {0} ~ '^[0-9][0-9][A-Za-z][0-9]+$' THEN 0 ELSE 1 END,
+CASE WHEN {0} ~ '^[0-9][0-9][A-Za-z][0-9]+$'
+    THEN CAST(left({0}, 2) AS integer) ELSE 0 END,
+CASE WHEN {0} ~ '^[0-9][0-9][A-Za-z][0-9]+$'
+    THEN CAST(substr({0}, 4) AS integer) ELSE 0 END,
+{0} COLLATE "C"
+'''
+
 LIBRARY_SELECT = '''
 record.mean_fragment_size AS "Mean Fragment Size",
 record.qpcr_result AS "qPCR Result",
@@ -44,28 +55,8 @@ FROM (
         record.amount_facility AS "Amount (Facility)",
         record.size_distribution_facility AS "Size Distribution (Facility)",
 
-        (
-            SELECT concat(i.prefix, i.number)
-            FROM library_sample_shared_indextype as it
-            INNER JOIN library_sample_shared_indextype_indices_i7 AS indices
-                ON it.id = indices.indextype_id
-            INNER JOIN library_sample_shared_indexi7 as i
-                ON indices.id = i.id
-            WHERE it.id = record.index_type_id AND i.index = record.index_i7
-            LIMIT 1
-        ) AS "Index I7 ID",
-
-        (
-            SELECT concat(i.prefix, i.number)
-            FROM library_sample_shared_indextype as it
-            INNER JOIN library_sample_shared_indextype_indices_i5 AS indices
-                ON it.id = indices.indextype_id
-            INNER JOIN library_sample_shared_indexi5 as i
-                ON indices.id = i.id
-            WHERE it.id = record.index_type_id AND i.index = record.index_i5
-            LIMIT 1
-        ) AS "Index I5 ID",
-
+        il7.index_id AS "Index I7 ID",
+        il5.index_id AS "Index I5 ID",
 
         r.name AS "Request",
         concat(u.first_name, ' ', u.last_name) AS "User",
@@ -79,7 +70,8 @@ FROM (
         pooling.concentration_c1 AS "Concentration C1",
         p.name AS "Pool",
         concat(psize.multiplier, 'x', psize.size) AS "Pool Size",
-        
+        rf.flowcell_date AS "Flowcell create time",
+        coalesce(rf.sequencers, '') AS "Sequencer",
 
         /* Sample-specific fields */
         {select}
@@ -116,6 +108,14 @@ FROM (
     LEFT JOIN library_sample_shared_indextype as it
         ON record.index_type_id = it.id
 
+    LEFT JOIN report_indexlookup as il7
+        ON record.index_type_id = il7.index_type_id
+        AND il7.index_group = 'i7' AND record.index_i7 = il7.index
+
+    LEFT JOIN report_indexlookup as il5
+        ON record.index_type_id = il5.index_type_id
+        AND il5.index_group = 'i5' AND record.index_i5 = il5.index
+
     LEFT JOIN index_generator_pool_{table_name_plural} as ps
         ON record.id = ps.{table_name}_id
 
@@ -127,30 +127,33 @@ FROM (
 
     LEFT JOIN pooling_pooling as pooling
         ON record.id = pooling.{table_name}_id
-    
-    
+
+    LEFT JOIN report_recordflowcell as rf
+        ON record.id = rf.{table_name}_id
 
     /* Sample-specific joins */
     {joins}
+
+    {where}
 ) t1
 
+ORDER BY {barcode_order}, t1_id
+'''
 
-LEFT JOIN (
-    SELECT record.id AS t2_id, f.create_time::date AS "Flowcell create time",
-        array_to_string(array_agg(DISTINCT s.name), ', ') AS "Sequencer"
-    FROM {table_name}_{table_name} AS record
-    LEFT JOIN index_generator_pool_{table_name_plural} as ps
-        ON record.id = ps.{table_name}_id
-    LEFT JOIN index_generator_pool as p
-        ON ps.pool_id = p.id
-    LEFT JOIN flowcell_lane as l
-        ON p.id = l.pool_id
-    LEFT JOIN flowcell_flowcell_lanes as fl
-        ON l.id = fl.lane_id
-    LEFT JOIN flowcell_flowcell as f
-        ON fl.flowcell_id = f.id
-    LEFT JOIN flowcell_sequencer AS s
-        ON f.sequencer_id = s.id
-    GROUP BY record.id, f.create_time::date
-) t2 ON t1_id = t2_id
+PAGE_QUERY = '''
+SELECT record.id, record.barcode
+FROM {table_name}_{table_name} AS record
+{where}
+ORDER BY {barcode_order}, record.id
+LIMIT %s
+'''
+
+REQUEST_FILTER = '''
+record.id IN (
+    SELECT rs.{table_name}_id
+    FROM request_request_{table_name_plural} AS rs
+    INNER JOIN request_request AS r
+        ON rs.request_id = r.id
+    WHERE r.name = %s
+)
 '''
@@ -1,3 +1,441 @@
-from django.test import TestCase
+from unittest import skipUnless
+from importlib import import_module
+from datetime import datetime, timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
+from common.models import Organization, PrincipalInvestigator
+from common.tests import BaseTestCase
+from common.utils import get_random_name
+from library_sample_shared.tests import create_index_type
+from library.tests import create_library
+from sample.tests import create_sample
+from index_generator.tests import create_pool
+from index_generator.models import Pool
+from request.tests import create_request
+from flowcell.tests import create_sequencer, create_lane, create_flowcell
+from library_sample_shared.models import IndexI7
+from library_preparation.models import LibraryPreparation
+
+from .models import IndexLookup, RecordFlowcell, RecordTurnaround
+from .signals import refresh_record_flowcells_pool
+from .views import Report, DatabaseQuery
+
+
+# Models
+
+class TestIndexLookup(BaseTestCase):
+    def setUp(self):
+        self.index_type = create_index_type(get_random_name())
+
+    def test_index_added(self):
+        index = IndexI7(prefix='A', number='01', index='GTAAAT')
+        index.save()
+        self.index_type.indices_i7.add(index)
+
+        lookup = IndexLookup.objects.get(index_type=self.index_type)
+        self.assertEqual(lookup.index_group, 'i7')
+        self.assertEqual(lookup.index, 'GTAAAT')
+        self.assertEqual(lookup.index_id, 'A01')
+
+    def test_index_changed_and_removed(self):
+        index = IndexI7(prefix='A', number='01', index='GTAAAT')
+        index.save()
+        self.index_type.indices_i7.add(index)
+
+        index.index = 'TACGTT'
+        index.save()
+        self.assertEqual(IndexLookup.objects.get(
+            index_type=self.index_type).index, 'TACGTT')
+
+        self.index_type.indices_i7.remove(index)
+        self.assertFalse(IndexLookup.objects.filter(
+            index_type=self.index_type).exists())
+
+
+class TestRecordFlowcell(BaseTestCase):
+    def setUp(self):
+        user = self.create_user()
+        self.library = create_library(get_random_name())
+        self.sample = create_sample(get_random_name())
+
+        self.pool = create_pool(user)
+        self.pool.libraries.add(self.library)
+        self.pool.samples.add(self.sample)
+
+        self.sequencer = create_sequencer(get_random_name())
+        self.flowcell = create_flowcell(get_random_name(), self.sequencer)
+        self.lane = create_lane('Lane 1', self.pool)
+
+    def test_lanes_added(self):
+        self.assertFalse(RecordFlowcell.objects.exists())
+        self.flowcell.lanes.add(self.lane)
+
+        library_rollup = RecordFlowcell.objects.get(library=self.library)
+        sample_rollup = RecordFlowcell.objects.get(sample=self.sample)
+        create_date = self.flowcell.create_time.astimezone(
+            timezone.utc).date()
+        self.assertEqual(library_rollup.flowcell_date, create_date)
+        self.assertEqual(library_rollup.sequencers, self.sequencer.name)
+        self.assertEqual(sample_rollup.sequencers, self.sequencer.name)
+
+    def test_record_removed_from_pool(self):
+        self.flowcell.lanes.add(self.lane)
+        self.pool.libraries.remove(self.library)
+        self.assertFalse(
+            RecordFlowcell.objects.filter(library=self.library).exists())
+        self.assertTrue(
+            RecordFlowcell.objects.filter(sample=self.sample).exists())
+
+    def test_flowcell_deleted(self):
+        self.flowcell.lanes.add(self.lane)
+        self.flowcell.delete()
+        self.assertFalse(RecordFlowcell.objects.exists())
+
+    def test_utc_date(self):
+        # Already the next day in local time (Europe/Berlin)
+        create_time = datetime(2020, 1, 1, 23, 30, tzinfo=timezone.utc)
+        type(self.flowcell).objects.filter(pk=self.flowcell.pk).update(
+            create_time=create_time)
+        self.flowcell.lanes.add(self.lane)
+
+        library_rollup = RecordFlowcell.objects.get(library=self.library)
+        self.assertEqual(
+            library_rollup.flowcell_date, datetime(2020, 1, 1).date())
+
+    def test_full_refresh(self):
+        self.flowcell.lanes.add(self.lane)
+        RecordFlowcell.objects.all().delete()
+        RecordFlowcell.refresh()
+        self.assertEqual(RecordFlowcell.objects.count(), 2)
+
+
+class TestPopulateTables(BaseTestCase):
+    def test_migration(self):
+        user = self.create_user()
+        index_type = create_index_type(get_random_name())
+        index = IndexI7(prefix='A', number='01', index='GTAAAT')
+        index.save()
+        index_type.indices_i7.add(index)
+
+        library = create_library(get_random_name())
+        pool = create_pool(user)
+        pool.libraries.add(library)
+        flowcell = create_flowcell(get_random_name(), create_sequencer(
+            get_random_name()))
+        flowcell.lanes.add(create_lane('Lane 1', pool))
+
+        # Tables of the data which existed before the migration
+        for model in [IndexLookup, RecordFlowcell, RecordTurnaround]:
+            model.objects.all().delete()
+
+        migration = import_module('report.migrations.0003_populate_tables')
+        state = MigrationLoader(connection).project_state(
+            ('report', '0003_populate_tables'))
+        migration.populate_tables(state.apps, None)
+
+        self.assertEqual(
+            IndexLookup.objects.get(index_type=index_type).index_id, 'A01')
+        self.assertEqual(
+            RecordFlowcell.objects.get(library=library).sequencers,
+            flowcell.sequencer.name,
+        )
+        self.assertEqual(
+            RecordTurnaround.objects.get(library=library).sequenced,
+            flowcell.create_time,
+        )
+
+
+class TestRecordTurnaround(BaseTestCase):
+    def setUp(self):
+        user = self.create_user()
+        self.library = create_library(get_random_name())
+        self.sample = create_sample(get_random_name())
+
+        self.pool = create_pool(user)
+        self.pool.libraries.add(self.library)
+        self.pool.samples.add(self.sample)
+
+        sequencer = create_sequencer(get_random_name())
+        self.flowcell = create_flowcell(get_random_name(), sequencer)
+        self.lane = create_lane('Lane 1', self.pool)
+
+    def test_milestones(self):
+        library_turnaround = RecordTurnaround.objects.get(
+            library=self.library)
+        self.assertEqual(library_turnaround.created, self.library.create_time)
+        self.assertIsNone(library_turnaround.sequenced)
+
+        # The library preparation was created when the sample was pooled
+        sample_turnaround = RecordTurnaround.objects.get(sample=self.sample)
+        self.assertEqual(
+            sample_turnaround.prepared,
+            LibraryPreparation.objects.get(sample=self.sample).create_time,
+        )
+
+        self.flowcell.lanes.add(self.lane)
+        library_turnaround = RecordTurnaround.objects.get(
+            library=self.library)
+        self.assertEqual(
+            library_turnaround.sequenced, self.flowcell.create_time)
+
+    def test_prepared_without_pool_refresh(self):
+        """
+        Ensure the preparation milestone is set when the library
+        preparations are bulk created, whatever the order of the receivers.
+        """
+        sample = create_sample(get_random_name())
+        m2m_changed.disconnect(
+            refresh_record_flowcells_pool, sender=Pool.samples.through)
+        try:
+            self.pool.samples.add(sample)
+        finally:
+            m2m_changed.connect(
+                refresh_record_flowcells_pool, sender=Pool.samples.through)
+
+        self.assertEqual(
+            RecordTurnaround.objects.get(sample=sample).prepared,
+            LibraryPreparation.objects.get(sample=sample).create_time,
+        )
+
+    def test_report_turnaround(self):
+        self.flowcell.lanes.add(self.lane)
+        RecordTurnaround.objects.filter(sample=self.sample).update(
+            created=self.flowcell.create_time - timedelta(days=10),
+            prepared=self.flowcell.create_time - timedelta(days=4),
+        )
+        RecordTurnaround.objects.filter(library=self.library).update(
+            created=self.flowcell.create_time - timedelta(days=3))
+
+        now = datetime.now()
+        report = Report(now - timedelta(days=30), now + timedelta(days=1))
+        rows = list(report.get_turnaround()['rows'])
+        self.assertEqual(
+            [x['Turnaround'] for x in rows], [
+                'Request -> Preparation',
+                'Preparation -> Sequencing',
+                'Complete Workflow',
+            ])
+        self.assertEqual([x['Sample (days)'] for x in rows], [6, 4, 10])
+        self.assertEqual([x['Library (days)'] for x in rows], [0, 0, 3])
+
+        # Records created outside of the date range are ignored
+        report = Report(now + timedelta(days=1), now + timedelta(days=2))
+        rows = list(report.get_turnaround()['rows'])
+        self.assertEqual([x['Sample (days)'] for x in rows], [0, 0, 0])
+
+
+# Views
+
+class TestReportCounts(BaseTestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name='Org')
+        pi = PrincipalInvestigator.objects.create(
+            name='PI', organization=organization)
+        user = self.create_user()
+        user.organization = organization
+        user.pi = pi
+        user.save()
+
+        self.library = create_library(get_random_name())
+        self.sample = create_sample(get_random_name())
+        request = create_request(user)
+        request.libraries.add(self.library)
+        request.samples.add(self.sample)
+
+        # A library without a request
+        create_library(get_random_name())
+
+        pool = create_pool(user)
+        pool.libraries.add(self.library)
+        pool.samples.add(self.sample)
+
+        self.sequencer = create_sequencer(get_random_name())
+        flowcell = create_flowcell(get_random_name(), self.sequencer)
+        flowcell.lanes.add(
+            create_lane('Lane 1', pool), create_lane('Lane 2', pool))
+
+        # A run without records created within the period
+        create_flowcell(get_random_name(), self.sequencer)
+
+        now = datetime.now()
+        self.report = Report(now - timedelta(days=1), now + timedelta(days=1))
+
+    def test_request_counts(self):
+        self.assertEqual(self.report.get_total_counts(), [
+            {'type': 'Samples', 'count': 1},
+            {'type': 'Libraries', 'count': 1},
+        ])
+        self.assertEqual(self.report.get_organization_counts(), [
+            {'name': 'Org', 'libraries_count': 1, 'samples_count': 1},
+        ])
+        self.assertEqual(self.report.get_pi_counts(), [
+            {'name': 'PI', 'libraries_count': 1, 'samples_count': 1},
+        ])
+        self.assertEqual(
+            self.report.get_library_protocol_counts()[0]['libraries_count'],
+            1,
+        )
+
+    def test_sequencer_counts(self):
+        self.assertEqual(self.report.get_sequencer_counts(), [{
+            'name': self.sequencer.name,
+            'items_count': 2,
+            'runs_count': 2,
+        }])
+        self.assertEqual(
+            self.report.get_sequencers_list(), [self.sequencer.name])
+        self.assertEqual(
+            self.report.get_pi_sequencer_counts(),
+            {'PI': {self.sequencer.name: 2}},
+        )
+
+    def test_no_records(self):
+        now = datetime.now()
+        report = Report(now + timedelta(days=1), now + timedelta(days=2))
+        self.assertEqual(report.get_total_counts(), [])
+        self.assertEqual(report.get_organization_counts(), [])
+        self.assertEqual(report.get_sequencer_counts(), [])
+        self.assertEqual(report.get_pi_sequencer_counts(), {})
+
+    def test_report_view(self):
+        self.login()
+        response = self.client.get('/report/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_counts'], [
+            {'type': 'Samples', 'count': 1},
+            {'type': 'Libraries', 'count': 1},
+        ])
+
+
+class TestDatabaseQuery(BaseTestCase):
+    def test_params(self):
+        db_query = DatabaseQuery({
+            'start': '01.02.2020',
+            'end': '29.02.2020',
+            'status': '2',
+            'request': 'Request',
+            'barcode': '20l',
+            'after': '20L000010',
+            'limit': '100',
+        })
+        self.assertEqual(db_query.limit, 100)
+        self.assertEqual(db_query.after, '20L000010')
+
+        params = [x for _, condition_params in db_query.filters
+                  for x in condition_params]
+        self.assertEqual(params, [
+            datetime(2020, 2, 1),
+            datetime(2020, 2, 29, 23, 59, 59),
+            2,
+            'Request',
+            '20L%',
+            0, 20, 10, '20L000010',
+        ])
+
+        where, _ = db_query.get_where('library', 'libraries')
+        self.assertIn('request_request_libraries', where)
+        self.assertIn("record.barcode ~ '^[0-9][0-9][A-Za-z][0-9]+$'", where)
+
+    def test_no_params(self):
+        db_query = DatabaseQuery({})
+        self.assertEqual(db_query.filters, [])
+        self.assertEqual(db_query.limit, 0)
+        self.assertEqual(db_query.get_where('library', 'libraries'), ('', []))
+
+    def test_invalid_params(self):
+        for params, message in [
+            ({'start': '2020-02-01'}, 'Invalid date.'),
+            ({'end': '31.02.2020'}, 'Invalid date.'),
+            ({'status': 'done'}, 'Invalid status.'),
+            ({'barcode': "20L%'"}, 'Invalid barcode.'),
+            ({'limit': 'all'}, 'Invalid limit.'),
+            ({'limit': '-1'}, 'Invalid limit.'),
+            ({'limit': str(DatabaseQuery.MAX_LIMIT + 1)}, 'Invalid limit.'),
+        ]:
+            with self.assertRaises(ValueError) as context:
+                DatabaseQuery(params)
+            self.assertEqual(str(context.exception), message)
+
+    def test_where_ids(self):
+        db_query = DatabaseQuery({'status': '1'})
+        where, params = db_query.get_where('sample', 'samples', [3, 4])
+        self.assertEqual(
+            where, 'WHERE record.status = %s AND record.id IN (%s, %s)')
+        self.assertEqual(params, [1, 3, 4])
+
+    def test_barcode_key(self):
+        barcodes = [
+            '20S000002', '', '19L000010', 'import-1', '20L000002',
+            '19S000009', '2OL000001', '20L00000X', None,
+        ]
+        self.assertEqual(sorted(barcodes, key=DatabaseQuery.barcode_key), [
+            '19S000009', '19L000010', '20L000002', '20S000002',
+            '', None, '20L00000X', '2OL000001', 'import-1',
+        ])
+
+    def test_merge(self):
+        libraries = [{'Barcode': x} for x in [
+            '19L000001', '20L000003', 'imported']]
+        samples = [{'Barcode': x} for x in [
+            '20S000002', '20S000004', 'bad barcode']]
+
+        rows = DatabaseQuery({}).merge([iter(libraries), iter(samples)])
+        self.assertEqual([x['Barcode'] for x in rows], [
+            '19L000001', '20S000002', '20L000003', '20S000004',
+            'bad barcode', 'imported',
+        ])
+
+    def test_invalid_params_view(self):
+        self.create_user()
+        self.login()
+        response = self.client.get('/db_data/', {
+            'limit': 'all',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Invalid limit.')
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'The database export queries require PostgreSQL.')
+class TestDatabaseQueryPages(BaseTestCase):
+    def setUp(self):
+        self.libraries = [create_library(get_random_name()) for _ in range(3)]
+        self.samples = [create_sample(get_random_name()) for _ in range(2)]
+
+        # Interleaved barcodes and a malformed one
+        for record, barcode in zip(
+            self.libraries + self.samples,
+            ['20L000001', '20L000003', 'imported', '20S000002', '20S000004'],
+        ):
+            type(record).objects.filter(pk=record.pk).update(barcode=barcode)
+
+    def get_pages(self, limit):
+        pages, after = [], ''
+        while True:
+            db_query = DatabaseQuery({'limit': limit, 'after': after})
+            rows, after = db_query.get_page()
+            pages.append([x['Barcode'] for x in rows])
+            if after is None:
+                return pages
+
+    def test_page_boundaries(self):
+        self.assertEqual(self.get_pages(2), [
+            ['20L000001', '20S000002'],
+            ['20L000003', '20S000004'],
+            ['imported'],
+        ])
+
+    def test_single_page(self):
+        self.assertEqual(self.get_pages(5), [[
+            '20L000001', '20S000002', '20L000003', '20S000004', 'imported',
+        ]])
+
+    def test_stream(self):
+        rows = DatabaseQuery({}).get_rows(chunked=True)
+        self.assertEqual([x['Barcode'] for x in rows], [
+            '20L000001', '20S000002', '20L000003', '20S000004', 'imported',
+        ])
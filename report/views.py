@@ -1,18 +1,30 @@
+import re
+import csv
+import json
+import heapq
+import itertools
 from datetime import datetime
 from collections import OrderedDict, Counter
 
 from django.apps import apps
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.db import connection
-from django.db.models import Prefetch
+from django.db.models import Count
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 
 import numpy as np
-from pandas import DataFrame
+from pandas import DataFrame, to_datetime
 
-from .sql import QUERY, LIBRARY_SELECT, SAMPLE_SELECT, SAMPLE_JOINS
+from common.cache import get_cached
+from common.utils import Echo
+
+from .sql import (
+    QUERY, PAGE_QUERY, REQUEST_FILTER, BARCODE_ORDER,
+    LIBRARY_SELECT, SAMPLE_SELECT, SAMPLE_JOINS,
+)
 
 Organization = apps.get_model('common', 'Organization')
 PrincipalInvestigator = apps.get_model('common', 'PrincipalInvestigator')
@@ -26,272 +38,209 @@ Pool = apps.get_model('index_generator', 'Pool')
 Sequencer = apps.get_model('flowcell', 'Sequencer')
 Flowcell = apps.get_model('flowcell', 'Flowcell')
 Lane = apps.get_model('flowcell', 'Lane')
+RecordTurnaround = apps.get_model('report', 'RecordTurnaround')
+
+# Well-formed barcodes, as matched in `BARCODE_ORDER`
+BARCODE_RE = re.compile(r'[0-9][0-9][A-Za-z][0-9]+')
+
+DATABASE_COLUMNS = [
+    'Name',
+    'Barcode',
+    'Status',
+    'Request',
+    'User',
+    'Library Type',
+    'Library Protocol',
+    'Concentration',
+    'Sequencing Depth',
+    'Read Length',
+    'Concentration Method',
+    'Equal Representation of Nucleotides',
+    'Index Type',
+    'Index Reads',
+    'Index I7 ID',
+    'Index I7',
+    'Index I5 ID',
+    'Index I5',
+    'Amplification Cycles',
+    'Dilution Factor',
+    'Concentration (Facility)',
+    'Sample Volume (Facility)',
+    'Amount (Facility)',
+    'Size Distribution (Facility)',
+    'Concentration Method (Facility)',
+    'RNA Quality (Facility)',
+    'Organism',
+    'Concentration C1',
+    'RNA Quality',
+    'Nucleic Acid Type',
+    'Starting Amount',
+    'Spike-in Volume',
+    'PCR Cycles',
+    'Concentration Library',
+    'Mean Fragment Size',
+    'nM',
+    'qPCR Result',
+    'qPCR Result (Facility)',
+    'Pool',
+    'Pool Size',
+    'Flowcell ID',
+    'Flowcell create time',
+    'Sequencer',
+]
 
 
 class Report:
     def __init__(self, start, end):
-        libraries_qs = Library.objects.select_related(
-            'library_protocol').only('id', 'library_protocol__name').filter(
-                create_time__gt=start, create_time__lt=end)
-
-        samples_qs = Sample.objects.select_related(
-            'library_protocol').only('id', 'library_protocol__name').filter(
-                create_time__gt=start, create_time__lt=end)
-
-        self.requests = Request.objects.select_related(
-            'user__organization', 'user__pi',
-        ).prefetch_related(
-            Prefetch('libraries', queryset=libraries_qs,
-                     to_attr='fetched_libraries'),
-            Prefetch('samples', queryset=samples_qs,
-                     to_attr='fetched_samples'),
-        ).only(
-            'id',
-            'libraries',
-            'samples',
-            'user__organization__name',
-            'user__pi__name',
-        )
-
-        lanes_qs = Lane.objects.select_related('pool').prefetch_related(
-            Prefetch('pool__libraries', queryset=libraries_qs,
-                     to_attr='fetched_libraries'),
-            Prefetch('pool__samples', queryset=samples_qs,
-                     to_attr='fetched_samples'),
-        ).only('id', 'pool__libraries', 'pool__samples')
-
-        self.flowcells = Flowcell.objects.select_related(
-            'sequencer',
-        ).prefetch_related(
-            Prefetch('lanes', queryset=lanes_qs, to_attr='fetched_lanes'),
-        ).only('id', 'sequencer__name', 'lanes')
+        self.start = start
+        self.end = end
+        self._request_counts = None
+        self._flowcell_counts = None
+
+    def get_records(self, model):
+        """ Return the libraries or samples created within the period. """
+        return model.objects.filter(
+            create_time__gt=self.start, create_time__lt=self.end)
+
+    def get_request_counts(self):
+        """
+        Return the numbers of libraries and samples per request user's
+        organization, PI, and library protocol.
+        """
+        if self._request_counts is None:
+            self._request_counts = []
+            for model, key in [(Library, 'libraries'), (Sample, 'samples')]:
+                self._request_counts.extend(
+                    (key, x['request__user__organization__name'],
+                     x['request__user__pi__name'],
+                     x['library_protocol__name'], x['count'])
+                    for x in self.get_records(model).filter(
+                        request__isnull=False,
+                    ).values(
+                        'request__user__organization__name',
+                        'request__user__pi__name',
+                        'library_protocol__name',
+                    ).annotate(count=Count('pk')).order_by()
+                )
+        return self._request_counts
+
+    def get_flowcell_counts(self):
+        """
+        Return the numbers of libraries and samples per sequencer, flowcell,
+        pool, and request user's PI.
+        """
+        if self._flowcell_counts is None:
+            self._flowcell_counts = []
+            for model in [Library, Sample]:
+                self._flowcell_counts.extend(
+                    (x['pool__lane__flowcell__sequencer__name'],
+                     x['request'], x['request__user__pi__name'], x['count'])
+                    for x in self.get_records(model).filter(
+                        pool__lane__flowcell__isnull=False,
+                    ).values(
+                        'pool__lane__flowcell__sequencer__name',
+                        'pool__lane__flowcell',
+                        'pool',
+                        'request',
+                        'request__user__pi__name',
+                    ).annotate(count=Count('pk', distinct=True)).order_by()
+                )
+        return self._flowcell_counts
 
     def get_total_counts(self):
         data = []
-        num_libraries = 0
-        num_samples = 0
+        counts = Counter()
 
-        for req in self.requests:
-            num_libraries += len(req.fetched_libraries)
-            num_samples += len(req.fetched_samples)
+        for key, _, _, _, count in self.get_request_counts():
+            counts[key] += count
 
-        if num_samples > 0:
-            data.append({'type': 'Samples', 'count': num_samples})
+        if counts['samples'] > 0:
+            data.append({'type': 'Samples', 'count': counts['samples']})
 
-        if num_libraries > 0:
-            data.append({'type': 'Libraries', 'count': num_libraries})
+        if counts['libraries'] > 0:
+            data.append({'type': 'Libraries', 'count': counts['libraries']})
 
         return data
 
     def get_organization_counts(self):
-        counts = {}
-
-        for req in self.requests:
-            organization = req.user.organization
-            org_name = organization.name if organization else 'None'
-            if org_name not in counts.keys():
-                counts[org_name] = {'libraries': 0, 'samples': 0}
-            counts[org_name]['libraries'] += len(req.fetched_libraries)
-            counts[org_name]['samples'] += len(req.fetched_samples)
-
-        return self._get_data(counts)
+        return self._get_request_data(lambda org, pi, protocol: org)
 
     def get_library_protocol_counts(self):
-        counts = {}
-
-        for req in self.requests:
-            # Extract Library Protocols
-            library_protocols = [
-                x.library_protocol.name for x in req.fetched_libraries]
-            sample_protocols = [
-                x.library_protocol.name for x in req.fetched_samples]
-
-            # Merge the counts
-            library_cnt = {x[0]: {'libraries': x[1]}
-                           for x in Counter(library_protocols).items()}
-            sample_cnt = {x[0]: {'samples': x[1]}
-                          for x in Counter(sample_protocols).items()}
-            count = {
-                k: {
-                    **library_cnt.get(k, {'libraries': 0}),
-                    **sample_cnt.get(k, {'samples': 0}),
-                }
-                for k in library_cnt.keys() | sample_cnt.keys()
-            }
-
-            for k, v in count.items():
-                temp_dict = counts.get(k, {'libraries': 0, 'samples': 0})
-                temp_dict['libraries'] += v['libraries']
-                temp_dict['samples'] += v['samples']
-                counts[k] = temp_dict
-
-        return self._get_data(counts)
+        return self._get_request_data(lambda org, pi, protocol: protocol)
 
     def get_pi_counts(self):
-        counts = {}
-
-        for req in self.requests:
-            pi = req.user.pi
-            pi_name = pi.name if pi else 'None'
-            if pi_name not in counts.keys():
-                counts[pi_name] = {'libraries': 0, 'samples': 0}
-            counts[pi_name]['libraries'] += len(req.fetched_libraries)
-            counts[pi_name]['samples'] += len(req.fetched_samples)
-
-        return self._get_data(counts)
+        return self._get_request_data(lambda org, pi, protocol: pi)
 
     def get_sequencer_counts(self):
         counts = {}
 
-        for flowcell in self.flowcells:
-            sequencer_name = flowcell.sequencer.name
-            if sequencer_name not in counts.keys():
-                counts[sequencer_name] = {
-                    'libraries': 0, 'samples': 0, 'runs': 0}
-            counts[sequencer_name]['runs'] += 1
+        for sequencer_name, _, _, count in self.get_flowcell_counts():
+            counts[sequencer_name] = counts.get(sequencer_name, 0) + count
 
-            pools = {x.pool for x in flowcell.fetched_lanes}
-            for pool in pools:
-                counts[sequencer_name]['libraries'] += \
-                    len(pool.fetched_libraries)
-                counts[sequencer_name]['samples'] += \
-                    len(pool.fetched_samples)
+        runs = dict(Flowcell.objects.filter(
+            sequencer__name__in=counts.keys(),
+        ).values_list('sequencer__name').annotate(Count('pk')).order_by())
 
         data = [
             {
                 'name': name,
-                'items_count': count['libraries'] + count['samples'],
-                'runs_count': count['runs'],
+                'items_count': count,
+                'runs_count': runs.get(name, 0),
             }
             for name, count in counts.items()
-            if count['libraries'] + count['samples'] > 0
+            if count > 0
         ]
 
         return sorted(data, key=lambda x: x['name'])
 
     def get_sequencers_list(self):
-        return sorted({x.sequencer.name for x in self.flowcells})
+        return sorted(set(Flowcell.objects.values_list(
+            'sequencer__name', flat=True).distinct()))
 
     def get_pi_sequencer_counts(self):
-        sequencer_mapping = {}
-        for flowcell in self.flowcells:    # gets records from flowcell
-            sequencer_name = flowcell.sequencer.name
-            pools = {x.pool for x in flowcell.fetched_lanes}
-            for pool in pools:
-                records = pool.fetched_libraries + pool.fetched_samples
-                for record in records:
-                    if record not in sequencer_mapping:
-                        sequencer_mapping[record] = []
-                    sequencer_mapping[record].append(sequencer_name)
-        items = sequencer_mapping.keys()
-
-        pi_mapping = {}
-        for req in self.requests:    # gets records from requests
-            pi = req.user.pi
-            pi_name = pi.name if pi else 'None'
-            records = req.fetched_libraries + req.fetched_samples
-
-            pi_mapping.update({
-                record: pi_name for record in records if record in items
-            })
-
-        pairs = []
-        for k, v in sequencer_mapping.items():
-            for sequencer_name in v:
-                try:
-                    pairs.append((pi_mapping[k], sequencer_name))
-                except KeyError:    # KeyError if record exists under flowcell but the correspond. request was deleted.
-                    pass    # could add a warning pop-up here
-        counts = Counter(pairs)
-
         data = {}
-        for item, count in counts.items():
-            if item[0] not in data:
-                data[item[0]] = {}
-            data[item[0]][item[1]] = count
 
-        return OrderedDict(sorted(data.items()))
+        for sequencer_name, request_id, pi_name, count in \
+                self.get_flowcell_counts():
+            # Ignore the records whose requests were deleted
+            if request_id is None:
+                continue
 
-    def get_turnaround(self):
-        query = '''
-        CREATE TEMPORARY TABLE IF NOT EXISTS temp1 AS SELECT
-            L.id,
-            CAST('Library' AS CHAR(7)) rtype,
-            L.create_time date1,
-            CAST(NULL AS TIMESTAMPTZ) date2
-        FROM library_library L;
-
-        CREATE TEMPORARY TABLE IF NOT EXISTS temp2 AS SELECT
-            L.id,
-            MIN(F.create_time) date3
-        FROM library_library L
-        LEFT JOIN index_generator_pool_libraries PR
-            ON L.id = PR.library_id
-        LEFT JOIN index_generator_pool P
-            ON PR.pool_id = P.id
-        LEFT JOIN flowcell_lane La
-            ON P.id = La.pool_id
-        LEFT JOIN flowcell_flowcell_lanes FL
-            ON La.id = FL.lane_id
-        LEFT JOIN flowcell_flowcell F
-            ON FL.flowcell_id = F.id
-        GROUP BY L.id;
-
-        CREATE TEMPORARY TABLE IF NOT EXISTS temp3 AS SELECT
-            S.id,
-            CAST('Sample' AS CHAR(6)) rtype,
-            S.create_time date1,
-            LP.create_time date2
-        FROM sample_sample S
-        LEFT JOIN library_preparation_librarypreparation LP
-            ON S.id = LP.sample_id;
-
-        CREATE TEMPORARY TABLE IF NOT EXISTS temp4 AS SELECT
-            S.id,
-            MIN(F.create_time) date3
-        FROM sample_sample S
-        LEFT JOIN index_generator_pool_samples PR
-            ON S.id = PR.sample_id
-        LEFT JOIN index_generator_pool P
-            ON PR.pool_id = P.id
-        LEFT JOIN flowcell_lane L
-            ON P.id = L.pool_id
-        LEFT JOIN flowcell_flowcell_lanes FL
-            ON L.id = FL.lane_id
-        LEFT JOIN flowcell_flowcell F
-            ON FL.flowcell_id = F.id
-        GROUP BY S.id;
-
-        SELECT
-            rtype, date1, date2, date3
-        FROM (
-            SELECT *
-            FROM temp1 t1
-            LEFT JOIN temp2 t2 ON t1.id = t2.id
-            UNION ALL
-            SELECT *
-            FROM temp3 t1
-            LEFT JOIN temp4 t2 ON t1.id = t2.id
-        ) t
-        '''
+            pi_name = pi_name if pi_name else 'None'
+            sequencer_counts = data.setdefault(pi_name, {})
+            sequencer_counts[sequencer_name] = \
+                sequencer_counts.get(sequencer_name, 0) + count
 
-        with connection.cursor() as c:
-            c.execute(query)
-            columns = [x[0] for x in c.description]
-            df = DataFrame(c.fetchall(), columns=columns)
+        return OrderedDict(sorted(data.items()))
 
-        df['Request -> Preparation'] = df.date2 - df.date1
-        df['Preparation -> Sequencing'] = df.date3 - df.date2
-        df['Complete Workflow'] = df.date3 - df.date1
+    def get_turnaround(self):
+        turnarounds = RecordTurnaround.objects.filter(
+            created__gt=self.start, created__lt=self.end,
+        ).values_list('library', 'created', 'prepared', 'sequenced')
+
+        df = DataFrame([
+            ('Sample' if x[0] is None else 'Library',) + x[1:]
+            for x in turnarounds.iterator()
+        ], columns=['rtype', 'date1', 'date2', 'date3'])
+        for column in ['date1', 'date2', 'date3']:
+            df[column] = to_datetime(df[column], utc=True)
+
+        durations = [
+            'Request -> Preparation',
+            'Preparation -> Sequencing',
+            'Complete Workflow',
+        ]
+        # Durations in days
+        day = np.timedelta64(1, 'D')
+        df[durations[0]] = (df.date2 - df.date1) / day
+        df[durations[1]] = (df.date3 - df.date2) / day
+        df[durations[2]] = (df.date3 - df.date1) / day
 
-        agg_samples_df = \
-            df[df.rtype == 'Sample'].aggregate(['mean', 'std']).fillna(0)
-        agg_samples_df = (agg_samples_df / np.timedelta64(1, 'D')).astype(int)
+        agg_samples_df = df[df.rtype == 'Sample'][durations] \
+            .aggregate(['mean', 'std']).fillna(0).astype(int)
 
-        agg_libraries_df = df[df.rtype == 'Library'].iloc[:, -1]\
-            .aggregate(['mean', 'std']).fillna(0)
-        agg_libraries_df = \
-            (agg_libraries_df / np.timedelta64(1, 'D')).astype(int)
+        agg_libraries_df = df[df.rtype == 'Library'][durations[-1]] \
+            .aggregate(['mean', 'std']).fillna(0).astype(int)
 
         columns = [
             'Turnaround',
@@ -302,7 +251,7 @@ class Report:
         ]
 
         result_df = DataFrame(columns=columns)
-        result_df[columns[0]] = df.columns[4:]
+        result_df[columns[0]] = durations
         result_df[columns[1]] = agg_samples_df.loc['mean'].values
         result_df[columns[2]] = agg_samples_df.loc['std'].values
         result_df[columns[3]] = [0] * 2 + [agg_libraries_df.loc['mean']]
@@ -310,9 +259,26 @@ class Report:
 
         return {
             'columns': columns,
-            'rows': result_df.T.to_dict().values(),
+            'rows': list(result_df.T.to_dict().values()),
         }
 
+    def _get_request_data(self, get_name):
+        """
+        Sum the numbers of libraries and samples by a given group
+        (organization, PI, or library protocol).
+        """
+        counts = {}
+
+        for key, org_name, pi_name, protocol_name, count in \
+                self.get_request_counts():
+            name = get_name(org_name, pi_name, protocol_name)
+            name = name if name else 'None'
+            if name not in counts:
+                counts[name] = {'libraries': 0, 'samples': 0}
+            counts[name][key] += count
+
+        return self._get_data(counts)
+
     @staticmethod
     def _get_data(counts):
         data = [
@@ -328,11 +294,181 @@ class Report:
         return sorted(data, key=lambda x: x['name'])
 
 
+class DatabaseQuery:
+    """
+    Fetch the libraries and samples of the database view, sorted by barcode,
+    optionally filtered by create time, status, request, and barcode prefix.
+
+    Both tables are queried separately, already sorted, and their rows are
+    merged on the fly, so that they can be paginated (keyset pagination on
+    the barcode) or streamed from server-side cursors.
+    """
+    TABLES = [
+        ('library', 'libraries', LIBRARY_SELECT, ''),
+        ('sample', 'samples', SAMPLE_SELECT, SAMPLE_JOINS),
+    ]
+    MAX_LIMIT = 5000
+    CHUNK_SIZE = 2000
+
+    def __init__(self, params):
+        self.filters = []
+
+        start = params.get('start', '')
+        end = params.get('end', '')
+        try:
+            if start:
+                start = datetime.strptime(start, '%d.%m.%Y')
+                self.filters.append(('record.create_time >= %s', [start]))
+            if end:
+                end = datetime.strptime(end, '%d.%m.%Y').replace(
+                    hour=23, minute=59, second=59)
+                self.filters.append(('record.create_time <= %s', [end]))
+        except ValueError:
+            raise ValueError('Invalid date.')
+
+        status = params.get('status', '')
+        if status:
+            try:
+                self.filters.append(('record.status = %s', [int(status)]))
+            except ValueError:
+                raise ValueError('Invalid status.')
+
+        request_name = params.get('request', '')
+        if request_name:
+            self.filters.append((REQUEST_FILTER, [request_name]))
+
+        barcode = params.get('barcode', '')
+        if barcode:
+            if not barcode.isalnum():
+                raise ValueError('Invalid barcode.')
+            self.filters.append(
+                ('record.barcode LIKE %s', [barcode.upper() + '%']))
+
+        self.after = params.get('after', '')
+        if self.after:
+            self.filters.append((
+                f'({BARCODE_ORDER.format("record.barcode")}) > '
+                '(%s, %s, %s, %s)',
+                list(self.barcode_key(self.after)),
+            ))
+
+        try:
+            self.limit = int(params.get('limit', 0))
+        except ValueError:
+            self.limit = -1
+        if not 0 <= self.limit <= self.MAX_LIMIT:
+            raise ValueError('Invalid limit.')
+
+    def get_page(self):
+        """
+        Return the rows of the next `limit` records and the barcode to
+        continue from (None if it is the last page).
+        """
+        records = []
+        with connection.cursor() as c:
+            for table_name, table_name_plural, _, _ in self.TABLES:
+                where, params = self.get_where(table_name, table_name_plural)
+                c.execute(PAGE_QUERY.format(
+                    table_name=table_name,
+                    where=where,
+                    barcode_order=BARCODE_ORDER.format('record.barcode'),
+                ), params + [self.limit])
+                records.extend((
+                    self.barcode_key(barcode), table_name, pk,
+                ) for pk, barcode in c.fetchall())
+
+        records = sorted(records)[:self.limit]
+        ids = {x[0]: [] for x in self.TABLES}
+        for _, table_name, pk in records:
+            ids[table_name].append(pk)
+
+        rows = self.merge(
+            self.execute(connection.cursor(), table_name, table_name_plural,
+                         select, joins, ids[table_name])
+            for table_name, table_name_plural, select, joins in self.TABLES
+            if ids[table_name]
+        )
+        next_barcode = records[-1][0][-1] \
+            if len(records) == self.limit else None
+
+        return list(rows), next_barcode
+
+    def get_rows(self, chunked=False):
+        """
+        Return an iterator over the rows of all matching records. If
+        `chunked` is True, the rows are fetched from server-side cursors
+        in chunks.
+        """
+        return self.merge(
+            self.execute(
+                connection.chunked_cursor() if chunked
+                else connection.cursor(),
+                table_name, table_name_plural, select, joins,
+            )
+            for table_name, table_name_plural, select, joins in self.TABLES
+        )
+
+    def execute(self, cursor, table_name, table_name_plural, select, joins,
+                ids=None):
+        """ Yield the rows (as dicts) of a given table. """
+        where, params = self.get_where(table_name, table_name_plural, ids)
+        query = QUERY.format(
+            table_name=table_name,
+            table_name_plural=table_name_plural,
+            select=select,
+            joins=joins,
+            where=where,
+            barcode_order=BARCODE_ORDER.format('t1."Barcode"'),
+        )
+
+        with cursor as c:
+            c.execute(query, params)
+            columns = [col[0] for col in c.description]
+
+            rows = c.fetchmany(self.CHUNK_SIZE)
+            while rows:
+                for row in rows:
+                    yield dict(zip(columns, row))
+                rows = c.fetchmany(self.CHUNK_SIZE)
+
+    def get_where(self, table_name, table_name_plural, ids=None):
+        """ Return the WHERE clause and its parameters for a given table. """
+        conditions, params = [], []
+        for condition, condition_params in self.filters:
+            conditions.append(condition.format(
+                table_name=table_name,
+                table_name_plural=table_name_plural,
+            ))
+            params.extend(condition_params)
+
+        if ids is not None:
+            conditions.append('record.id IN ({})'.format(
+                ', '.join(['%s'] * len(ids))))
+            params.extend(ids)
+
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return where, params
+
+    def merge(self, tables):
+        """ Merge the sorted rows of the tables by barcode. """
+        return heapq.merge(
+            *tables, key=lambda x: self.barcode_key(x['Barcode']))
+
+    @staticmethod
+    def barcode_key(barcode):
+        """
+        Return the sort key of a barcode, e.g., 18L000123. Malformed
+        barcodes (e.g., of records imported by hand) are sorted last.
+        """
+        barcode = barcode or ''
+        if BARCODE_RE.fullmatch(barcode):
+            return 0, int(barcode[:2]), int(barcode[3:]), barcode
+        return 1, 0, 0, barcode
+
+
 @login_required
 @staff_member_required
 def report(request):
-    data = {}
-
     now = datetime.now()
     start = request.GET.get('start', now)
     end = request.GET.get('end', now)
@@ -343,7 +479,7 @@ def report(request):
     except ValueError:
         start = now
     finally:
-        start = start.replace(hour=0, minute=0)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
 
     try:
         end = datetime.strptime(end, '%d.%m.%Y') \
@@ -351,12 +487,18 @@ def report(request):
     except ValueError:
         end = now
     finally:
-        end = end.replace(hour=23, minute=59)
+        end = end.replace(hour=23, minute=59, second=59, microsecond=0)
 
     if start > end:
-        start = end.replace(hour=0, minute=0)
+        start = end.replace(hour=0, minute=0, second=0)
+
+    data = get_cached('report', start, end, lambda: get_report_data(
+        Report(start, end)))
+    return render(request, 'report.html', data)
 
-    report = Report(start, end)
+
+def get_report_data(report):
+    data = {}
 
     # Total Sample Count
     data['total_counts'] = report.get_total_counts()
@@ -380,7 +522,7 @@ def report(request):
     # Count days
     data['turnaround'] = report.get_turnaround()
 
-    return render(request, 'report.html', data)
+    return data
 
 
 @login_required
@@ -388,80 +530,58 @@ def report(request):
 def database(request):
     return render(request, 'database.html')
 
+
 # @print_sql_queries
 @login_required
 @staff_member_required
 def database_data(request):
-    with connection.cursor() as c:
-        query = QUERY.format(
-            table_name='library',
-            table_name_plural='libraries',
-            select=LIBRARY_SELECT,
-            joins='',
-        )
-        c.execute(query)
-        columns = [col[0] for col in c.description]
-        libraries = [dict(zip(columns, row)) for row in c.fetchall()]
+    """
+    Return the libraries and samples of the database view as JSON,
+    or stream them as NDJSON or CSV (`format`).
 
-        query = QUERY.format(
-            table_name='sample',
-            table_name_plural='samples',
-            select=SAMPLE_SELECT,
-            joins=SAMPLE_JOINS,
-        )
-        c.execute(query)
-        columns = [col[0] for col in c.description]
-        samples = [dict(zip(columns, row)) for row in c.fetchall()]
-
-    data = sorted(libraries + samples, key=lambda x: (
-        int(x['Barcode'][:2]),
-        int(x['Barcode'][3:]),
-    ))
-
-    columns = [
-        'Name',
-        'Barcode',
-        'Status',
-        'Request',
-        'User',
-        'Library Type',
-        'Library Protocol',
-        'Concentration',
-        'Sequencing Depth',
-        'Read Length',
-        'Concentration Method',
-        'Equal Representation of Nucleotides',
-        'Index Type',
-        'Index Reads',
-        'Index I7 ID',
-        'Index I7',
-        'Index I5 ID',
-        'Index I5',
-        'Amplification Cycles',
-        'Dilution Factor',
-        'Concentration (Facility)',
-        'Sample Volume (Facility)',
-        'Amount (Facility)',
-        'Size Distribution (Facility)',
-        'Concentration Method (Facility)',
-        'RNA Quality (Facility)',
-        'Organism',
-        'Concentration C1',
-        'RNA Quality',
-        'Nucleic Acid Type',
-        'Starting Amount',
-        'Spike-in Volume',
-        'PCR Cycles',
-        'Concentration Library',
-        'Mean Fragment Size',
-        'nM',
-        'qPCR Result',
-        'qPCR Result (Facility)',
-        'Pool',
-        'Pool Size',
-        'Flowcell ID',
-        'Flowcell create time',
-        'Sequencer',
-    ]
+    The records can be filtered by `start`/`end` create date (dd.mm.YYYY),
+    `status`, `request` name, and `barcode` prefix. If `limit` is set,
+    the JSON response only contains a page of records and the barcode to
+    pass as `after` to get the next page (`next`).
+    """
+    output_format = request.GET.get('format', 'json')
 
-    return JsonResponse({'columns': columns, 'data': data})
+    try:
+        if output_format not in ('json', 'ndjson', 'csv'):
+            raise ValueError('Invalid format.')
+
+        db_query = DatabaseQuery(request.GET)
+        if output_format == 'json' and db_query.limit:
+            data, next_barcode = db_query.get_page()
+        elif output_format == 'json':
+            data, next_barcode = list(db_query.get_rows()), None
+
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    if output_format == 'ndjson':
+        response = StreamingHttpResponse((
+            json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+            for row in db_query.get_rows(chunked=True)
+        ), content_type='application/x-ndjson')
+
+    elif output_format == 'csv':
+        writer = csv.writer(Echo())
+        rows = itertools.chain(
+            [DATABASE_COLUMNS],
+            ([row.get(x, '') for x in DATABASE_COLUMNS]
+             for row in db_query.get_rows(chunked=True)),
+        )
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows), content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="database.csv"'
+
+    else:
+        response = JsonResponse({
+            'columns': DATABASE_COLUMNS,
+            'data': data,
+            'next': next_barcode,
+        })
+
+    return response
@@ -14,6 +14,7 @@ from rest_framework.permissions import IsAdminUser
 
 from xlwt import Workbook, XFStyle
 
+from common.cache import get_cached
 from common.utils import get_date_range
 from common.views import CsrfExemptSessionAuthentication
 
@@ -92,15 +93,17 @@ class RunStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         start = request.query_params.get('start', now)
         end = request.query_params.get('end', now)
         start, end = get_date_range(start, end, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'run-statistics', start, end, lambda: self.get_data(start, end)))
 
+    def get_data(self, start, end):
         queryset = self.filter_queryset(self.get_queryset()).filter(
             create_time__gte=start,
             create_time__lte=end,
         )
 
         serializer = self.get_serializer(queryset, many=True)
-        data = list(itertools.chain(*serializer.data))
-        return Response(data)
+        return list(itertools.chain(*serializer.data))
 
     @action(methods=['post'], detail=False)
     def upload(self, request):
@@ -228,15 +231,17 @@ class SequencesStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         start = request.query_params.get('start', now)
         end = request.query_params.get('end', now)
         start, end = get_date_range(start, end, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'sequences-statistics', start, end, lambda: self.get_data(start, end)))
 
+    def get_data(self, start, end):
         queryset = self.filter_queryset(self.get_queryset()).filter(
             create_time__gte=start,
             create_time__lte=end,
         )
 
         serializer = self.get_serializer(queryset, many=True)
-        data = list(itertools.chain(*serializer.data))
-        return Response(data)
+        return list(itertools.chain(*serializer.data))
 
     @action(methods=['post'], detail=False)
     def upload(self, request):
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from usage.models import DailyUsage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily usage buckets'
+
+    def handle(self, *args, **options):
+        DailyUsage.refresh()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully refreshed the usage buckets.'))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('common', '0001_initial'),
+        ('library_sample_shared', '0009_auto_20210126_1348'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Request Date')),
+                ('record_date', models.DateField(db_index=True, verbose_name='Record Date')),
+                ('libraries', models.PositiveIntegerField(default=0, verbose_name='Libraries')),
+                ('samples', models.PositiveIntegerField(default=0, verbose_name='Samples')),
+                ('library_protocol', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library_sample_shared.LibraryProtocol', verbose_name='Library Protocol')),
+                ('library_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library_sample_shared.LibraryType', verbose_name='Library Type')),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='common.Organization', verbose_name='Organization')),
+                ('pi', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='common.PrincipalInvestigator', verbose_name='Principal Investigator')),
+            ],
+            options={
+                'verbose_name': 'Daily Usage',
+                'verbose_name_plural': 'Daily Usage',
+            },
+        ),
+    ]
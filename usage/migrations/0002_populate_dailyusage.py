@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from usage.models import refresh_daily_usage
+
+
+def populate_daily_usage(apps, schema_editor):
+    """ Build the usage buckets of existing requests. """
+    refresh_daily_usage(apps.get_model('usage', 'DailyUsage'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_auto_20200227_1634'),
+        ('sample', '0003_auto_20200227_1634'),
+        ('request', '0001_initial'),
+        ('usage', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_daily_usage, migrations.RunPython.noop),
+    ]
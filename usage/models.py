@@ -0,0 +1,106 @@
+from django.db import models, transaction
+from django.db.models.functions import TruncDate
+
+from common.models import Organization, PrincipalInvestigator
+from library_sample_shared.models import LibraryType, LibraryProtocol
+
+
+def refresh_daily_usage(model, dates=None):
+    """
+    Rebuild the buckets of the requests created on given dates (all if
+    None). `model` is `DailyUsage`, or its historical version in a
+    migration.
+    """
+    dates = sorted(set(dates)) if dates is not None else None
+    if dates == []:
+        return
+
+    buckets = {}
+    for key, record_model in [
+        ('libraries', model._meta.apps.get_model('library', 'Library')),
+        ('samples', model._meta.apps.get_model('sample', 'Sample')),
+    ]:
+        records = record_model.objects.filter(request__isnull=False)
+        if dates is not None:
+            records = records.filter(request__create_time__date__in=dates)
+
+        for x in records.annotate(
+            request_date=TruncDate('request__create_time'),
+            create_date=TruncDate('create_time'),
+        ).values(
+            'request_date',
+            'create_date',
+            'request__user__organization',
+            'request__user__pi',
+            'library_type',
+            'library_protocol',
+        ).annotate(count=models.Count('pk')).order_by():
+            bucket = buckets.setdefault((
+                x['request_date'],
+                x['create_date'],
+                x['request__user__organization'],
+                x['request__user__pi'],
+                x['library_type'],
+                x['library_protocol'],
+            ), {'libraries': 0, 'samples': 0})
+            bucket[key] += x['count']
+
+    with transaction.atomic():
+        usage = model.objects.all()
+        if dates is not None:
+            usage = usage.filter(date__in=dates)
+        usage.delete()
+
+        model.objects.bulk_create([
+            model(
+                date=date,
+                record_date=record_date,
+                organization_id=organization_id,
+                pi_id=pi_id,
+                library_type_id=library_type_id,
+                library_protocol_id=library_protocol_id,
+                **counts
+            )
+            for (date, record_date, organization_id, pi_id,
+                 library_type_id, library_protocol_id), counts
+            in buckets.items()
+        ])
+
+
+class DailyUsage(models.Model):
+    """
+    Number of libraries and samples submitted per day, request user's
+    organization and PI, library type, and library protocol.
+
+    A bucket is keyed by both the request's and the records' create dates
+    because the records usage is filtered by the latter.
+    """
+    date = models.DateField('Request Date', db_index=True)
+    record_date = models.DateField('Record Date', db_index=True)
+    organization = models.ForeignKey(
+        Organization, verbose_name='Organization', related_name='+',
+        on_delete=models.SET_NULL, null=True, blank=True)
+    pi = models.ForeignKey(
+        PrincipalInvestigator, verbose_name='Principal Investigator',
+        related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    library_type = models.ForeignKey(
+        LibraryType, verbose_name='Library Type', related_name='+')
+    library_protocol = models.ForeignKey(
+        LibraryProtocol, verbose_name='Library Protocol', related_name='+')
+    libraries = models.PositiveIntegerField('Libraries', default=0)
+    samples = models.PositiveIntegerField('Samples', default=0)
+
+    class Meta:
+        verbose_name = 'Daily Usage'
+        verbose_name_plural = 'Daily Usage'
+
+    def __str__(self):
+        return f'{self.date}: {self.libraries} + {self.samples}'
+
+    @classmethod
+    def refresh(cls, dates=None):
+        """
+        Rebuild the buckets of the requests created on given dates
+        (all if None).
+        """
+        refresh_daily_usage(cls, dates)
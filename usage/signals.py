@@ -0,0 +1,126 @@
+from django.apps import apps
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete, m2m_changed,
+)
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .models import DailyUsage
+
+User = get_user_model()
+Request = apps.get_model('request', 'Request')
+Library = apps.get_model('library', 'Library')
+Sample = apps.get_model('sample', 'Sample')
+
+
+def is_changed(instance, fields):
+    """ Check if any of given fields of a saved object has been changed. """
+    if instance.pk is None:
+        return False
+    return not type(instance).objects.filter(pk=instance.pk, **{
+        field: getattr(instance, field) for field in fields
+    }).exists()
+
+
+def get_dates(requests):
+    """ Return the (local) create dates of given requests. """
+    return [
+        timezone.localtime(x).date() if timezone.is_aware(x) else x.date()
+        for x in requests.values_list('create_time', flat=True)
+    ]
+
+
+@receiver(post_save, sender=Request)
+def refresh_usage_request(sender, instance, **kwargs):
+    """ When a request is saved, rebuild the buckets of its date. """
+    DailyUsage.refresh(get_dates(Request.objects.filter(pk=instance.pk)))
+
+
+@receiver(m2m_changed, sender=Request.libraries.through)
+@receiver(m2m_changed, sender=Request.samples.through)
+def refresh_usage_request_records(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    """
+    When libraries or samples are added to or removed from a request,
+    rebuild the buckets of the request's date.
+    """
+    if action == 'pre_clear' and reverse:
+        instance._usage_dates = get_dates(instance.request.all())
+        return
+
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    if not reverse:
+        requests = Request.objects.filter(pk=instance.pk)
+    elif action == 'post_clear':
+        DailyUsage.refresh(getattr(instance, '_usage_dates', []))
+        return
+    else:
+        requests = Request.objects.filter(pk__in=pk_set)
+
+    DailyUsage.refresh(get_dates(requests))
+
+
+@receiver(pre_save, sender=Library)
+@receiver(pre_save, sender=Sample)
+@receiver(pre_save, sender=User)
+def store_usage_changed(sender, instance, update_fields, **kwargs):
+    """
+    Check if the fields the buckets are grouped by (a record's library
+    type and protocol, a user's organization and PI) are being changed.
+    New objects and saves of other fields only are skipped without
+    querying the database.
+    """
+    if sender is User:
+        fields = ['organization_id', 'pi_id']
+    else:
+        fields = ['library_type_id', 'library_protocol_id']
+
+    # update_fields may contain either the field names or the column names
+    names = set(fields) | {x[:-3] for x in fields}
+    if instance._state.adding or (
+            update_fields is not None and not names & update_fields):
+        instance._usage_changed = False
+        return
+
+    instance._usage_changed = is_changed(instance, fields)
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_save, sender=Sample)
+@receiver(post_save, sender=User)
+def refresh_usage_changed(sender, instance, **kwargs):
+    """
+    When a record's library type or protocol, or a user's organization or
+    PI is changed, rebuild the buckets of the affected requests' dates.
+    """
+    if not getattr(instance, '_usage_changed', False):
+        return
+
+    if sender is User:
+        requests = Request.objects.filter(user=instance)
+    else:
+        requests = instance.request.all()
+    DailyUsage.refresh(get_dates(requests))
+
+
+@receiver(pre_delete, sender=Request)
+@receiver(pre_delete, sender=Library)
+@receiver(pre_delete, sender=Sample)
+def store_usage_dates(sender, instance, **kwargs):
+    """ Remember the dates affected by the deletion of an object. """
+    if sender is Request:
+        requests = Request.objects.filter(pk=instance.pk)
+    else:
+        requests = instance.request.all()
+    instance._usage_dates = get_dates(requests)
+
+
+@receiver(post_delete, sender=Request)
+@receiver(post_delete, sender=Library)
+@receiver(post_delete, sender=Sample)
+def refresh_usage_deleted(sender, instance, **kwargs):
+    """ When an object is deleted, rebuild the buckets of its dates. """
+    DailyUsage.refresh(getattr(instance, '_usage_dates', []))
@@ -1,3 +1,148 @@
-from django.test import TestCase
+from importlib import import_module
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from common.models import Organization, PrincipalInvestigator
+from common.tests import BaseTestCase
+from common.utils import get_random_name
+from library.tests import create_library
+from sample.tests import create_sample
+from request.tests import create_request
+
+from .models import DailyUsage
+
+
+def get_totals():
+    totals = DailyUsage.objects.aggregate(
+        libraries=Sum('libraries'), samples=Sum('samples'))
+    return totals['libraries'], totals['samples']
+
+
+class TestDailyUsage(BaseTestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Org')
+        self.user = self.create_user()
+        self.user.organization = self.organization
+        self.user.save()
+
+        self.library = create_library(get_random_name())
+        self.sample = create_sample(get_random_name())
+        self.request = create_request(self.user)
+        self.request.libraries.add(self.library)
+        self.request.samples.add(self.sample)
+
+    def test_records_added(self):
+        usage = DailyUsage.objects.get(
+            library_type=self.library.library_type)
+        self.assertEqual(usage.date, timezone.localdate())
+        self.assertEqual(usage.organization, self.organization)
+        self.assertIsNone(usage.pi)
+        self.assertEqual((usage.libraries, usage.samples), (1, 0))
+        self.assertEqual(get_totals(), (1, 1))
+
+    def test_records_removed(self):
+        self.request.libraries.remove(self.library)
+        self.assertEqual(get_totals(), (0, 1))
+
+        self.sample.delete()
+        self.assertFalse(DailyUsage.objects.exists())
+
+    def test_user_changed(self):
+        pi = PrincipalInvestigator.objects.create(
+            name='PI', organization=self.organization)
+        self.user.pi = pi
+        self.user.save()
+        self.assertEqual(
+            set(DailyUsage.objects.values_list('pi', flat=True)), {pi.pk})
+
+    def test_unrelated_fields_saved(self):
+        # Saving other fields doesn't look up the previous values
+        with CaptureQueriesContext(connection) as context:
+            self.user.save(update_fields=['last_login'])
+            self.library.save(update_fields=['name'])
+        self.assertFalse([
+            x for x in context.captured_queries
+            if x['sql'].startswith('SELECT')
+        ])
+
+    def test_request_deleted(self):
+        self.request.delete()
+        self.assertFalse(DailyUsage.objects.exists())
+
+    def test_full_refresh(self):
+        DailyUsage.objects.all().delete()
+        DailyUsage.refresh()
+        self.assertEqual(get_totals(), (1, 1))
+
+    def test_migration(self):
+        DailyUsage.objects.all().delete()
+
+        migration = import_module('usage.migrations.0002_populate_dailyusage')
+        state = MigrationLoader(connection).project_state(
+            ('usage', '0002_populate_dailyusage'))
+        migration.populate_daily_usage(state.apps, None)
+        self.assertEqual(get_totals(), (1, 1))
+
+
+# Views
+
+class TestUsage(BaseTestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name='Org')
+        pi = PrincipalInvestigator.objects.create(
+            name='PI', organization=organization)
+        user = self.create_user()
+        user.organization = organization
+        user.pi = pi
+        user.save()
+        self.login()
+
+        self.library = create_library(get_random_name())
+        request = create_request(user)
+        request.libraries.add(self.library, create_library(get_random_name()))
+        request.samples.add(create_sample(get_random_name()))
+
+    def get(self, url, start=None, end=None):
+        today = date.today()
+        start, end = start or today, end or today
+        return self.client.get(url, {
+            'start': start.strftime('%Y-%m-%dT00:00:00'),
+            'end': end.strftime('%Y-%m-%dT00:00:00'),
+        }).json()
+
+    def test_records_usage(self):
+        self.assertEqual(self.get('/api/usage/records/'), [
+            {'name': 'Libraries', 'data': 2},
+            {'name': 'Samples', 'data': 1},
+        ])
+
+    def test_organizations_usage(self):
+        self.assertEqual(self.get('/api/usage/organizations/'), [
+            {'name': 'Org', 'data': 3},
+        ])
+
+    def test_principal_investigators_usage(self):
+        self.assertEqual(self.get('/api/usage/principal_investigators/'), [
+            {'name': 'PI', 'data': 3, 'libraries': 2, 'samples': 1},
+        ])
+
+    def test_library_types_usage(self):
+        data = self.get('/api/usage/library_types/')
+        self.assertEqual(sum(x['data'] for x in data), 3)
+        self.assertIn(self.library.library_type.name,
+                      [x['name'] for x in data])
+
+    def test_empty_range(self):
+        tomorrow = date.today() + timedelta(days=1)
+        self.assertEqual(
+            self.get('/api/usage/records/', tomorrow, tomorrow), [
+                {'name': 'Libraries', 'data': 0},
+                {'name': 'Samples', 'data': 0},
+            ])
+        self.assertEqual(
+            self.get('/api/usage/organizations/', tomorrow, tomorrow), [])
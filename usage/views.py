@@ -1,17 +1,14 @@
 from datetime import datetime
-from collections import Counter
 
-from django.apps import apps
-from django.db.models import Prefetch
+from django.db.models import Sum
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 
-Request = apps.get_model('request', 'Request')
-LibraryType = apps.get_model('library_sample_shared', 'LibraryType')
-Library = apps.get_model('library', 'Library')
-Sample = apps.get_model('sample', 'Sample')
+from common.cache import get_cached
+
+from .models import DailyUsage
 
 
 def get_date_range(request, format):
@@ -25,7 +22,7 @@ def get_date_range(request, format):
     except ValueError:
         start = now
     finally:
-        start = start.replace(hour=0, minute=0)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
 
     try:
         end = datetime.strptime(end, format) \
@@ -33,42 +30,64 @@ def get_date_range(request, format):
     except ValueError:
         end = now
     finally:
-        end = end.replace(hour=23, minute=59)
+        end = end.replace(hour=23, minute=59, second=59, microsecond=0)
 
     if start > end:
-        start = end.replace(hour=0, minute=0)
+        start = end.replace(hour=0, minute=0, second=0)
 
     return (start, end)
 
 
+def get_counts(start, end, group, date_field='date'):
+    """
+    Sum the numbers of libraries and samples of the daily buckets within
+    a given date range by a given field.
+    """
+    usage = DailyUsage.objects.filter(**{
+        f'{date_field}__gte': start.date(),
+        f'{date_field}__lte': end.date(),
+    })
+
+    if group is None:
+        return usage.aggregate(libraries=Sum('libraries'),
+                               samples=Sum('samples'))
+
+    counts = {}
+    for x in usage.values(group).annotate(
+        libraries=Sum('libraries'), samples=Sum('samples'),
+    ).order_by():
+        name = x[group] if x[group] else 'None'
+        if name not in counts:
+            counts[name] = {'libraries': 0, 'samples': 0}
+        counts[name]['libraries'] += x['libraries']
+        counts[name]['samples'] += x['samples']
+
+    return counts
+
+
 class RecordsUsage(APIView):
     permission_classes = (IsAdminUser,)
 
     def get(self, request):
         start, end = get_date_range(request, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'usage-records', start, end,
+            lambda: self.get_data(start, end),
+        ))
 
-        libraries = Library.objects.filter(
-            request__isnull=False,
-            create_time__gte=start,
-            create_time__lte=end,
-        ).only('id')
-
-        samples = Sample.objects.filter(
-            request__isnull=False,
-            create_time__gte=start,
-            create_time__lte=end,
-        ).only('id')
+    def get_data(self, start, end):
+        counts = get_counts(start, end, None, 'record_date')
 
-        return Response([
+        return [
             {
                 'name': 'Libraries',
-                'data': len(libraries),
+                'data': counts['libraries'] or 0,
             },
             {
                 'name': 'Samples',
-                'data': len(samples),
+                'data': counts['samples'] or 0,
             },
-        ])
+        ]
 
 
 class OrganizationsUsage(APIView):
@@ -76,35 +95,20 @@ class OrganizationsUsage(APIView):
 
     def get(self, request):
         start, end = get_date_range(request, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'usage-organizations', start, end,
+            lambda: self.get_data(start, end),
+        ))
 
-        libraries_qs = Library.objects.only('id')
-        samples_qs = Sample.objects.only('id')
-
-        requests = Request.objects.select_related(
-            'user', 'user__organization',
-        ).prefetch_related(
-            Prefetch('libraries', queryset=libraries_qs,
-                     to_attr='fetched_libraries'),
-            Prefetch('samples', queryset=samples_qs,
-                     to_attr='fetched_samples'),
-        ).filter(create_time__gte=start, create_time__lte=end) \
-            .only('id', 'user', 'libraries', 'samples')
-
-        counts = {}
-        for req in requests:
-            organization = req.user.organization
-            org_name = organization.name if organization else 'None'
-            if org_name not in counts.keys():
-                counts[org_name] = {'libraries': 0, 'samples': 0}
-            counts[org_name]['libraries'] += len(req.fetched_libraries)
-            counts[org_name]['samples'] += len(req.fetched_samples)
+    def get_data(self, start, end):
+        counts = get_counts(start, end, 'organization__name')
 
         data = [{
             'name': organization,
             'data': sum(count.values())
         } for organization, count in counts.items()]
 
-        return Response(data)
+        return data
 
 
 class PrincipalInvestigatorsUsage(APIView):
@@ -112,28 +116,13 @@ class PrincipalInvestigatorsUsage(APIView):
 
     def get(self, request):
         start, end = get_date_range(request, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'usage-principal-investigators', start, end,
+            lambda: self.get_data(start, end),
+        ))
 
-        libraries_qs = Library.objects.only('id')
-        samples_qs = Sample.objects.only('id')
-
-        requests = Request.objects.select_related(
-            'user', 'user__pi',
-        ).prefetch_related(
-            Prefetch('libraries', queryset=libraries_qs,
-                     to_attr='fetched_libraries'),
-            Prefetch('samples', queryset=samples_qs,
-                     to_attr='fetched_samples'),
-        ).filter(create_time__gte=start, create_time__lte=end) \
-            .only('id', 'user__pi__name', 'libraries', 'samples')
-
-        counts = {}
-        for req in requests:
-            pi = req.user.pi
-            pi_name = pi.name if pi else 'None'
-            if pi_name not in counts.keys():
-                counts[pi_name] = {'libraries': 0, 'samples': 0}
-            counts[pi_name]['libraries'] += len(req.fetched_libraries)
-            counts[pi_name]['samples'] += len(req.fetched_samples)
+    def get_data(self, start, end):
+        counts = get_counts(start, end, 'pi__name')
 
         data = [{
             'name': pi,
@@ -143,7 +132,7 @@ class PrincipalInvestigatorsUsage(APIView):
         } for pi, count in counts.items()]
 
         data = sorted(data, key=lambda x: x['name'])
-        return Response(data)
+        return data
 
 
 class LibraryTypesUsage(APIView):
@@ -151,46 +140,13 @@ class LibraryTypesUsage(APIView):
 
     def get(self, request):
         start, end = get_date_range(request, '%Y-%m-%dT%H:%M:%S')
+        return Response(get_cached(
+            'usage-library-types', start, end,
+            lambda: self.get_data(start, end),
+        ))
 
-        libraries_qs = Library.objects.select_related(
-            'library_type').only('id', 'library_type__name')
-        samples_qs = Sample.objects.select_related(
-            'library_type').only('id', 'library_type__name')
-
-        requests = Request.objects.prefetch_related(
-            Prefetch('libraries', queryset=libraries_qs,
-                     to_attr='fetched_libraries'),
-            Prefetch('samples', queryset=samples_qs,
-                     to_attr='fetched_samples'),
-        ).filter(create_time__gte=start, create_time__lte=end) \
-            .only('id', 'libraries', 'samples')
-
-        counts = {}
-        for req in requests:
-            # Extract Library Types
-            library_types = [
-                x.library_type.name for x in req.fetched_libraries]
-            sample_types = [
-                x.library_type.name for x in req.fetched_samples]
-
-            # Merge the counts
-            library_cnt = {x[0]: {'libraries': x[1]}
-                           for x in Counter(library_types).items()}
-            sample_cnt = {x[0]: {'samples': x[1]}
-                          for x in Counter(sample_types).items()}
-            count = {
-                k: {
-                    **library_cnt.get(k, {'libraries': 0}),
-                    **sample_cnt.get(k, {'samples': 0}),
-                }
-                for k in library_cnt.keys() | sample_cnt.keys()
-            }
-
-            for k, v in count.items():
-                temp_dict = counts.get(k, {'libraries': 0, 'samples': 0})
-                temp_dict['libraries'] += v['libraries']
-                temp_dict['samples'] += v['samples']
-                counts[k] = temp_dict
+    def get_data(self, start, end):
+        counts = get_counts(start, end, 'library_type__name')
 
         data = [{
             'name': library_type,
@@ -200,4 +156,4 @@ class LibraryTypesUsage(APIView):
         } for library_type, count in counts.items()]
 
         data = sorted(data, key=lambda x: x['name'])
-        return Response(data)
+        return data
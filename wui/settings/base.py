@@ -1,4 +1,5 @@
 import os
+import tempfile
 import dj_database_url
 
 
@@ -96,6 +97,30 @@ WSGI_APPLICATION = 'wui.wsgi.application'
 DATABASES = {'default': dj_database_url.config()}
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+# The results of the dashboards (report, usage, statistics) are shared
+# between the worker processes and invalidated by a generation counter
+# (see common.cache)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'RESULTS_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'parkour_cache'),
+        ),
+        'TIMEOUT': 24 * 60 * 60,  # 1 day
+    },
+}
+
+# The tests use process-local caches (see common.test_runner)
+TEST_RUNNER = 'common.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -233,6 +258,11 @@ SETUP_ADMIN_PASSWORD = os.environ.get('SETUP_ADMIN_PASSWORD', None)
 
 
 
+# Index Generator
+# Number of processes used to generate indices for multiple pools at once
+INDEX_GENERATOR_WORKERS = int(os.environ.get('INDEX_GENERATOR_WORKERS', 4))
+
+
 # OBSOLETE/NON-OBSOLETE STATUS
 NON_OBSOLETE = 1
 OBSOLETE = 2